@@ -1,32 +1,83 @@
-import requests
+import asyncio
+import httpx
 import json
 import os
 import html
 import hashlib
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List, Tuple, Callable, Awaitable
 from cachetools import TTLCache
 from app.logger import setup_logger
 from app.config import OLLAMA_URL, MODELO, SYSTEM_INSTRUCTIONS
+from app.components.ai.disk_cache import DiskPromptCache
+from app.components.ai.scheduler import llm_scheduler, ColaLLMLlena
 
 logger = setup_logger("ai_client")
 
 # Timeout para requests desde variable de entorno
 OLLAMA_TIMEOUT = int(os.getenv("OLLAMA_TIMEOUT", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+
+# Límites del pool de conexiones (la concurrencia la fija llm_scheduler)
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "10"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "30"))
+
+# ============================================
+# HTTP CLIENTS (keep-alive)
+# ============================================
+
+# Cliente asíncrono compartido; se crea perezosamente dentro del event loop
+_async_client: Optional[httpx.AsyncClient] = None
 
 # ============================================
 # AI RESPONSE CACHE
 # ============================================
 
-# Cache with 200 entries, 1 hour TTL (3600 seconds)
+# L1: Cache with 200 entries, 1 hour TTL (3600 seconds)
 # Stores up to 200 AI responses, each expires after 1 hour
 _prompt_cache = TTLCache(maxsize=200, ttl=3600)
 
-# Cache statistics
+# L2: persistent SQLite store below the TTLCache (survives restarts)
+AI_CACHE_DISK_ENABLED = os.getenv("AI_CACHE_DISK_ENABLED", "True") == "True"
+AI_CACHE_DISK_PATH = os.getenv("AI_CACHE_DISK_PATH", "ai_cache.db")
+AI_CACHE_DISK_MAX_MB = int(os.getenv("AI_CACHE_DISK_MAX_MB", "64"))
+AI_CACHE_DISK_TTL = int(os.getenv("AI_CACHE_DISK_TTL", str(7 * 24 * 3600)))
+
+_disk_cache: Optional[DiskPromptCache] = None
+if AI_CACHE_DISK_ENABLED:
+    try:
+        _disk_cache = DiskPromptCache(
+            AI_CACHE_DISK_PATH,
+            max_bytes=AI_CACHE_DISK_MAX_MB * 1024 * 1024,
+            default_ttl=AI_CACHE_DISK_TTL,
+        )
+    except Exception as e:
+        logger.warning(f"Caché L2 deshabilitada, no se pudo abrir {AI_CACHE_DISK_PATH}: {e}")
+
+# Reutilización del KV-cache de Ollama: prefijos compartidos evaluados una vez
+OLLAMA_KV_REUSE = os.getenv("OLLAMA_KV_REUSE", "True") == "True"
+
+# Métricas de evaluación de prompt (tokens y tiempo que Ollama gasta leyendo el prompt)
+_kv_stats = {
+    "calls": 0,
+    "calls_with_context": 0,
+    "prompt_eval_tokens": 0,
+    "prompt_eval_ms": 0.0,
+    "reused_tokens": 0,
+    "prefixes_evaluated": 0
+}
+
+# Generaciones en curso por cache_key (single-flight)
+_inflight: Dict[str, asyncio.Future] = {}
+
+# Cache statistics (hits = served from any tier)
 _cache_stats = {
     "hits": 0,
     "misses": 0,
     "bypassed": 0,
-    "evictions": 0
+    "evictions": 0,
+    "l1_hits": 0,
+    "l2_hits": 0,
+    "coalesced": 0
 }
 
 
@@ -69,6 +120,9 @@ def clear_prompt_cache():
     entries_cleared = len(_prompt_cache)
     _prompt_cache.clear()
     
+    if _disk_cache is not None:
+        entries_cleared += _disk_cache.clear()
+    
     logger.info(f"Prompt cache cleared: {entries_cleared} entries removed")
     
     # Reset stats
@@ -76,7 +130,10 @@ def clear_prompt_cache():
         "hits": 0,
         "misses": 0,
         "bypassed": 0,
-        "evictions": 0
+        "evictions": 0,
+        "l1_hits": 0,
+        "l2_hits": 0,
+        "coalesced": 0
     }
 
 
@@ -84,6 +141,9 @@ def get_cache_stats() -> Dict[str, Any]:
     """
     Get cache performance statistics.
     
+    Reads the L2 entry count from SQLite: from async code call it through
+    asyncio.to_thread.
+    
     Returns:
         Dict with:
             - size: Current number of cached entries
@@ -92,10 +152,26 @@ def get_cache_stats() -> Dict[str, Any]:
             - hits: Number of cache hits
             - misses: Number of cache misses
             - bypassed: Number of times cache was intentionally bypassed
+            - coalesced: Misses that awaited an identical in-flight request
+                         instead of calling Ollama again
             - hit_rate: Percentage of requests served from cache
+            - tiers: Per-tier stats (l1 = memory TTLCache, l2 = SQLite on disk)
     """
     total_requests = _cache_stats["hits"] + _cache_stats["misses"]
     hit_rate = (_cache_stats["hits"] / total_requests * 100) if total_requests > 0 else 0
+    l1_hit_rate = (_cache_stats["l1_hits"] / total_requests * 100) if total_requests > 0 else 0
+    
+    tiers = {
+        "l1": {
+            "size": len(_prompt_cache),
+            "maxsize": _prompt_cache.maxsize,
+            "ttl_seconds": _prompt_cache.ttl,
+            "hits": _cache_stats["l1_hits"],
+            "misses": total_requests - _cache_stats["l1_hits"],
+            "hit_rate_percent": round(l1_hit_rate, 2)
+        },
+        "l2": _disk_cache.stats() if _disk_cache is not None else {"enabled": False}
+    }
     
     return {
         "size": len(_prompt_cache),
@@ -105,11 +181,56 @@ def get_cache_stats() -> Dict[str, Any]:
         "misses": _cache_stats["misses"],
         "bypassed": _cache_stats["bypassed"],
         "evictions": _cache_stats["evictions"],
+        "coalesced": _cache_stats["coalesced"],
         "hit_rate_percent": round(hit_rate, 2),
-        "total_requests": total_requests
+        "total_requests": total_requests,
+        "tiers": tiers
     }
 
 
+def get_kv_stats() -> Dict[str, Any]:
+    """
+    Métricas de reutilización de contexto (KV-cache) de Ollama.
+    
+    Returns:
+        Dict con:
+            - calls / calls_with_context: llamadas totales y las que enviaron `context`
+            - prompt_eval_tokens / prompt_eval_ms: tokens de prompt evaluados y su tiempo
+            - ms_per_token: costo medio de evaluar un token de prompt
+            - reused_tokens: tokens de prefijo que no hubo que re-evaluar
+            - estimated_saved_ms: reused_tokens * ms_per_token
+            - prefixes_evaluated: prefijos compartidos evaluados (uno por aventura)
+    """
+    tokens = _kv_stats["prompt_eval_tokens"]
+    ms_per_token = _kv_stats["prompt_eval_ms"] / tokens if tokens else 0
+    
+    return {
+        "enabled": OLLAMA_KV_REUSE,
+        "calls": _kv_stats["calls"],
+        "calls_with_context": _kv_stats["calls_with_context"],
+        "prefixes_evaluated": _kv_stats["prefixes_evaluated"],
+        "prompt_eval_tokens": tokens,
+        "prompt_eval_ms": round(_kv_stats["prompt_eval_ms"], 1),
+        "ms_per_token": round(ms_per_token, 3),
+        "reused_tokens": _kv_stats["reused_tokens"],
+        "estimated_saved_ms": round(_kv_stats["reused_tokens"] * ms_per_token, 1)
+    }
+
+
+def _registrar_eval(meta: Dict[str, Any], context_enviado: Optional[List[int]]):
+    """Acumula prompt_eval_count/duration de una respuesta de Ollama."""
+    evaluados = meta.get("prompt_eval_count") or 0
+    _kv_stats["calls"] += 1
+    _kv_stats["prompt_eval_tokens"] += evaluados
+    _kv_stats["prompt_eval_ms"] += (meta.get("prompt_eval_duration") or 0) / 1e6
+    
+    if context_enviado:
+        _kv_stats["calls_with_context"] += 1
+        # Si Ollama evaluó menos tokens que el contexto enviado, el prefijo salió del KV-cache
+        if evaluados < len(context_enviado):
+            _kv_stats["reused_tokens"] += len(context_enviado)
+
+
 def sanitizar_texto(texto: str) -> str:
     """Escapa caracteres HTML peligrosos"""
     try:
@@ -121,6 +242,114 @@ def sanitizar_texto(texto: str) -> str:
         return ""
 
 
+def _construir_prompt(task_prompt: str, json_mode: bool, contexto: str) -> str:
+    """Arma el prompt completo (instrucciones de sistema + contexto + tarea)."""
+    full_prompt = f"{SYSTEM_INSTRUCTIONS}"
+    
+    if contexto:
+        full_prompt += f"\n\nCONTEXTO PREVIO:\n{contexto}"
+        
+    full_prompt += f"\n\nTAREA:\n{task_prompt}"
+    if json_mode:
+        full_prompt += "\n\nFORMATO: JSON válido ÚNICAMENTE."
+    
+    return full_prompt
+
+
+def _parsear_respuesta(text: str, json_mode: bool) -> Optional[Any]:
+    """
+    Convierte el texto devuelto por Ollama en el resultado final.
+    
+    Returns:
+        dict si json_mode, str si no, o None si el JSON no es válido
+    """
+    if not json_mode:
+        return text
+    
+    try:
+        start = text.find('{')
+        end = text.rfind('}') + 1
+        
+        if start != -1 and end > start:
+            parsed = json.loads(text[start:end])
+        else:
+            parsed = json.loads(text)
+        
+        logger.info("✓ JSON parseado exitosamente")
+        return parsed
+        
+    except json.JSONDecodeError as e:
+        logger.error(f"Error parseando JSON de IA: {e}")
+        logger.debug(f"Texto recibido: {text[:500]}")
+        return None
+
+
+def _consultar_l1(task_prompt: str, json_mode: bool, contexto: str, use_cache: bool) -> tuple:
+    """
+    Busca la respuesta en la caché en memoria (L1).
+    
+    Returns:
+        (cache_key, valor) — valor es None si no hubo HIT en L1
+    """
+    if not use_cache:
+        _cache_stats["bypassed"] += 1
+        return None, None
+    
+    cache_key = _get_cache_key(task_prompt, json_mode, contexto)
+    
+    if cache_key in _prompt_cache:
+        _cache_stats["hits"] += 1
+        _cache_stats["l1_hits"] += 1
+        logger.info(
+            f"✓ Cache HIT L1 ({_cache_stats['hits']} total) - "
+            f"Prompt: {task_prompt[:60]}..."
+        )
+        return cache_key, _prompt_cache[cache_key]
+    
+    return cache_key, None
+
+
+def _registrar_l2(cache_key: str, value: Optional[Any], task_prompt: str) -> Optional[Any]:
+    """Contabiliza el resultado de la búsqueda en L2 y promueve el HIT a L1."""
+    if value is None:
+        _cache_stats["misses"] += 1
+        return None
+    
+    _cache_stats["hits"] += 1
+    _cache_stats["l2_hits"] += 1
+    _prompt_cache[cache_key] = value
+    logger.info(
+        f"✓ Cache HIT L2 ({_cache_stats['hits']} total) - "
+        f"Prompt: {task_prompt[:60]}..."
+    )
+    return value
+
+
+async def _consultar_cache_async(task_prompt: str, json_mode: bool, contexto: str, use_cache: bool) -> tuple:
+    """
+    Busca la respuesta en L1 y luego en L2 (disco, fuera del event loop),
+    actualizando estadísticas.
+    
+    Returns:
+        (cache_key, valor) — valor es None si no hubo HIT
+    """
+    cache_key, value = _consultar_l1(task_prompt, json_mode, contexto, use_cache)
+    if cache_key is None or value is not None:
+        return cache_key, value
+    
+    disk_value = await asyncio.to_thread(_disk_cache.get, cache_key) if _disk_cache is not None else None
+    return cache_key, _registrar_l2(cache_key, disk_value, task_prompt)
+
+
+def _guardar_en_l2(cache_key: str, value: Any):
+    """Persiste el resultado en la caché de disco (errores no son fatales)."""
+    if _disk_cache is not None:
+        try:
+            _disk_cache.set(cache_key, value)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar en caché L2: {e}")
+
+
 def generar_con_ia(
     task_prompt: str, 
     json_mode: bool = True, 
@@ -128,7 +357,11 @@ def generar_con_ia(
     use_cache: bool = True
 ) -> Optional[Any]:
     """
-    Genera contenido usando Ollama/LLM con soporte de caché.
+    Versión síncrona de generar_con_ia_async, para scripts sin event loop.
+    
+    Corre la versión async en un loop propio, así que pasa por la misma caché
+    y por llm_scheduler (límite de concurrencia y prioridades). Desde código
+    async usar generar_con_ia_async.
     
     Args:
         task_prompt: Prompt principal de la tarea
@@ -139,123 +372,345 @@ def generar_con_ia(
     
     Returns:
         Respuesta parseada (dict si JSON, str si texto) o None si error
+    
+    Raises:
+        RuntimeError: si se llama con un event loop corriendo en este hilo
+        ColaLLMLlena: si la cola del planificador está llena
     """
-    global _cache_stats
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        raise RuntimeError("generar_con_ia bloquearía el event loop: usar await generar_con_ia_async")
+    
+    async def _generar():
+        try:
+            return await generar_con_ia_async(task_prompt, json_mode, contexto, use_cache)
+        finally:
+            # El cliente httpx queda ligado a este loop, que se cierra al volver
+            await cerrar_cliente_async()
     
-    # Check cache if enabled
-    if use_cache:
-        cache_key = _get_cache_key(task_prompt, json_mode, contexto)
+    return asyncio.run(_generar())
+
+
+# ============================================
+# CLIENTE ASÍNCRONO
+# ============================================
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Retorna el cliente httpx compartido (pool keep-alive), creándolo si hace falta."""
+    global _async_client
+    
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=OLLAMA_POOL_SIZE,
+                max_keepalive_connections=OLLAMA_POOL_SIZE,
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+            ),
+        )
+        logger.info(
+            f"Cliente async de Ollama creado (pool={OLLAMA_POOL_SIZE}, "
+            f"concurrencia={llm_scheduler.max_concurrency})"
+        )
+    
+    return _async_client
+
+
+async def cerrar_cliente_async():
+    """Cierra el pool de conexiones async (llamar al apagar el servidor)."""
+    global _async_client
+    
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+        logger.info("Cliente async de Ollama cerrado")
+    _async_client = None
+
+
+async def llamar_ollama_async(
+    full_prompt: str,
+    json_mode: bool = False,
+    timeout: Optional[float] = None,
+    on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
+) -> str:
+    """
+    Envía un prompt ya armado a Ollama sin bloquear el event loop.
+    
+    Pasa por llm_scheduler: respeta el límite de concurrencia y, si está
+    lleno, espera turno según la prioridad del contexto (ver contexto_llm).
+    
+    Args:
+        full_prompt: Prompt completo a enviar
+        json_mode: Si True, pide formato JSON a Ollama
+        timeout: Timeout de esta llamada en segundos (default OLLAMA_TIMEOUT)
+        on_chunk: Si se indica, se usa streaming y se invoca con cada
+                  fragmento de texto a medida que Ollama lo produce
+    
+    Returns:
+        Texto crudo completo de la respuesta
+    
+    Raises:
+        httpx.TimeoutException, httpx.HTTPError, ColaLLMLlena
+    """
+    text, _meta = await _llamar_ollama(full_prompt, json_mode=json_mode, timeout=timeout, on_chunk=on_chunk)
+    return text
+
+
+async def _llamar_ollama(
+    full_prompt: str,
+    json_mode: bool = False,
+    timeout: Optional[float] = None,
+    on_chunk: Optional[Callable[[str], Awaitable[None]]] = None,
+    context: Optional[List[int]] = None,
+    options: Optional[Dict[str, Any]] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Igual que llamar_ollama_async, pero acepta el `context` de una llamada
+    previa y retorna también los metadatos finales de Ollama
+    (context, prompt_eval_count, prompt_eval_duration, eval_count).
+    """
+    client = _get_async_client()
+    call_timeout = httpx.Timeout(timeout or OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)
+    payload = {
+        "model": MODELO,
+        "prompt": full_prompt,
+        "format": "json" if json_mode else "",
+        "stream": on_chunk is not None
+    }
+    if context:
+        payload["context"] = context
+    if options:
+        payload["options"] = options
+    
+    async with llm_scheduler.slot():
+        if on_chunk is None:
+            response = await client.post(OLLAMA_URL, json=payload, timeout=call_timeout)
+            response.raise_for_status()
+            meta = response.json()
+            _registrar_eval(meta, context)
+            return meta.get('response', ''), meta
+        
+        partes = []
+        meta: Dict[str, Any] = {}
+        async with client.stream("POST", OLLAMA_URL, json=payload, timeout=call_timeout) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                delta = data.get('response', '')
+                if delta:
+                    partes.append(delta)
+                    await on_chunk(delta)
+                if data.get('done'):
+                    meta = data
+                    break
         
-        if cache_key in _prompt_cache:
-            _cache_stats["hits"] += 1
-            cached_value = _prompt_cache[cache_key]
+        _registrar_eval(meta, context)
+        return "".join(partes), meta
+
+
+class ConversacionLLM:
+    """
+    Prefijo de prompt compartido por varias llamadas (p. ej. las escenas de una aventura).
+    
+    La primera llamada evalúa SYSTEM_INSTRUCTIONS + prefijo una sola vez y guarda
+    el `context` que devuelve Ollama; las siguientes envían ese contexto y solo
+    su propia tarea, así Ollama reutiliza el KV-cache del prefijo en vez de
+    re-evaluarlo. Si no hay contexto (Ollama sin soporte, error o OLLAMA_KV_REUSE
+    desactivado) cada llamada envía el prompt completo con el mismo prefijo.
+    """
+    
+    def __init__(self, prefijo: str):
+        self.prefijo = prefijo
+        self.huella = hashlib.sha256(f"{SYSTEM_INSTRUCTIONS}|{prefijo}|{MODELO}".encode("utf-8")).hexdigest()[:16]
+        self.context: Optional[List[int]] = None
+        self._preparada = False
+        self._lock = asyncio.Lock()
+    
+    async def preparar(self, timeout: Optional[float] = None):
+        """Evalúa el prefijo (una vez) y guarda el contexto resultante."""
+        if self.context is not None or not OLLAMA_KV_REUSE:
+            return
+        
+        # Las llamadas concurrentes esperan aquí a que termine la primera evaluación
+        async with self._lock:
+            if self._preparada:
+                return
             
-            logger.info(
-                f"✓ Cache HIT ({_cache_stats['hits']} total) - "
-                f"Prompt: {task_prompt[:60]}..."
-            )
-            # logger.debug(f"Cache stats: {get_cache_stats()}")
+            # Si falla o se cancela, la siguiente llamada lo vuelve a intentar
+            full_prompt = f"{SYSTEM_INSTRUCTIONS}\n\n{self.prefijo}\n\nResponde solo: OK"
+            try:
+                _text, meta = await _llamar_ollama(full_prompt, timeout=timeout, options={"num_predict": 1})
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"No se pudo evaluar el prefijo compartido, se usará el prompt completo: {e}")
+                return
             
-            return cached_value
-        else:
-            _cache_stats["misses"] += 1
-            # logger.debug(
-            #     f"Cache MISS ({_cache_stats['misses']} total) - "
-            #     f"Prompt: {task_prompt[:60]}..."
-            # )
-    else:
-        _cache_stats["bypassed"] += 1
-        # logger.debug(
-        #     f"Cache BYPASSED (use_cache=False) - "
-        #     f"Prompt: {task_prompt[:60]}..."
-        # )
+            self.context = meta.get("context") or None
+            if self.context:
+                self._preparada = True
+                _kv_stats["prefixes_evaluated"] += 1
+                logger.info(f"🧠 Prefijo compartido evaluado ({len(self.context)} tokens, huella {self.huella})")
     
-    # Build full prompt (existing logic)
-    full_prompt = f"{SYSTEM_INSTRUCTIONS}"
-    
-    if contexto:
-        full_prompt += f"\n\nCONTEXTO PREVIO:\n{contexto}"
+    def construir_prompt(self, task_prompt: str, json_mode: bool, contexto: str) -> str:
+        """Prompt a enviar: solo la tarea si hay contexto, o prefijo + tarea si no."""
+        if self.context:
+            full_prompt = ""
+            if contexto:
+                full_prompt += f"CONTEXTO PREVIO:\n{contexto}\n\n"
+            full_prompt += f"TAREA:\n{task_prompt}"
+            if json_mode:
+                full_prompt += "\n\nFORMATO: JSON válido ÚNICAMENTE."
+            return full_prompt
         
-    full_prompt += f"\n\nTAREA:\n{task_prompt}"
-    if json_mode:
-        full_prompt += "\n\nFORMATO: JSON válido ÚNICAMENTE."
+        return _construir_prompt(f"{self.prefijo}\n\n{task_prompt}", json_mode, contexto)
+
+
+async def generar_con_ia_async(
+    task_prompt: str,
+    json_mode: bool = True,
+    contexto: str = "",
+    use_cache: bool = True,
+    timeout: Optional[float] = None,
+    on_chunk: Optional[Callable[[str], Awaitable[None]]] = None,
+    conversacion: Optional[ConversacionLLM] = None
+) -> Optional[Any]:
+    """
+    Versión asíncrona de generar_con_ia (misma caché y mismo formato de salida).
     
-    logger.info(f"Generando contenido con IA (JSON={json_mode}, cached={use_cache})")
-    # logger.debug(f"Prompt: {task_prompt[:100]}...")
+    Si ya hay una generación en curso con la misma clave de caché, la llamada
+    espera ese resultado en lugar de enviar un prompt duplicado a Ollama. Si
+    esa generación falla, quien espera recibe la misma excepción; si se
+    cancela, quien espera vuelve a intentarlo por su cuenta.
     
-    try:
-        response = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": MODELO,
-                "prompt": full_prompt,
-                "format": "json" if json_mode else "",
-                "stream": False
-            },
-            timeout=OLLAMA_TIMEOUT
+    Args:
+        task_prompt: Prompt principal de la tarea
+        json_mode: Si True, espera respuesta en formato JSON
+        contexto: Contexto adicional previo
+        use_cache: Si True, usa caché para evitar llamadas duplicadas
+        timeout: Timeout de esta llamada en segundos (default OLLAMA_TIMEOUT)
+        on_chunk: Callback async para recibir el texto en streaming.
+                  El parseo JSON y el guardado en caché se hacen al final.
+        conversacion: Prefijo compartido (ConversacionLLM). La tarea se envía
+                      sobre el contexto ya evaluado del prefijo; la clave de
+                      caché incluye la huella del prefijo.
+    
+    Returns:
+        Respuesta parseada (dict si JSON, str si texto) o None si error
+    
+    Raises:
+        ColaLLMLlena: si la cola del planificador está llena
+    """
+    contexto_clave = f"{contexto}|conv:{conversacion.huella}" if conversacion else contexto
+    cache_key, cached_value = await _consultar_cache_async(task_prompt, json_mode, contexto_clave, use_cache)
+    if cached_value is not None:
+        await _entregar_completo(cached_value, on_chunk)
+        return cached_value
+    
+    if cache_key is None:
+        return await _generar_sin_cache(task_prompt, json_mode, contexto, None, timeout, on_chunk, conversacion)
+    
+    # Single-flight: esperar al primer llamador si el mismo prompt ya está en vuelo
+    inflight = _inflight.get(cache_key)
+    if inflight is not None:
+        _cache_stats["coalesced"] += 1
+        logger.info(
+            f"⧗ Prompt en vuelo, esperando resultado compartido ({_cache_stats['coalesced']} total) - "
+            f"Prompt: {task_prompt[:60]}..."
         )
-        response.raise_for_status()
-        
-        data = response.json()
-        text = data.get('response', '')
+        try:
+            result = await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            if not inflight.cancelled():
+                raise  # Cancelaron a este llamador, no al primero
+            # El primer llamador se canceló: generar por cuenta propia
+            logger.info(f"↻ Prompt en vuelo cancelado, reintentando - Prompt: {task_prompt[:60]}...")
+            return await generar_con_ia_async(task_prompt, json_mode, contexto, use_cache, timeout, on_chunk, conversacion)
+        await _entregar_completo(result, on_chunk)
+        return result
+    
+    future = asyncio.get_running_loop().create_future()
+    _inflight[cache_key] = future
+    try:
+        result = await _generar_sin_cache(task_prompt, json_mode, contexto, cache_key, timeout, on_chunk, conversacion)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Marcada como leída: si nadie más esperaba, no se reporta como excepción perdida
+        future.exception()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        _inflight.pop(cache_key, None)
+
+
+async def _entregar_completo(value: Optional[Any], on_chunk: Optional[Callable[[str], Awaitable[None]]]):
+    """Entrega de una vez un resultado ya disponible a un llamador en modo streaming."""
+    if on_chunk is None or value is None:
+        return
+    # Un HIT se entrega de una vez para que el cliente no quede esperando chunks
+    await on_chunk(value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+
+
+async def _generar_sin_cache(
+    task_prompt: str,
+    json_mode: bool,
+    contexto: str,
+    cache_key: Optional[str],
+    timeout: Optional[float],
+    on_chunk: Optional[Callable[[str], Awaitable[None]]],
+    conversacion: Optional[ConversacionLLM] = None
+) -> Optional[Any]:
+    """Consulta a Ollama, parsea la respuesta y la guarda en caché si hay cache_key."""
+    logger.info(f"Generando contenido con IA async (JSON={json_mode}, cached={cache_key is not None})")
+    
+    try:
+        if conversacion is not None:
+            await conversacion.preparar(timeout)
+            full_prompt = conversacion.construir_prompt(task_prompt, json_mode, contexto)
+            text, _meta = await _llamar_ollama(
+                full_prompt, json_mode=json_mode, timeout=timeout, on_chunk=on_chunk,
+                context=conversacion.context
+            )
+        else:
+            full_prompt = _construir_prompt(task_prompt, json_mode, contexto)
+            text = await llamar_ollama_async(full_prompt, json_mode=json_mode, timeout=timeout, on_chunk=on_chunk)
         
         if not text:
             logger.error("Respuesta vacía de Ollama")
             return None
         
-        # logger.info(f"✓ Respuesta recibida de Ollama ({len(text)} caracteres)")
+        result = _parsear_respuesta(text, json_mode)
         
-        # Parse JSON if needed
-        if json_mode:
-            try:
-                start = text.find('{')
-                end = text.rfind('}') + 1
-                
-                if start != -1 and end > start:
-                    json_text = text[start:end]
-                    parsed = json.loads(json_text)
-                    logger.info("✓ JSON parseado exitosamente")
-                    
-                    # Store in cache
-                    if use_cache:
-                        _prompt_cache[cache_key] = parsed
-                        # logger.debug(f"Resultado almacenado en caché (key: {cache_key[:16]}...)")
-                    
-                    return parsed
-                else:
-                    parsed = json.loads(text)
-                    logger.info("✓ JSON parseado exitosamente")
-                    
-                    if use_cache:
-                        _prompt_cache[cache_key] = parsed
-                    
-                    return parsed
-                    
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parseando JSON de IA: {e}")
-                logger.debug(f"Texto recibido: {text[:500]}")
-                return None
+        if result is not None and cache_key is not None:
+            _prompt_cache[cache_key] = result
+            await asyncio.to_thread(_guardar_en_l2, cache_key, result)
         
-        # Store text response in cache
-        if use_cache:
-            _prompt_cache[cache_key] = text
-            # logger.debug(f"Resultado almacenado en caché (key: {cache_key[:16]}...)")
+        return result
         
-        return text
-        
-    except requests.Timeout:
-        logger.error(f"Timeout al contactar Ollama ({OLLAMA_TIMEOUT}s): {OLLAMA_URL}")
+    except httpx.TimeoutException:
+        logger.error(f"Timeout al contactar Ollama ({timeout or OLLAMA_TIMEOUT}s): {OLLAMA_URL}")
         return None
         
-    except requests.ConnectionError:
+    except httpx.ConnectError:
         logger.error(f"No se pudo conectar a Ollama: {OLLAMA_URL}")
         logger.warning("Verifica que Ollama esté corriendo: 'ollama serve'")
         return None
         
-    except requests.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         logger.error(f"Error HTTP de Ollama: {e.response.status_code} - {e}")
         return None
         
+    except ColaLLMLlena:
+        # No es un fallo de la IA: quien llama decide (p. ej. responder 503)
+        raise
+        
     except Exception as e:
-        logger.error(f"Error inesperado en generar_con_ia: {e}", exc_info=True)
+        logger.error(f"Error inesperado en generar_con_ia_async: {e}", exc_info=True)
         return None
@@ -0,0 +1,167 @@
+"""
+Segundo nivel (L2) de la caché de prompts: almacén SQLite en disco.
+
+Sobrevive a reinicios y deploys. Cada entrada se guarda comprimida (zlib)
+con su propio TTL; cuando el archivo supera el tamaño máximo se expulsan
+las entradas usadas hace más tiempo (LRU).
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional, Any, Dict
+from app.logger import setup_logger
+
+logger = setup_logger("ai_disk_cache")
+
+
+class DiskPromptCache:
+    """Caché persistente clave → respuesta de IA, acotada por tamaño."""
+
+    def __init__(self, path: str, max_bytes: int, default_ttl: int, compress_level: int = 6):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS prompt_cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_prompt_cache_expires ON prompt_cache (expires_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_prompt_cache_access ON prompt_cache (last_access)")
+
+        self._purge_expired()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM prompt_cache").fetchone()[0]
+        logger.info(f"Caché L2 abierta: {path} ({len(self)} entradas, {self._total_bytes} bytes)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Any]:
+        """Retorna el valor guardado o None si no existe o expiró."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, size, expires_at FROM prompt_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+
+            blob, size, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._conn.execute("UPDATE prompt_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._stats["hits"] += 1
+
+        try:
+            return json.loads(zlib.decompress(blob).decode("utf-8"))
+        except (zlib.error, ValueError) as e:
+            logger.warning(f"Entrada L2 corrupta ({key[:16]}...), descartada: {e}")
+            self.delete(key)
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        """Guarda (o reemplaza) una entrada comprimida con TTL propio."""
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), self.compress_level)
+        size = len(blob)
+        if size > self.max_bytes:
+            logger.warning(f"Entrada de {size} bytes excede el tamaño máximo de L2, no se guarda")
+            return
+
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.default_ttl)
+
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM prompt_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prompt_cache (key, value, size, created_at, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, blob, size, now, expires_at, now),
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            self._stats["writes"] += 1
+
+            if self._total_bytes > self.max_bytes:
+                self._evict_locked()
+
+    def delete(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM prompt_cache WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+                self._total_bytes -= row[0]
+
+    def clear(self) -> int:
+        """Elimina todas las entradas. Retorna cuántas había."""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()[0]
+            self._conn.execute("DELETE FROM prompt_cache")
+            self._total_bytes = 0
+            self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+        return count
+
+    def _purge_expired(self):
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM prompt_cache WHERE expires_at <= ?", (time.time(),))
+            self._stats["expired"] += cur.rowcount
+
+    def _evict_locked(self):
+        """Expulsa expiradas y luego las menos usadas hasta quedar al 90% del máximo."""
+        cur = self._conn.execute("DELETE FROM prompt_cache WHERE expires_at <= ?", (time.time(),))
+        self._stats["expired"] += cur.rowcount
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM prompt_cache").fetchone()[0]
+
+        target = int(self.max_bytes * 0.9)
+        if self._total_bytes <= target:
+            return
+
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM prompt_cache ORDER BY last_access ASC"):
+            victims.append((key,))
+            freed += size
+            if self._total_bytes - freed <= target:
+                break
+
+        self._conn.executemany("DELETE FROM prompt_cache WHERE key = ?", victims)
+        self._total_bytes -= freed
+        self._stats["evictions"] += len(victims)
+        logger.info(f"Caché L2: {len(victims)} entradas expulsadas ({freed} bytes liberados)")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self._stats["hits"] + self._stats["misses"]
+        return {
+            "size": len(self),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.default_ttl,
+            "hits": self._stats["hits"],
+            "misses": self._stats["misses"],
+            "writes": self._stats["writes"],
+            "evictions": self._stats["evictions"],
+            "expired": self._stats["expired"],
+            "hit_rate_percent": round(self._stats["hits"] / total * 100, 2) if total > 0 else 0,
+        }
@@ -1,31 +1,480 @@
-from typing import List, Dict
+"""
+Memoria narrativa por niveles para el contexto de la IA.
+
+  - Eventos recientes: los últimos MEMORY_RECENT_EVENTS del journal, literales.
+  - Resumen de sesión: lo anterior a esa ventana, condensado por la IA en
+    bloques de MEMORY_CHUNK_EVENTS eventos.
+  - Resumen de arco: cuando el de sesión pasa de MEMORY_SESSION_MAX_CHARS se
+    pliega en el de arco y el de sesión vuelve a empezar.
+
+Los resúmenes se guardan en SQLite (narrative_summaries) y se actualizan en
+segundo plano cada vez que el journal registra un evento. preparar_contexto
+carga de la DB (en el pool de hilos) lo que falte de una sesión, así que
+get_narrative_context solo lee lo que ya está en memoria.
+
+Además, un índice invertido BM25 por sesión permite recuperar los eventos
+más relevantes para un texto (buscar_eventos) entre los últimos
+MEMORY_INDEX_EVENTS; lo anterior ya está cubierto por los resúmenes.
+"""
+import asyncio
+import heapq
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+from sqlmodel import select
 from app.state import journal
+from app.database import get_session, run_db
+from app.db_models import NarrativeSummary
+from app.components.ai.client import generar_con_ia_async
+from app.components.ai.scheduler import contexto_llm, PRIORIDAD_PREFETCH, ColaLLMLlena
 from app.logger import setup_logger
 
 logger = setup_logger("memory")
 
-def get_narrative_context(session_id: str, limit: int = 10) -> str:
+MEMORY_RECENT_EVENTS = int(os.getenv("MEMORY_RECENT_EVENTS", "10"))
+MEMORY_CHUNK_EVENTS = int(os.getenv("MEMORY_CHUNK_EVENTS", "10"))
+MEMORY_SESSION_MAX_CHARS = int(os.getenv("MEMORY_SESSION_MAX_CHARS", "1500"))
+# Eventos relevantes (BM25) que se suman al contexto del oráculo
+MEMORY_RELEVANT_EVENTS = int(os.getenv("MEMORY_RELEVANT_EVENTS", "5"))
+# Ventana del índice BM25 (últimos eventos de cada sesión) y sesiones indexadas a la vez
+MEMORY_INDEX_EVENTS = int(os.getenv("MEMORY_INDEX_EVENTS", "2000"))
+MEMORY_INDEX_SESSIONS = int(os.getenv("MEMORY_INDEX_SESSIONS", "32"))
+
+_STOPWORDS = set("""
+a al algo ante antes aqui asi aun bajo bien cada como con contra cual cuando de del desde donde dos
+el ella ellas ellos en entre era eran es esa esas ese eso esos esta estaba estan estas este esto estos
+fue fueron ha habia han hasta hay la las le les lo los mas me mi mientras muy nada ni no nos o otra
+otro para pero poco por porque que quien se sea segun ser si sin sobre son su sus tambien tan te
+tiene todo todos tras tu un una unas uno unos ya y
+""".split())
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _tokenizar(texto: str) -> List[str]:
+    """Minúsculas, sin tildes, sin stopwords ni tokens de menos de 3 letras"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in _TOKEN_RE.findall(texto) if len(t) > 2 and t not in _STOPWORDS]
+
+
+class IndiceBM25:
     """
-    Recupera los últimos eventos del journal y los formatea como contexto narrativo.
+    Índice invertido BM25 (k1=1.5, b=0.75) sobre las descripciones de una sesión.
+
+    Guarda como mucho `capacidad` documentos: al pasarse descarta el más
+    antiguo junto con sus postings.
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, inicio: int = 0, capacidad: Optional[int] = None):
+        self.capacidad = capacidad or MEMORY_INDEX_EVENTS
+        self.inicio = inicio  # doc_id del documento más antiguo que sigue indexado
+        self.fin = inicio     # doc_id del próximo documento
+        self.postings: Dict[str, Dict[int, int]] = {}  # término -> {doc_id: tf}
+        self.doc_len: Dict[int, int] = {}
+        self.docs: Dict[int, Dict[str, Any]] = {}  # evento de cada doc_id (sin metadata)
+        self.total_len = 0
+
+    def __len__(self) -> int:
+        return self.fin - self.inicio
+
+    def agregar(self, evento: Dict[str, Any]) -> int:
+        """Indexa un evento; su doc_id es su posición absoluta en el journal."""
+        doc_id = self.fin
+        tokens = _tokenizar(evento.get("description", ""))
+        for termino, tf in Counter(tokens).items():
+            self.postings.setdefault(termino, {})[doc_id] = tf
+        self.docs[doc_id] = {k: evento.get(k) for k in ("timestamp", "event_type", "description")}
+        self.doc_len[doc_id] = len(tokens)
+        self.total_len += len(tokens)
+        self.fin += 1
+        while len(self) > self.capacidad:
+            self._descartar_mas_antiguo()
+        return doc_id
+
+    def _descartar_mas_antiguo(self):
+        doc_id = self.inicio
+        for termino in set(_tokenizar(self.docs.pop(doc_id)["description"] or "")):
+            docs = self.postings[termino]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[termino]
+        self.total_len -= self.doc_len.pop(doc_id)
+        self.inicio += 1
+
+    def top_k(self, consulta: str, k: int, excluir_desde: Optional[int] = None) -> List[tuple]:
+        """
+        Los k documentos con mayor puntaje BM25 para la consulta.
+
+        Args:
+            excluir_desde: ignora doc_id >= este valor (p. ej. eventos ya incluidos como recientes)
+
+        Returns:
+            Lista de (doc_id, score) ordenada de mayor a menor
+        """
+        n = len(self)
+        if n == 0:
+            return []
+        avgdl = self.total_len / n or 1.0
+        scores: Dict[int, float] = {}
+
+        for termino in set(_tokenizar(consulta)):
+            docs = self.postings.get(termino)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                if excluir_desde is not None and doc_id >= excluir_desde:
+                    continue
+                norm = tf + self.K1 * (1 - self.B + self.B * self.doc_len[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.K1 + 1) / norm
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+class JournalRetriever:
+    """
+    Un IndiceBM25 por sesión, alimentado por cada register_event.
+
+    Se conservan los índices de las MEMORY_INDEX_SESSIONS sesiones usadas más
+    recientemente; el de una sesión descartada se reconstruye en segundo plano
+    la próxima vez que se necesite.
+    """
+
+    def __init__(self):
+        self._indices: "OrderedDict[str, IndiceBM25]" = OrderedDict()
+        self._construcciones: Dict[str, asyncio.Task] = {}
+        self._stats = {"queries": 0, "query_ms_total": 0.0, "builds": 0, "evicted": 0}
+
+    def on_event(self, session_id: str, entry: Dict[str, Any], total: int):
+        """Observador de JournalSystem: indexa el evento recién registrado."""
+        indice = self._indices.get(session_id)
+        if indice is not None and indice.fin == total - 1:
+            indice.agregar(entry)
+            return
+        # Primera vez (o desincronizado): reconstruir en segundo plano, sin leer la DB en el loop
+        try:
+            self._programar_construccion(session_id)
+        except RuntimeError:
+            pass  # Sin event loop (scripts síncronos): se construirá en la próxima búsqueda
+
+    async def preparar(self, session_id: str):
+        """Deja el índice de la sesión al día con el journal (construyéndolo si hace falta)."""
+        indice = self._indices.get(session_id)
+        if indice is None or indice.fin != journal.total(session_id):
+            await asyncio.shield(self._programar_construccion(session_id))
+
+    def buscar(self, session_id: str, consulta: str, top_k: int = 5, excluir_recientes: int = 0) -> List[Dict[str, Any]]:
+        """
+        Eventos del journal más relevantes para la consulta (con su 'score').
+        Solo memoria: si el índice aún no está construido no devuelve nada
+        (await preparar() antes para tenerlo al día).
+        """
+        inicio = time.perf_counter()
+        indice = self._indices.get(session_id)
+        if indice is None:
+            return []
+        self._indices.move_to_end(session_id)
+
+        limite = indice.fin - excluir_recientes if excluir_recientes else None
+        resultados = [
+            {**indice.docs[doc_id], "score": round(score, 3)}
+            for doc_id, score in indice.top_k(consulta, top_k, excluir_desde=limite)
+        ]
+
+        self._stats["queries"] += 1
+        self._stats["query_ms_total"] += (time.perf_counter() - inicio) * 1000
+        return resultados
+
+    def stats(self) -> Dict[str, Any]:
+        queries = self._stats["queries"]
+        return {
+            "sessions": len(self._indices),
+            "documents": sum(len(i) for i in self._indices.values()),
+            "terms": sum(len(i.postings) for i in self._indices.values()),
+            "building": len(self._construcciones),
+            "builds": self._stats["builds"],
+            "evicted_sessions": self._stats["evicted"],
+            "queries": queries,
+            "avg_query_ms": round(self._stats["query_ms_total"] / queries, 3) if queries else 0,
+        }
+
+    def _programar_construccion(self, session_id: str) -> asyncio.Task:
+        """Una construcción por sesión a la vez; quien llegue después espera la misma."""
+        task = self._construcciones.get(session_id)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._construir(session_id))
+            self._construcciones[session_id] = task
+            task.add_done_callback(lambda _t, sid=session_id: self._construcciones.pop(sid, None))
+        return task
+
+    async def _construir(self, session_id: str):
+        await journal.preparar(session_id)
+        total = journal.total(session_id)
+        # Solo la ventana del índice: lo anterior ya lo cubren los resúmenes
+        desde = max(0, total - MEMORY_INDEX_EVENTS)
+        eventos = await journal.eventos(session_id, desde, total)
+        # Tokenizar miles de eventos es CPU: fuera del loop
+        indice = await asyncio.to_thread(self._indexar, IndiceBM25(inicio=desde), eventos)
+
+        # Ponerse al día con lo registrado mientras se construía
+        while indice.fin < journal.total(session_id):
+            nuevos = await journal.eventos(session_id, indice.fin, journal.total(session_id))
+            if not nuevos:
+                break  # DB no disponible: el próximo evento desincronizado lo reintenta
+            for evento in nuevos:
+                indice.agregar(evento)
+
+        self._indices[session_id] = indice
+        self._indices.move_to_end(session_id)
+        while len(self._indices) > MEMORY_INDEX_SESSIONS:
+            self._indices.popitem(last=False)
+            self._stats["evicted"] += 1
+        self._stats["builds"] += 1
+        logger.debug(f"Índice BM25 construido para {session_id} ({len(indice)} eventos)")
+
+    @staticmethod
+    def _indexar(indice: IndiceBM25, eventos: List[Dict[str, Any]]) -> IndiceBM25:
+        for evento in eventos:
+            indice.agregar(evento)
+        return indice
+
+
+class NarrativeMemory:
+    """Resúmenes de sesión y de arco por session_id, mantenidos incrementalmente."""
+
+    def __init__(self):
+        # session_id -> {"session": str, "arc": str, "covered": int}
+        self._estado: Dict[str, Dict[str, Any]] = {}
+        self._en_curso: Dict[str, asyncio.Task] = {}
+        self._stats = {"condensations": 0, "arc_folds": 0, "failed": 0}
+
+    # ─── Lectura ─────────────────────────────────────────
+
+    async def preparar(self, session_id: str) -> Dict[str, Any]:
+        """Carga (una vez) los resúmenes de la sesión desde la DB, en el pool de hilos."""
+        if session_id not in self._estado:
+            estado = await run_db(self._cargar, session_id)
+            # Otra carga concurrente pudo terminar antes: conservar la primera
+            self._estado.setdefault(session_id, estado)
+        return self._estado[session_id]
+
+    def resumenes(self, session_id: str) -> Dict[str, Any]:
+        """Resúmenes vigentes de la sesión. Solo memoria: await preparar() antes."""
+        return self._estado.get(session_id) or {"session": "", "arc": "", "covered": 0}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self._estado), "running": len(self._en_curso), **self._stats}
+
+    # ─── Mantenimiento incremental ───────────────────────
+
+    def on_event(self, session_id: str, entry: Dict[str, Any], total: int):
+        """Observador de JournalSystem: lanza la condensación cuando hay un bloque listo."""
+        if session_id in self._en_curso:
+            return
+        # Sin los resúmenes en memoria todavía, _condensar los carga y decide
+        estado = self._estado.get(session_id)
+        if estado is not None and not self._hay_bloque(estado, total):
+            return
+
+        try:
+            task = asyncio.get_running_loop().create_task(self._condensar(session_id))
+        except RuntimeError:
+            return  # Sin event loop (scripts síncronos): se condensará en el próximo evento
+        self._en_curso[session_id] = task
+        task.add_done_callback(lambda _t, sid=session_id: self._en_curso.pop(sid, None))
+
+    @staticmethod
+    def _hay_bloque(estado: Dict[str, Any], total: int) -> bool:
+        if estado["covered"] > total:
+            # El journal se reinició (clear_session): empezar de cero
+            estado.update({"session": "", "arc": "", "covered": 0})
+        return total - MEMORY_RECENT_EVENTS - estado["covered"] >= MEMORY_CHUNK_EVENTS
+
+    async def _condensar(self, session_id: str):
+        estado = await self.preparar(session_id)
+        if not self._hay_bloque(estado, journal.total(session_id)):
+            return
+        hasta = journal.total(session_id) - MEMORY_RECENT_EVENTS
+        bloque = await journal.eventos(session_id, estado["covered"], hasta)
+        if not bloque:
+            return
+
+        lineas = "\n".join(f"- [{e.get('event_type', 'evento')}] {e.get('description', '')}" for e in bloque)
+        prompt = f"""Eres el CRONISTA de una campaña de D&D 5e. Actualiza el resumen de la sesión
+incorporando los nuevos eventos. Conserva nombres, decisiones, pistas, objetos y deudas pendientes.
+Máximo 150 palabras, español, 3ra persona.
+
+RESUMEN ACTUAL: {estado["session"] or "(vacío)"}
+NUEVOS EVENTOS:
+{lineas}
+
+JSON REQUERIDO: {{ "resumen": "..." }}"""
+
+        # Trabajo de fondo: nunca por delante del oráculo ni de una generación
+        try:
+            with contexto_llm(PRIORIDAD_PREFETCH, None):
+                resultado = await generar_con_ia_async(prompt, use_cache=False)
+        except ColaLLMLlena:
+            resultado = None
+
+        if not isinstance(resultado, dict) or not resultado.get("resumen"):
+            self._stats["failed"] += 1
+            logger.warning(f"No se pudo condensar la memoria de {session_id}, se reintentará con el próximo evento")
+            return
+
+        estado["session"] = str(resultado["resumen"])
+        estado["covered"] = hasta
+        self._stats["condensations"] += 1
+        logger.info(f"🧠 Memoria de {session_id} condensada ({hasta} eventos cubiertos)")
+
+        if len(estado["session"]) > MEMORY_SESSION_MAX_CHARS:
+            await self._plegar_en_arco(session_id, estado)
+
+        # Copia: el loop puede seguir actualizando el estado mientras el hilo escribe
+        await run_db(self._guardar, session_id, dict(estado))
+
+    async def _plegar_en_arco(self, session_id: str, estado: Dict[str, Any]):
+        prompt = f"""Eres el CRONISTA de una campaña de D&D 5e. Integra el resumen de la sesión
+en el resumen del ARCO de la campaña: solo lo que importa a largo plazo (conflictos, aliados,
+enemigos, promesas, lugares clave). Máximo 200 palabras, español, 3ra persona.
+
+ARCO ACTUAL: {estado["arc"] or "(vacío)"}
+SESIÓN: {estado["session"]}
+
+JSON REQUERIDO: {{ "resumen": "..." }}"""
+
+        try:
+            with contexto_llm(PRIORIDAD_PREFETCH, None):
+                resultado = await generar_con_ia_async(prompt, use_cache=False)
+        except ColaLLMLlena:
+            return  # Se vuelve a intentar en la próxima condensación
+
+        if isinstance(resultado, dict) and resultado.get("resumen"):
+            estado["arc"] = str(resultado["resumen"])
+            estado["session"] = ""
+            self._stats["arc_folds"] += 1
+            logger.info(f"🧠 Resumen de sesión de {session_id} plegado en el arco")
+
+    # ─── Persistencia ────────────────────────────────────
+
+    def _cargar(self, session_id: str) -> Dict[str, Any]:
+        estado = {"session": "", "arc": "", "covered": 0}
+        try:
+            with get_session() as db:
+                filas = db.exec(
+                    select(NarrativeSummary).where(NarrativeSummary.session_id == session_id)
+                ).all()
+            for fila in filas:
+                estado[fila.level] = fila.content
+                if fila.level == "session":
+                    estado["covered"] = fila.events_covered
+        except Exception as e:
+            logger.warning(f"No se pudieron cargar los resúmenes de {session_id}: {e}")
+        return estado
+
+    def _guardar(self, session_id: str, estado: Dict[str, Any]):
+        try:
+            with get_session() as db:
+                filas = {
+                    f.level: f for f in db.exec(
+                        select(NarrativeSummary).where(NarrativeSummary.session_id == session_id)
+                    ).all()
+                }
+                for level in ("session", "arc"):
+                    fila = filas.get(level) or NarrativeSummary(session_id=session_id, level=level)
+                    fila.content = estado[level]
+                    fila.events_covered = estado["covered"]
+                    fila.updated_at = datetime.utcnow()
+                    db.add(fila)
+                db.commit()
+        except Exception as e:
+            logger.warning(f"No se pudieron guardar los resúmenes de {session_id}: {e}")
+
+
+narrative_memory = NarrativeMemory()
+journal_retriever = JournalRetriever()
+journal.add_listener(narrative_memory.on_event)
+journal.add_listener(journal_retriever.on_event)
+
+
+async def buscar_eventos(session_id: str, consulta: str, top_k: int = MEMORY_RELEVANT_EVENTS) -> List[Dict[str, Any]]:
+    """
+    Recupera los top_k eventos del journal más relevantes para `consulta` (BM25).
+
+    Returns:
+        Lista de eventos (timestamp, event_type, description, score)
+    """
+    try:
+        await journal_retriever.preparar(session_id)
+        return journal_retriever.buscar(session_id, consulta, top_k)
+    except Exception as e:
+        logger.error(f"Error buscando eventos relevantes: {e}")
+        return []
+
+
+async def preparar_contexto(session_id: str):
+    """
+    Carga lo que get_narrative_context necesita de la sesión (journal reciente,
+    resúmenes e índice BM25) sin bloquear el loop. Tras la primera vez es inmediato.
+    """
+    try:
+        await journal.preparar(session_id)
+        await narrative_memory.preparar(session_id)
+        if MEMORY_RELEVANT_EVENTS > 0:
+            await journal_retriever.preparar(session_id)
+    except Exception as e:
+        logger.error(f"Error preparando contexto narrativo: {e}")
+
+
+def get_narrative_context(session_id: str, limit: int = MEMORY_RECENT_EVENTS, consulta: Optional[str] = None) -> str:
+    """
+    Arma el contexto narrativo: resumen del arco + resumen de la sesión +
+    eventos relevantes para `consulta` (si se pasa) + últimos eventos literales.
+    Solo lee estado en memoria (no llama a la IA ni a la DB): await
+    preparar_contexto(session_id) antes para una sesión recién retomada.
     """
     try:
         events = journal.get_log(session_id)
-        if not events:
+        resumenes = narrative_memory.resumenes(session_id)
+        if not events and not resumenes["arc"]:
             return ""
-            
-        # Tomar los últimos 'limit' eventos relevantes
-        # Filtramos eventos técnicos si es necesario, por ahora tomamos todo
+
+        context_lines: List[str] = []
+        if resumenes["arc"]:
+            context_lines.append(f"RESUMEN DEL ARCO: {resumenes['arc']}")
+        if resumenes["session"]:
+            context_lines.append(f"RESUMEN DE LA SESIÓN: {resumenes['session']}")
+
+        # Eventos antiguos relacionados con lo que se está narrando ahora
+        if consulta and MEMORY_RELEVANT_EVENTS > 0:
+            relevantes = journal_retriever.buscar(
+                session_id, consulta, MEMORY_RELEVANT_EVENTS, excluir_recientes=limit
+            )
+            if relevantes:
+                context_lines.append("EVENTOS RELEVANTES:")
+                for evt in relevantes:
+                    context_lines.append(f"- [{evt.get('event_type', 'evento')}] {evt.get('description', '')}")
+
+        # Últimos 'limit' eventos literales (los anteriores ya están en los resúmenes)
         recent_events = events[-limit:]
-        
-        context_lines = ["RESUMEN DE EVENTOS RECIENTES:"]
+        if recent_events:
+            context_lines.append("RESUMEN DE EVENTOS RECIENTES:")
         for evt in recent_events:
-            timestamp = evt.get("timestamp", "")
-            tipo = evt.get("type", "evento")
+            tipo = evt.get("event_type", "evento")
             desc = evt.get("description", "")
             context_lines.append(f"- [{tipo}] {desc}")
-            
+
         return "\n".join(context_lines)
-        
+
     except Exception as e:
         logger.error(f"Error obteniendo contexto narrativo: {e}")
         return ""
@@ -0,0 +1,209 @@
+"""
+Planificador de trabajos LLM con prioridades.
+
+Todas las llamadas a Ollama pasan por aquí: como máximo max_concurrency
+generaciones en paralelo y, detrás, una cola acotada ordenada por clase
+(interactiva > generación > prefetch) y luego por orden de llegada.
+A los clientes que esperan se les informa su posición por WebSocket.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from app.logger import setup_logger
+
+logger = setup_logger("llm_scheduler")
+
+# Clases de prioridad (menor número = se atiende antes)
+PRIORIDAD_INTERACTIVA = 0
+PRIORIDAD_GENERACION = 1
+PRIORIDAD_PREFETCH = 2
+
+NOMBRES_PRIORIDAD = {
+    PRIORIDAD_INTERACTIVA: "interactive",
+    PRIORIDAD_GENERACION: "generation",
+    PRIORIDAD_PREFETCH: "prefetch",
+}
+
+# Prioridad y sesión de la tarea actual (se heredan en create_task/gather)
+_prioridad_actual: ContextVar[int] = ContextVar("llm_prioridad", default=PRIORIDAD_GENERACION)
+_sesion_actual: ContextVar[Optional[str]] = ContextVar("llm_sesion", default=None)
+
+
+@contextmanager
+def contexto_llm(prioridad: int, session_id: Optional[str] = None):
+    """
+    Fija la prioridad (y la sesión a notificar) de las llamadas LLM
+    hechas dentro del bloque, incluidas las de subtareas que se creen en él.
+    """
+    token_prioridad = _prioridad_actual.set(prioridad)
+    token_sesion = _sesion_actual.set(session_id)
+    try:
+        yield
+    finally:
+        _prioridad_actual.reset(token_prioridad)
+        _sesion_actual.reset(token_sesion)
+
+
+def prioridad_actual() -> int:
+    return _prioridad_actual.get()
+
+
+class ColaLLMLlena(Exception):
+    """La cola del planificador alcanzó su límite; la petición se rechaza."""
+
+
+class LLMScheduler:
+    """Cola con prioridades + límite de concurrencia delante del backend LLM."""
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.notifier: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None
+
+        self._running = 0
+        self._heap: List[list] = []  # [prioridad, seq, future, session_id, encolado_en, ultima_posicion]
+        self._seq = itertools.count()
+        self._notify_tasks: set = set()
+        self._stats = {
+            "submitted": {p: 0 for p in NOMBRES_PRIORIDAD},
+            "queued": {p: 0 for p in NOMBRES_PRIORIDAD},
+            "wait_seconds": {p: 0.0 for p in NOMBRES_PRIORIDAD},
+            "completed": 0,
+            "rejected": 0,
+            "max_depth": 0,
+        }
+        logger.info(f"LLMScheduler inicializado (concurrencia={max_concurrency}, cola={max_queue})")
+
+    # ─── API pública ─────────────────────────────────────
+
+    @asynccontextmanager
+    async def slot(self, prioridad: Optional[int] = None, session_id: Optional[str] = None):
+        """Espera turno para usar el backend y lo libera al salir del bloque."""
+        prioridad = prioridad_actual() if prioridad is None else prioridad
+        session_id = session_id if session_id is not None else _sesion_actual.get()
+
+        await self._acquire(prioridad, session_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def is_idle(self) -> bool:
+        """True si no hay generaciones en curso ni en cola."""
+        return self._running == 0 and not self._heap
+
+    def queue_depth(self, prioridad: Optional[int] = None) -> int:
+        if prioridad is None:
+            return len(self._heap)
+        return sum(1 for entry in self._heap if entry[0] == prioridad)
+
+    def stats(self) -> Dict[str, Any]:
+        per_class = {}
+        for p, nombre in NOMBRES_PRIORIDAD.items():
+            queued = self._stats["queued"][p]
+            per_class[nombre] = {
+                "submitted": self._stats["submitted"][p],
+                "waiting": self.queue_depth(p),
+                "avg_wait_ms": round(self._stats["wait_seconds"][p] / queued * 1000, 1) if queued else 0,
+            }
+
+        return {
+            "running": self._running,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": len(self._heap),
+            "max_queue": self.max_queue,
+            "max_depth_seen": self._stats["max_depth"],
+            "completed": self._stats["completed"],
+            "rejected": self._stats["rejected"],
+            "classes": per_class,
+        }
+
+    # ─── Internos ────────────────────────────────────────
+
+    async def _acquire(self, prioridad: int, session_id: Optional[str]):
+        self._stats["submitted"][prioridad] += 1
+
+        if self._running < self.max_concurrency and not self._heap:
+            self._running += 1
+            return
+
+        if len(self._heap) >= self.max_queue:
+            self._stats["rejected"] += 1
+            logger.warning(f"Cola LLM llena ({len(self._heap)}), rechazando petición {NOMBRES_PRIORIDAD[prioridad]}")
+            raise ColaLLMLlena(f"Cola LLM llena ({self.max_queue} en espera)")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [prioridad, next(self._seq), future, session_id, time.monotonic(), None]
+        heapq.heappush(self._heap, entry)
+        self._stats["max_depth"] = max(self._stats["max_depth"], len(self._heap))
+        logger.debug(f"Petición {NOMBRES_PRIORIDAD[prioridad]} encolada (profundidad={len(self._heap)})")
+        self._notificar_posiciones()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # El turno llegó justo al cancelar: devolverlo
+                self._release()
+            else:
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                self._notificar_posiciones()
+            raise
+
+        self._stats["queued"][prioridad] += 1
+        self._stats["wait_seconds"][prioridad] += time.monotonic() - entry[4]
+        self._notificar(session_id, {"type": "llm_queue", "status": "running", "position": 0})
+
+    def _release(self):
+        self._running -= 1
+        self._stats["completed"] += 1
+
+        while self._heap and self._running < self.max_concurrency:
+            entry = heapq.heappop(self._heap)
+            future = entry[2]
+            if future.done():
+                continue
+            self._running += 1
+            future.set_result(None)
+
+        self._notificar_posiciones()
+
+    def _notificar_posiciones(self):
+        """Envía la posición en cola a cada sesión cuya posición cambió."""
+        if self.notifier is None:
+            return
+
+        for posicion, entry in enumerate(sorted(self._heap), start=1):
+            session_id = entry[3]
+            if session_id is None or entry[5] == posicion:
+                continue
+            entry[5] = posicion
+            self._notificar(session_id, {
+                "type": "llm_queue",
+                "status": "queued",
+                "position": posicion,
+                "queue_depth": len(self._heap),
+                "priority": NOMBRES_PRIORIDAD[entry[0]],
+            })
+
+    def _notificar(self, session_id: Optional[str], payload: Dict[str, Any]):
+        if self.notifier is None or session_id is None:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self.notifier(session_id, payload))
+        except RuntimeError:
+            return
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2")),
+    max_queue=int(os.getenv("LLM_MAX_QUEUE", "50")),
+)
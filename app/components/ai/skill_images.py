@@ -4,7 +4,7 @@ import time
 from typing import Dict, Optional, Any
 from app.logger import setup_logger
 from app.components.ai.comfy_client import ComfyClient
-from app.components.ai.client import generar_con_ia
+from app.components.ai.client import generar_con_ia_async
 
 logger = setup_logger("skill_images")
 
@@ -72,7 +72,7 @@ class ImageGeneratorSkill:
     async def _refine_prompt_with_llm(self, description: str) -> Dict[str, str]:
         """Usa el 'Prompt Maestro' para obtener prompts optimizados."""
         try:
-            result = generar_con_ia(
+            result = await generar_con_ia_async(
                 task_prompt=f"Descripción de la escena: {description}",
                 json_mode=True,
                 contexto=PROMPT_MAESTRO_SYSTEM
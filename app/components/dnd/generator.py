@@ -1,12 +1,28 @@
-from typing import Dict, Any, List
+import os
+import copy
+import asyncio
+from typing import Dict, Any, List, Optional, Callable, Awaitable
 from app.logger import setup_logger
 from app.config import PERSONAJES_EMERGENCIA
 from app.components.dnd.rules import sanitizar_pj
-from app.components.ai.client import generar_con_ia
-from app.components.story.narrator import _generar_historia, _agregar_imagenes, _generar_esquema_aventura, _expandir_escena
+from app.components.ai.client import generar_con_ia_async
+from app.components.story.narrator import _generar_historia, _agregar_imagenes, _generar_esquema_aventura, _expandir_escena, _revisar_consistencia, _conversacion_escenas, ResumenRodante
 
 logger = setup_logger("generator")
 
+# Reenviar al cliente el texto de cada escena a medida que se genera
+STREAM_SCENES = os.getenv("STREAM_SCENES", "True") == "True"
+
+# Modo por defecto de expansión de escenas: "cascada" (secuencial) o "paralelo"
+GENERATION_MODE = os.getenv("GENERATION_MODE", "cascada")
+# En modo paralelo, pasada final barata que re-escribe las transiciones entre escenas
+CONSISTENCY_PASS = os.getenv("CONSISTENCY_PASS", "True") == "True"
+# Escenas por aventura cuando la petición no indica otra cosa
+NUM_ESCENAS = int(os.getenv("ADVENTURE_SCENES", "5"))
+
+# Referencias a tareas de imagen lanzadas con create_task (evita que el GC las cancele)
+_TAREAS_IMAGEN: set = set()
+
 from app.state import image_skill
 # Diccionario de Keywords Raciales para ComfyUI
 RACIAL_PROMPTS = {
@@ -27,9 +43,56 @@ RACIAL_PROMPTS = {
     "dragonborn": "dragonborn, scales, dragon head, snout, reptilian eyes",
 }
 
-async def crear_datos_aventura(session_id: str, setting: str, estilo: Dict[str, str], nivel: int = 1, background_tasks=None, connection_manager=None) -> Dict[str, Any]:
-    """Genera una aventura completa con personajes e historia en cascada (Async + WS Streaming)"""
-    logger.info(f"🎲 Iniciando generación de aventura en cascada (Nivel {nivel})")
+async def crear_datos_aventura(session_id: str, setting: str, estilo: Dict[str, str], nivel: int = 1, connection_manager=None, modo: Optional[str] = None, on_escena: Optional[Callable[..., Awaitable[None]]] = None, checkpoint: Optional[Dict[str, Any]] = None, on_checkpoint: Optional[Callable[..., Awaitable[None]]] = None, imagenes: bool = True, num_escenas: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Genera una aventura completa con personajes e historia (Async + WS Streaming).
+    
+    modo:
+        "cascada"  — cada escena se expande con el resumen de las anteriores (secuencial)
+        "paralelo" — todas las escenas se expanden a la vez desde el esquema,
+                     seguido de una pasada opcional de consistencia
+    on_escena:
+        Callback async on_escena(pjs, historia, escena, indice) invocado en cuanto
+        cada escena está expandida y enriquecida con el SRD. `historia` contiene
+        solo las escenas terminadas hasta ese momento.
+    checkpoint / on_checkpoint:
+        Estado parcial {pjs, esquema, escenas: {id: escena}} desde el que reanudar,
+        y callback async on_checkpoint(checkpoint, etapa) llamado tras los
+        personajes, el esquema y cada escena para persistirlo.
+    imagenes:
+        False para no disparar retratos ni mapas (aventuras de stock sin sesión;
+        se lanzan luego con lanzar_imagenes_aventura al entregarlas).
+    num_escenas:
+        Escenas del esquema (default ADVENTURE_SCENES). El contexto que arrastra la
+        cascada está acotado (ResumenRodante), así que aventuras largas no encarecen
+        cada prompt.
+    
+    Si hubo que recurrir a los personajes o a la historia de emergencia (Ollama
+    caído o respuesta inválida), el resultado lleva "emergencia": True.
+    
+    Si la generación se cancela (DELETE /jobs, apagado) o falla, se cancelan
+    también las escenas en vuelo y los retratos/mapas que haya lanzado.
+    """
+    # Retratos y mapas lanzados por esta generación: si se cancela o falla, se cancelan con ella
+    tareas_imagen: List[asyncio.Task] = []
+    try:
+        return await _crear_datos_aventura(session_id=session_id, setting=setting, estilo=estilo, nivel=nivel, connection_manager=connection_manager, modo=modo, on_escena=on_escena, checkpoint=checkpoint, on_checkpoint=on_checkpoint, imagenes=imagenes, num_escenas=num_escenas, tareas_imagen=tareas_imagen)
+    except BaseException:
+        for task in tareas_imagen:
+            task.cancel()
+        raise
+
+async def _crear_datos_aventura(session_id: str, setting: str, estilo: Dict[str, str], nivel: int = 1, connection_manager=None, modo: Optional[str] = None, on_escena: Optional[Callable[..., Awaitable[None]]] = None, checkpoint: Optional[Dict[str, Any]] = None, on_checkpoint: Optional[Callable[..., Awaitable[None]]] = None, imagenes: bool = True, num_escenas: Optional[int] = None, tareas_imagen: Optional[List[asyncio.Task]] = None) -> Dict[str, Any]:
+    modo = modo or GENERATION_MODE
+    checkpoint = checkpoint or {}
+    checkpoint.setdefault("escenas", {})
+    num_escenas = num_escenas or checkpoint.get("num_escenas") or NUM_ESCENAS
+    
+    async def guardar_checkpoint(etapa: str):
+        if on_checkpoint:
+            await on_checkpoint(checkpoint, etapa)
+    
+    logger.info(f"🎲 Iniciando generación de aventura en modo {modo} (Nivel {nivel}, {num_escenas} escenas)")
     
     # Helper para enviar updates
     async def send_update(msg: str, progress: int):
@@ -39,24 +102,64 @@ async def crear_datos_aventura(session_id: str, setting: str, estilo: Dict[str,
                 {"type": "loading_progress", "message": msg, "progress": progress}
             )
     
+    def scene_streamer(numero_escena: int):
+        """Crea el callback que reenvía los tokens de una escena como scene_chunk"""
+        if not (connection_manager and STREAM_SCENES):
+            return None
+        
+        async def _on_chunk(delta: str):
+            await connection_manager.send_to_session(
+                session_id,
+                {"type": "scene_chunk", "escena": numero_escena, "delta": delta}
+            )
+        return _on_chunk
+    
+    async def publicar(escena: Dict[str, Any], indice: int):
+        """Agrega la escena terminada a la historia, dispara su mapa y la notifica"""
+        historia['escenas'].append(escena)
+        historia['escenas'].sort(key=lambda e: e.get('id', 0) if isinstance(e.get('id'), int) else 0)
+        if imagenes:
+            _lanzar_imagen_escena(escena, session_id, indice, tareas_imagen)
+        checkpoint["escenas"][str(indice + 1)] = escena
+        await guardar_checkpoint(f"escena:{indice + 1}")
+        if on_escena:
+            await on_escena(pjs, historia, escena, indice)
+    
     await send_update("Generando personajes...", 10)
     
     # 1. PERSONAJES
-    logger.info("Paso 1/3: Generando personajes...")
-    # Ejecutamos generación de PJs (síncrona)
-    pjs = _generar_personajes(setting, nivel)
-    logger.info(f"✓ {len(pjs)} personajes generados")
+    if checkpoint.get("pjs"):
+        pjs = checkpoint["pjs"]
+        logger.info(f"Paso 1/3: {len(pjs)} personajes recuperados del checkpoint")
+    else:
+        logger.info("Paso 1/3: Generando personajes...")
+        pjs = await _generar_personajes(setting, nivel)
+        logger.info(f"✓ {len(pjs)} personajes generados")
+        checkpoint["pjs"] = pjs
+        await guardar_checkpoint("personajes")
+    
+    # Los retratos no dependen de la historia: se lanzan ya y corren en paralelo a las escenas
+    if imagenes:
+        _lanzar_retratos(pjs, session_id, tareas_imagen)
     
     await send_update(f"Personajes generados. Creando trama...", 30)
     
     # 2. ESQUEMA DE HISTORIA
-    logger.info("Paso 2/3: Generando esquema de historia...")
-    esquema = _generar_esquema_aventura(setting, estilo, pjs, nivel)
+    esquema = checkpoint.get("esquema")
+    if esquema:
+        logger.info("Paso 2/3: Esquema recuperado del checkpoint")
+    else:
+        logger.info("Paso 2/3: Generando esquema de historia...")
+        esquema = await _generar_esquema_aventura(setting, estilo, pjs, nivel, num_escenas)
+        if esquema:
+            checkpoint["esquema"] = esquema
+            await guardar_checkpoint("esquema")
     
     if not esquema:
         logger.warning("Fallo generando esquema, usando método legacy")
-        historia = _generar_historia(setting, estilo, pjs, nivel)
+        historia = await _generar_historia(setting, estilo, pjs, nivel)
         await send_update("Historia generada (modo legacy)...", 90)
+        await _publicar_historia_completa(historia, publicar)
     else:
         logger.info(f"✓ Esquema generado: {esquema['titulo']}")
         await send_update(f"Esquema: {esquema['titulo']}. Expandiendo escenas...", 40)
@@ -68,119 +171,206 @@ async def crear_datos_aventura(session_id: str, setting: str, estilo: Dict[str,
             "escenas": []
         }
         
-        # 3. EXPANSIÓN DE ESCENAS (CASCADA)
-        resumen_acumulado = f"Sinopsis: {esquema['sinopsis']}. "
+        # Escenas ya terminadas antes de un reinicio: se republican sin regenerarlas
+        previas = {int(k): v for k, v in checkpoint["escenas"].items()}
+        for escena_id in sorted(previas):
+            await publicar(previas[escena_id], escena_id - 1)
+        if previas:
+            logger.info(f"↪ {len(previas)} escenas recuperadas del checkpoint")
         
-        for i in range(1, 6):
-            logger.info(f"  > Expandiendo Escena {i}/5...")
-            await send_update(f"Escribiendo Escena {i}/5...", 40 + (i * 10))
-            
-            # Ejecutar expansión (síncrona, puede bloquear un poco, idealmente envolver en threadpool si es muy lento)
-            escena = _expandir_escena(esquema, resumen_acumulado, nivel, i, pjs)
-            
-            if escena:
-                # INTEGRACIÓN SRD: Reemplazar stats locas de la IA por matemáticas canónicas
-                try:
-                    from app.components.dnd.database import db
-                    if 'enemigos' in escena and isinstance(escena['enemigos'], list):
-                        for enemigo in escena['enemigos']:
-                            nombre = enemigo.get('nombre', '')
-                            srd_data = db.get_monster(nombre)
-                            if srd_data:
-                                logger.info(f"🦇 Inyectando stats hardcore SRD para {nombre} -> {srd_data['name']}")
-                                enemigo['nombre'] = srd_data['name'] # Nombre oficial
-                                enemigo['hp'] = srd_data.get('hit_points', enemigo.get('hp'))
-                                enemigo['ac'] = srd_data.get('armor_class', enemigo.get('ac'))
-                                
-                                # Extraer ataques para UI
-                                acciones = srd_data.get('actions', [])
-                                if acciones:
-                                    ataques = []
-                                    danos = []
-                                    for act in acciones[:2]:
-                                        ataque_str = f"+{act.get('attack_bonus', 0)} ({act.get('name', '')})"
-                                        ataques.append(ataque_str)
-                                        # Resumir el texto de daño
-                                        desc = act.get('desc', '')
-                                        # Buscar la palabra 'Hit:' o 'Impacto:'
-                                        if 'Hit:' in desc:
-                                            desc = desc.split('Hit:')[1].strip()
-                                        danos.append(desc)
-                                    
-                                    enemigo['ataque'] = " / ".join(ataques)
-                                    enemigo['dano'] = " | ".join(danos)
-                                    enemigo['srd_matcheado'] = True
-                                    
-                    # INTEGRACIÓN SRD: Validar botín
-                    if 'botin' in escena and isinstance(escena['botin'], list):
-                        botin_validado = []
-                        for item in escena['botin']:
-                            if not isinstance(item, str): continue
-                            eq_data = db.get_equipment(item)
-                            if eq_data:
-                                # Agregar stats al texto del botín si es un arma o armadura
-                                detalles = ""
-                                if "damage" in eq_data:
-                                    dmg_dice = eq_data["damage"].get("damage_dice", "")
-                                    dmg_type = eq_data["damage"].get("damage_type", {}).get("name", "")
-                                    if dmg_dice: detalles += f" [{dmg_dice} {dmg_type}]"
-                                if "armor_class" in eq_data:
-                                    detalles += f" [AC: {eq_data['armor_class'].get('base', '')}]"
-                                botin_validado.append(f"{eq_data['name']}{detalles}")
-                            else:
-                                botin_validado.append(item)
-                        escena['botin'] = botin_validado
-                        
-                except Exception as e:
-                    logger.error(f"Error inyectando SRD en generador: {e}")
-
-                historia['escenas'].append(escena)
-                resumen_acumulado += f"Escena {i}: {escena.get('narrativa', '')[:200]}... "
-            else:
-                logger.error(f"Fallo generando Escena {i}")
+        # 3. EXPANSIÓN DE ESCENAS (cada escena se publica al terminar)
+        if modo == "paralelo":
+            await _expandir_escenas_paralelo(esquema, nivel, pjs, send_update, scene_streamer, publicar, previas)
+        else:
+            await _expandir_escenas_cascada(esquema, nivel, pjs, send_update, scene_streamer, publicar, previas)
     
     # Check si algo falló catastroficamente
     if not historia.get('escenas'):
         logger.error("No se generaron escenas válidas, usando fallback completo")
-        historia = _generar_historia(setting, estilo, pjs, nivel)
+        historia = await _generar_historia(setting, estilo, pjs, nivel)
+        await _publicar_historia_completa(historia, publicar)
 
     logger.info(f"✓ Historia completada con {len(historia.get('escenas', []))} escenas")
-    await send_update("Finalizando detalles y magia...", 95)
-    
-    # 4. IMÁGENES
-    logger.info("Paso 3/3: Disparando generación de imágenes...")
-    if background_tasks:
-        # Mapas combinados
-        for idx, escena in enumerate(historia.get("escenas", [])):
-            if "narrativa" in escena:
-                background_tasks.add_task(
-                    image_skill.process_narrative, 
-                    escena["narrativa"], 
-                    session_id,
-                    escena.get("visual_prompt"),
-                    idx
-                )
-        # Retratos de PJs via ComfyUI
-        for idx, pj in enumerate(pjs):
-            raza = pj.get('raza', 'human')
-            clase = pj.get('clase', 'warrior')
-            # nombre = pj.get('nombre', 'Adventurer') # Unused var
-            genero = pj.get('genero', 'neutral') 
-            
-            portrait_prompt = _generate_portrait_prompt(raza, clase, genero, pj.get('descripcion_fisica', ''))
-            
-            background_tasks.add_task(
-                image_skill.generate_portrait,
-                portrait_prompt,
-                session_id,
-                pj_index=idx
-            )
-            
-    logger.info("✓ Tareas de imagen encoladas")
     await send_update("¡Aventura lista!", 100)
     
     logger.info("🎉 Aventura generada exitosamente")
-    return {"pjs": pjs, "historia": historia}
+    datos = {"pjs": pjs, "historia": historia}
+    if historia.get("emergencia") or any(pj.get("emergencia") for pj in pjs):
+        datos["emergencia"] = True
+    return datos
+
+async def _publicar_historia_completa(historia: Dict[str, Any], publicar):
+    """Publica una a una las escenas de una historia generada de golpe (legacy / fallback)"""
+    escenas = historia.get('escenas', [])
+    historia['escenas'] = []
+    for idx, escena in enumerate(escenas):
+        await publicar(escena, idx)
+
+async def _expandir_escenas_cascada(esquema: Dict, nivel: int, pjs: list, send_update, scene_streamer, publicar, previas: Optional[Dict[int, Dict]] = None) -> List[Dict[str, Any]]:
+    """Expande las escenas una tras otra; cada una recibe el resumen de las anteriores"""
+    previas = previas or {}
+    conversacion = _conversacion_escenas(esquema, nivel, pjs)
+    total = len(esquema['esquema_escenas'])
+    escenas = []
+    # Contexto acotado: las escenas viejas se condensan en un digest
+    resumen = ResumenRodante(esquema['sinopsis'])
+    
+    for i in range(1, total + 1):
+        if i in previas:
+            escenas.append(previas[i])
+            await resumen.agregar(i, previas[i])
+            continue
+        
+        logger.info(f"  > Expandiendo Escena {i}/{total}...")
+        await send_update(f"Escribiendo Escena {i}/{total}...", 40 + (i * 50 // total))
+        
+        escena = await _expandir_escena(esquema, resumen.texto(), nivel, i, pjs, on_chunk=scene_streamer(i), conversacion=conversacion)
+        
+        if escena:
+            _enriquecer_escena_srd(escena)
+            escenas.append(escena)
+            await publicar(escena, i - 1)
+            await resumen.agregar(i, escena)
+        else:
+            logger.error(f"Fallo generando Escena {i}")
+    
+    return escenas
+
+async def _expandir_escenas_paralelo(esquema: Dict, nivel: int, pjs: list, send_update, scene_streamer, publicar, previas: Optional[Dict[int, Dict]] = None) -> List[Dict[str, Any]]:
+    """
+    Expande todas las escenas a la vez. Cada una recibe el esquema completo
+    (sinopsis + resumen de todas las escenas) en lugar de la narrativa previa.
+    """
+    # El arco entero ya va en el prefijo compartido (ESQUEMA COMPLETO)
+    resumen_esquema = "Escena escrita en paralelo: apóyate en el ESQUEMA COMPLETO para el arco."
+    conversacion = _conversacion_escenas(esquema, nivel, pjs)
+    
+    async def _expandir(i: int):
+        escena = await _expandir_escena(esquema, resumen_esquema, nivel, i, pjs, on_chunk=scene_streamer(i), conversacion=conversacion)
+        return i, escena
+    
+    total = len(esquema['esquema_escenas'])
+    logger.info(f"  > Expandiendo {total} escenas en paralelo...")
+    await send_update("Escribiendo escenas en paralelo...", 45)
+    
+    por_id: Dict[int, Dict[str, Any]] = dict(previas or {})
+    pendientes = [i for i in range(1, total + 1) if i not in por_id]
+    # Tareas propias: al cancelar el trabajo se cancelan también las escenas en vuelo
+    tareas = [asyncio.create_task(_expandir(i)) for i in pendientes]
+    try:
+        for terminada in asyncio.as_completed(tareas):
+            i, escena = await terminada
+            if not escena:
+                logger.error(f"Fallo generando Escena {i}")
+                continue
+            _enriquecer_escena_srd(escena)
+            por_id[i] = escena
+            await publicar(escena, i - 1)
+            await send_update(f"Escena {i} lista ({len(por_id)}/{total})", 45 + len(por_id) * 40 // total)
+    finally:
+        for task in tareas:
+            task.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+    
+    escenas = [por_id[i] for i in sorted(por_id)]
+    
+    if escenas and CONSISTENCY_PASS:
+        await send_update("Hilando las escenas...", 90)
+        await _revisar_consistencia(esquema, escenas)
+    
+    return escenas
+
+def lanzar_imagenes_aventura(data: Dict[str, Any], session_id: str):
+    """Dispara retratos y mapas de una aventura ya generada (p. ej. sacada del pool)"""
+    _lanzar_retratos(data.get("pjs", []), session_id)
+    for idx, escena in enumerate(data.get("historia", {}).get("escenas", [])):
+        _lanzar_imagen_escena(escena, session_id, idx)
+
+def _registrar_tarea_imagen(task: asyncio.Task, tareas: Optional[List[asyncio.Task]]):
+    _TAREAS_IMAGEN.add(task)
+    task.add_done_callback(_TAREAS_IMAGEN.discard)
+    if tareas is not None:
+        tareas.append(task)
+
+def _lanzar_imagen_escena(escena: Dict[str, Any], session_id: str, indice: int, tareas: Optional[List[asyncio.Task]] = None):
+    """Dispara el mapa/imagen de una escena en cuanto está escrita (la tarea se agrega a `tareas`)"""
+    if "narrativa" not in escena:
+        return
+    task = asyncio.create_task(
+        image_skill.process_narrative(escena["narrativa"], session_id, escena.get("visual_prompt"), indice)
+    )
+    _registrar_tarea_imagen(task, tareas)
+
+def _lanzar_retratos(pjs: list, session_id: str, tareas: Optional[List[asyncio.Task]] = None):
+    """Dispara la generación de retratos de los PJs vía ComfyUI sin esperar el resultado"""
+    for idx, pj in enumerate(pjs):
+        raza = pj.get('raza', 'human')
+        clase = pj.get('clase', 'warrior')
+        genero = pj.get('genero', 'neutral') 
+        
+        portrait_prompt = _generate_portrait_prompt(raza, clase, genero, pj.get('descripcion_fisica', ''))
+        
+        task = asyncio.create_task(image_skill.generate_portrait(portrait_prompt, session_id, pj_index=idx))
+        _registrar_tarea_imagen(task, tareas)
+    
+    logger.info(f"✓ {len(pjs)} retratos encolados")
+
+def _enriquecer_escena_srd(escena: Dict[str, Any]):
+    """Reemplaza stats inventadas por la IA por datos canónicos del SRD (enemigos y botín)"""
+    # INTEGRACIÓN SRD: Reemplazar stats locas de la IA por matemáticas canónicas
+    try:
+        from app.components.dnd.database import db
+        if 'enemigos' in escena and isinstance(escena['enemigos'], list):
+            for enemigo in escena['enemigos']:
+                nombre = enemigo.get('nombre', '')
+                srd_data = db.get_monster(nombre)
+                if srd_data:
+                    logger.info(f"🦇 Inyectando stats hardcore SRD para {nombre} -> {srd_data['name']}")
+                    enemigo['nombre'] = srd_data['name'] # Nombre oficial
+                    enemigo['hp'] = srd_data.get('hit_points', enemigo.get('hp'))
+                    enemigo['ac'] = srd_data.get('armor_class', enemigo.get('ac'))
+                    
+                    # Extraer ataques para UI
+                    acciones = srd_data.get('actions', [])
+                    if acciones:
+                        ataques = []
+                        danos = []
+                        for act in acciones[:2]:
+                            ataque_str = f"+{act.get('attack_bonus', 0)} ({act.get('name', '')})"
+                            ataques.append(ataque_str)
+                            # Resumir el texto de daño
+                            desc = act.get('desc', '')
+                            # Buscar la palabra 'Hit:' o 'Impacto:'
+                            if 'Hit:' in desc:
+                                desc = desc.split('Hit:')[1].strip()
+                            danos.append(desc)
+                        
+                        enemigo['ataque'] = " / ".join(ataques)
+                        enemigo['dano'] = " | ".join(danos)
+                        enemigo['srd_matcheado'] = True
+                        
+        # INTEGRACIÓN SRD: Validar botín
+        if 'botin' in escena and isinstance(escena['botin'], list):
+            botin_validado = []
+            for item in escena['botin']:
+                if not isinstance(item, str): continue
+                eq_data = db.get_equipment(item)
+                if eq_data:
+                    # Agregar stats al texto del botín si es un arma o armadura
+                    detalles = ""
+                    if "damage" in eq_data:
+                        dmg_dice = eq_data["damage"].get("damage_dice", "")
+                        dmg_type = eq_data["damage"].get("damage_type", {}).get("name", "")
+                        if dmg_dice: detalles += f" [{dmg_dice} {dmg_type}]"
+                    if "armor_class" in eq_data:
+                        detalles += f" [AC: {eq_data['armor_class'].get('base', '')}]"
+                    botin_validado.append(f"{eq_data['name']}{detalles}")
+                else:
+                    botin_validado.append(item)
+            escena['botin'] = botin_validado
+            
+    except Exception as e:
+        logger.error(f"Error inyectando SRD en generador: {e}")
 
 def _generate_portrait_prompt(raza: str, clase: str, genero: str, extra_desc: str) -> str:
     """Genera un prompt optimizado para ComfyUI basado en raza y clase"""
@@ -201,7 +391,7 @@ def _generate_portrait_prompt(raza: str, clase: str, genero: str, extra_desc: st
     
     return f"{racial_keywords}, {clase}, {genero}, {extra_desc}, {style}"
 
-def _generar_personajes(setting: str, nivel: int) -> list:
+async def _generar_personajes(setting: str, nivel: int) -> list:
     """Genera lista de personajes para la aventura"""
     from app.config import CLASES_DND
     
@@ -242,11 +432,14 @@ def _generar_personajes(setting: str, nivel: int) -> list:
     
     IMPORTANTE: Asegura que al menos 2 PJs tengan un vínculo compartido en el campo 'vinculo'."""
     
-    data_pjs = generar_con_ia(prompt, use_cache=True)
+    # Sin caché: el prompt solo depende de (setting, nivel) y cada partida nueva debe ser distinta
+    data_pjs = await generar_con_ia_async(prompt, use_cache=False)
     
-    if not data_pjs or 'personajes' not in data_pjs:
+    emergencia = not data_pjs or 'personajes' not in data_pjs
+    if emergencia:
         logger.warning("Fallo generación de PJs, usando personajes de emergencia")
-        data_pjs = PERSONAJES_EMERGENCIA
+        # Copia: sanitizar_pj modifica los dicts y la constante se comparte entre partidas
+        data_pjs = copy.deepcopy(PERSONAJES_EMERGENCIA)
     
     raw_pjs = data_pjs.get('personajes', [])
     for p in raw_pjs:
@@ -256,6 +449,12 @@ def _generar_personajes(setting: str, nivel: int) -> list:
     
     if not pjs_finales:
         logger.error("No se pudieron generar PJs, usando fallback completo")
-        pjs_finales = [sanitizar_pj(p) for p in PERSONAJES_EMERGENCIA['personajes']]
+        emergencia = True
+        pjs_finales = [sanitizar_pj(p) for p in copy.deepcopy(PERSONAJES_EMERGENCIA)['personajes']]
+    
+    # Marca para que quien consuma la aventura (p. ej. el pool) sepa que no la escribió la IA
+    if emergencia:
+        for pj in pjs_finales:
+            pj['emergencia'] = True
     
     return pjs_finales
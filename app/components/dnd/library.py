@@ -1,20 +1,197 @@
 """
 CRUD para la biblioteca de contenido reutilizable (NPCs, Enemigos, Encuentros, Items).
+
+Los tags de cada entrada se guardan en su columna `tags` ("a,b,c") y además
+normalizados en library_tags, una fila por tag: los filtros por tag (todos o
+cualquiera de varios) y las facetas se resuelven con ese índice en lugar de
+un LIKE sobre el texto.
+
+La búsqueda de texto usa una tabla FTS5 (library_fts) con el nombre y el
+texto de cada entrada, mantenida por triggers de SQLite: una sola consulta
+ordenada por relevancia (bm25), con prefijos y fragmentos resaltados.
+
+Importar y exportar trabajan con NDJSON, una entrada por línea con su
+"type": la exportación se lee por bloques de id y la importación valida
+cada línea y hace upsert por nombre en lotes de LIBRARY_BULK_BATCH.
+
+Las respuestas de los endpoints de la biblioteca se cachean ya serializadas
+(con su ETag) por parámetros de consulta. Cada tipo tiene un contador de
+generación que crear_*/actualizar_*/eliminar_* incrementan: una entrada
+cacheada solo vale mientras las generaciones de sus tipos no cambien.
 """
+import hashlib
 import json
-from typing import List, Optional, Dict, Any
-from sqlmodel import select
-from app.database import get_session
-from app.db_models import LibraryNPC, LibraryEnemy, LibraryEncounter, LibraryItem
+import os
+import re
+import threading
+from typing import List, Optional, Dict, Any, Union, Callable, Tuple
+from cachetools import LRUCache
+from sqlalchemy import insert, text, bindparam
+from sqlalchemy.exc import OperationalError
+from sqlmodel import select, delete, func, or_, and_
+from app.database import get_session, engine
+from app.db_models import LibraryNPC, LibraryEnemy, LibraryEncounter, LibraryItem, LibraryTag
 from app.logger import setup_logger
 
 logger = setup_logger("library")
 
+# content_type -> modelo (mismas claves que buscar_biblioteca)
+MODELOS = {
+    "npcs": LibraryNPC,
+    "enemies": LibraryEnemy,
+    "encounters": LibraryEncounter,
+    "items": LibraryItem,
+}
+
+LIBRARY_CACHE_SIZE = int(os.getenv("LIBRARY_CACHE_SIZE", "256"))
+# Filas por transacción al importar y por lectura al exportar (NDJSON)
+LIBRARY_BULK_BATCH = int(os.getenv("LIBRARY_BULK_BATCH", "1000"))
+
+
+# ─── Caché de respuestas ─────────────────────────────────
+
+_generaciones: Dict[str, int] = {tipo: 0 for tipo in MODELOS}
+# clave -> (generaciones de sus tipos, cuerpo JSON, etag)
+_respuestas: LRUCache = LRUCache(maxsize=LIBRARY_CACHE_SIZE)
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def invalidar(*tipos: str):
+    """Incrementa la generación de esos tipos (de todos si no se indica ninguno)."""
+    with _cache_lock:
+        for tipo in tipos or MODELOS:
+            _generaciones[tipo] += 1
+        _cache_stats["invalidations"] += 1
+
+
+def leer_cache(clave: Tuple, tipos: List[str]) -> Optional[Tuple[bytes, str]]:
+    """(cuerpo, etag) si la respuesta cacheada sigue vigente; None si hay que construirla."""
+    with _cache_lock:
+        entrada = _respuestas.get(clave)
+        if entrada and entrada[0] == tuple(_generaciones[t] for t in tipos):
+            _cache_stats["hits"] += 1
+            return entrada[1], entrada[2]
+        _cache_stats["misses"] += 1
+        return None
+
+
+def construir_en_cache(clave: Tuple, tipos: List[str], construir: Callable[..., Any], *args, **kwargs) -> Tuple[bytes, str]:
+    """Ejecuta la consulta, serializa la respuesta una vez y la guarda con su ETag."""
+    # La generación se toma antes de consultar: una escritura concurrente deja la entrada ya vencida
+    with _cache_lock:
+        generacion = tuple(_generaciones[t] for t in tipos)
+    cuerpo = json.dumps(construir(*args, **kwargs), ensure_ascii=False).encode("utf-8")
+    etag = f'"{hashlib.blake2b(cuerpo, digest_size=12).hexdigest()}"'
+    with _cache_lock:
+        _respuestas[clave] = (generacion, cuerpo, etag)
+    return cuerpo, etag
+
+
+def cache_stats() -> Dict[str, Any]:
+    with _cache_lock:
+        total = _cache_stats["hits"] + _cache_stats["misses"]
+        return {
+            **_cache_stats,
+            "size": len(_respuestas),
+            "maxsize": LIBRARY_CACHE_SIZE,
+            "hit_rate_percent": round(100 * _cache_stats["hits"] / total, 1) if total else 0.0,
+            "generations": dict(_generaciones),
+        }
+
+
+# ─── Tags ────────────────────────────────────────────────
+
+def normalizar_tags(tags: Union[str, List[str], None]) -> List[str]:
+    """"Cr1, Mazmorra,cr1" -> ["cr1", "mazmorra"] (minúsculas, sin vacíos ni repetidos)."""
+    if not tags:
+        return []
+    partes = tags.split(",") if isinstance(tags, str) else tags
+    vistos: Dict[str, None] = {}
+    for parte in partes:
+        tag = str(parte).strip().lower()
+        if tag:
+            vistos.setdefault(tag)
+    return list(vistos)
+
+
+def _sincronizar_tags(db, content_type: str, item_id: int, tags: List[str]):
+    """Reemplaza las filas de library_tags de una entrada."""
+    db.exec(delete(LibraryTag).where(LibraryTag.content_type == content_type, LibraryTag.item_id == item_id))
+    for tag in tags:
+        db.add(LibraryTag(content_type=content_type, item_id=item_id, tag=tag))
+
+
+def _filtro_tags(columna_id, content_type: str, tags: List[str], match: str = "all"):
+    """
+    Condición sobre `columna_id` para las entradas de `content_type` que
+    tienen todos (match="all") o alguno (match="any") de los tags. Cada IN
+    es un rango del índice (content_type, tag, item_id).
+    """
+    def con_tag(*buscados: str):
+        return columna_id.in_(
+            select(LibraryTag.item_id).where(LibraryTag.content_type == content_type, LibraryTag.tag.in_(buscados))
+        )
+
+    if match == "any":
+        return con_tag(*tags)
+    return and_(*(con_tag(tag) for tag in tags))
+
+
+def facetas_tags(content_type: Optional[str] = None, tag: Optional[str] = None,
+                 match: str = "all", limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Cuántas entradas tienen cada tag, de más a menos frecuente. Con `tag`
+    cuenta solo dentro de las entradas que pasan ese filtro.
+    """
+    filtro = normalizar_tags(tag)
+    tipos = [content_type] if content_type else list(MODELOS)
+    stmt = (
+        select(LibraryTag.tag, func.count(LibraryTag.id))
+        .where(LibraryTag.content_type.in_(tipos))
+        .group_by(LibraryTag.tag)
+        .order_by(func.count(LibraryTag.id).desc(), LibraryTag.tag)
+        .limit(limit)
+    )
+    if filtro:
+        # Por tipo: los ids solo son únicos dentro de cada tabla
+        stmt = stmt.where(or_(*(
+            (LibraryTag.content_type == tipo) & _filtro_tags(LibraryTag.item_id, tipo, filtro, match)
+            for tipo in tipos
+        )))
+    with get_session() as db:
+        return [{"tag": t, "count": n} for t, n in db.exec(stmt).all()]
+
+
+def indexar_tags_pendientes() -> int:
+    """Indexa en library_tags las entradas con tags que aún no tienen filas. Retorna cuántas."""
+    indexadas = 0
+    with get_session() as db:
+        for content_type, modelo in MODELOS.items():
+            ya = select(LibraryTag.item_id).where(LibraryTag.content_type == content_type)
+            filas = db.exec(
+                select(modelo.id, modelo.tags).where(modelo.tags != "", modelo.id.not_in(ya))
+            ).all()
+            nuevas = [
+                {"content_type": content_type, "item_id": item_id, "tag": tag}
+                for item_id, tags in filas
+                for tag in normalizar_tags(tags)
+            ]
+            if nuevas:
+                db.execute(insert(LibraryTag), nuevas)
+            indexadas += len(filas)
+        db.commit()
+    if indexadas:
+        invalidar()
+        logger.info(f"🏷️ Tags indexados para {indexadas} entradas de la biblioteca")
+    return indexadas
+
 
 # ─── NPCs ────────────────────────────────────────────────
 
 def crear_npc(data: Dict[str, Any]) -> LibraryNPC:
     """Crea un NPC en la biblioteca."""
+    tags = normalizar_tags(data.get("tags"))
     npc = LibraryNPC(
         name=data["name"],
         race=data.get("race", "Humano"),
@@ -22,22 +199,26 @@ def crear_npc(data: Dict[str, Any]) -> LibraryNPC:
         description=data.get("description", ""),
         personality=data.get("personality", ""),
         stats_json=json.dumps(data.get("stats", {}), ensure_ascii=False),
-        tags=data.get("tags", ""),
+        tags=",".join(tags),
     )
     with get_session() as db:
         db.add(npc)
+        db.flush()
+        _sincronizar_tags(db, "npcs", npc.id, tags)
         db.commit()
+        invalidar("npcs")
         db.refresh(npc)
         logger.info(f"✅ NPC creado: {npc.name} (id={npc.id})")
         return npc
 
 
-def listar_npcs(tag: Optional[str] = None) -> List[LibraryNPC]:
-    """Lista NPCs, opcionalmente filtrados por tag."""
+def listar_npcs(tag: Optional[str] = None, match: str = "all") -> List[LibraryNPC]:
+    """Lista NPCs, opcionalmente filtrados por tags ("a,b": todos con match="all", alguno con "any")."""
+    tags = normalizar_tags(tag)
     with get_session() as db:
         stmt = select(LibraryNPC).order_by(LibraryNPC.name)
-        if tag:
-            stmt = stmt.where(LibraryNPC.tags.contains(tag))
+        if tags:
+            stmt = stmt.where(_filtro_tags(LibraryNPC.id, "npcs", tags, match))
         return list(db.exec(stmt).all())
 
 
@@ -52,12 +233,17 @@ def actualizar_npc(npc_id: int, data: Dict[str, Any]) -> Optional[LibraryNPC]:
         if not npc:
             return None
         for key, val in data.items():
-            if key == "stats":
+            if key == "tags":
+                tags = normalizar_tags(val)
+                npc.tags = ",".join(tags)
+                _sincronizar_tags(db, "npcs", npc_id, tags)
+            elif key == "stats":
                 npc.stats_json = json.dumps(val, ensure_ascii=False)
             elif hasattr(npc, key):
                 setattr(npc, key, val)
         db.add(npc)
         db.commit()
+        invalidar("npcs")
         db.refresh(npc)
         logger.info(f"✏️ NPC actualizado: {npc.name} (id={npc.id})")
         return npc
@@ -69,7 +255,9 @@ def eliminar_npc(npc_id: int) -> bool:
         if not npc:
             return False
         db.delete(npc)
+        db.exec(delete(LibraryTag).where(LibraryTag.content_type == "npcs", LibraryTag.item_id == npc_id))
         db.commit()
+        invalidar("npcs")
         logger.info(f"🗑️ NPC eliminado: {npc.name} (id={npc_id})")
         return True
 
@@ -78,6 +266,7 @@ def eliminar_npc(npc_id: int) -> bool:
 
 def crear_enemy(data: Dict[str, Any]) -> LibraryEnemy:
     """Crea un enemigo en la biblioteca."""
+    tags = normalizar_tags(data.get("tags"))
     enemy = LibraryEnemy(
         name=data["name"],
         cr=data.get("cr", 0.25),
@@ -86,21 +275,25 @@ def crear_enemy(data: Dict[str, Any]) -> LibraryEnemy:
         attack=data.get("attack", "+0"),
         damage=data.get("damage", "1d4"),
         abilities_json=json.dumps(data.get("abilities", []), ensure_ascii=False),
-        tags=data.get("tags", ""),
+        tags=",".join(tags),
     )
     with get_session() as db:
         db.add(enemy)
+        db.flush()
+        _sincronizar_tags(db, "enemies", enemy.id, tags)
         db.commit()
+        invalidar("enemies")
         db.refresh(enemy)
         logger.info(f"✅ Enemigo creado: {enemy.name} (id={enemy.id})")
         return enemy
 
 
-def listar_enemies(tag: Optional[str] = None) -> List[LibraryEnemy]:
+def listar_enemies(tag: Optional[str] = None, match: str = "all") -> List[LibraryEnemy]:
+    tags = normalizar_tags(tag)
     with get_session() as db:
         stmt = select(LibraryEnemy).order_by(LibraryEnemy.name)
-        if tag:
-            stmt = stmt.where(LibraryEnemy.tags.contains(tag))
+        if tags:
+            stmt = stmt.where(_filtro_tags(LibraryEnemy.id, "enemies", tags, match))
         return list(db.exec(stmt).all())
 
 
@@ -115,12 +308,17 @@ def actualizar_enemy(enemy_id: int, data: Dict[str, Any]) -> Optional[LibraryEne
         if not enemy:
             return None
         for key, val in data.items():
-            if key == "abilities":
+            if key == "tags":
+                tags = normalizar_tags(val)
+                enemy.tags = ",".join(tags)
+                _sincronizar_tags(db, "enemies", enemy_id, tags)
+            elif key == "abilities":
                 enemy.abilities_json = json.dumps(val, ensure_ascii=False)
             elif hasattr(enemy, key):
                 setattr(enemy, key, val)
         db.add(enemy)
         db.commit()
+        invalidar("enemies")
         db.refresh(enemy)
         logger.info(f"✏️ Enemigo actualizado: {enemy.name} (id={enemy.id})")
         return enemy
@@ -132,7 +330,9 @@ def eliminar_enemy(enemy_id: int) -> bool:
         if not enemy:
             return False
         db.delete(enemy)
+        db.exec(delete(LibraryTag).where(LibraryTag.content_type == "enemies", LibraryTag.item_id == enemy_id))
         db.commit()
+        invalidar("enemies")
         logger.info(f"🗑️ Enemigo eliminado: {enemy.name} (id={enemy_id})")
         return True
 
@@ -141,6 +341,7 @@ def eliminar_enemy(enemy_id: int) -> bool:
 
 def crear_encounter(data: Dict[str, Any]) -> LibraryEncounter:
     """Crea un encuentro en la biblioteca."""
+    tags = normalizar_tags(data.get("tags"))
     encounter = LibraryEncounter(
         name=data["name"],
         description=data.get("description", ""),
@@ -148,21 +349,25 @@ def crear_encounter(data: Dict[str, Any]) -> LibraryEncounter:
         enemies_json=json.dumps(data.get("enemies", []), ensure_ascii=False),
         environment=data.get("environment", ""),
         loot=data.get("loot", ""),
-        tags=data.get("tags", ""),
+        tags=",".join(tags),
     )
     with get_session() as db:
         db.add(encounter)
+        db.flush()
+        _sincronizar_tags(db, "encounters", encounter.id, tags)
         db.commit()
+        invalidar("encounters")
         db.refresh(encounter)
         logger.info(f"✅ Encuentro creado: {encounter.name} (id={encounter.id})")
         return encounter
 
 
-def listar_encounters(tag: Optional[str] = None) -> List[LibraryEncounter]:
+def listar_encounters(tag: Optional[str] = None, match: str = "all") -> List[LibraryEncounter]:
+    tags = normalizar_tags(tag)
     with get_session() as db:
         stmt = select(LibraryEncounter).order_by(LibraryEncounter.name)
-        if tag:
-            stmt = stmt.where(LibraryEncounter.tags.contains(tag))
+        if tags:
+            stmt = stmt.where(_filtro_tags(LibraryEncounter.id, "encounters", tags, match))
         return list(db.exec(stmt).all())
 
 
@@ -177,12 +382,17 @@ def actualizar_encounter(encounter_id: int, data: Dict[str, Any]) -> Optional[Li
         if not encounter:
             return None
         for key, val in data.items():
-            if key == "enemies":
+            if key == "tags":
+                tags = normalizar_tags(val)
+                encounter.tags = ",".join(tags)
+                _sincronizar_tags(db, "encounters", encounter_id, tags)
+            elif key == "enemies":
                 encounter.enemies_json = json.dumps(val, ensure_ascii=False)
             elif hasattr(encounter, key):
                 setattr(encounter, key, val)
         db.add(encounter)
         db.commit()
+        invalidar("encounters")
         db.refresh(encounter)
         logger.info(f"✏️ Encuentro actualizado: {encounter.name} (id={encounter.id})")
         return encounter
@@ -194,7 +404,9 @@ def eliminar_encounter(encounter_id: int) -> bool:
         if not encounter:
             return False
         db.delete(encounter)
+        db.exec(delete(LibraryTag).where(LibraryTag.content_type == "encounters", LibraryTag.item_id == encounter_id))
         db.commit()
+        invalidar("encounters")
         logger.info(f"🗑️ Encuentro eliminado: {encounter.name} (id={encounter_id})")
         return True
 
@@ -203,6 +415,7 @@ def eliminar_encounter(encounter_id: int) -> bool:
 
 def crear_item(data: Dict[str, Any]) -> LibraryItem:
     """Crea un item en la biblioteca."""
+    tags = normalizar_tags(data.get("tags"))
     item = LibraryItem(
         name=data["name"],
         item_type=data.get("item_type", "objeto"),
@@ -212,21 +425,25 @@ def crear_item(data: Dict[str, Any]) -> LibraryItem:
         description=data.get("description", ""),
         value_gp=data.get("value_gp", 0),
         weight=data.get("weight", 0.0),
-        tags=data.get("tags", ""),
+        tags=",".join(tags),
     )
     with get_session() as db:
         db.add(item)
+        db.flush()
+        _sincronizar_tags(db, "items", item.id, tags)
         db.commit()
+        invalidar("items")
         db.refresh(item)
         logger.info(f"✅ Item creado: {item.name} (id={item.id})")
         return item
 
 
-def listar_items(tag: Optional[str] = None, item_type: Optional[str] = None) -> List[LibraryItem]:
+def listar_items(tag: Optional[str] = None, item_type: Optional[str] = None, match: str = "all") -> List[LibraryItem]:
+    tags = normalizar_tags(tag)
     with get_session() as db:
         stmt = select(LibraryItem).order_by(LibraryItem.name)
-        if tag:
-            stmt = stmt.where(LibraryItem.tags.contains(tag))
+        if tags:
+            stmt = stmt.where(_filtro_tags(LibraryItem.id, "items", tags, match))
         if item_type:
             stmt = stmt.where(LibraryItem.item_type == item_type)
         return list(db.exec(stmt).all())
@@ -243,10 +460,15 @@ def actualizar_item(item_id: int, data: Dict[str, Any]) -> Optional[LibraryItem]
         if not item:
             return None
         for key, val in data.items():
-            if hasattr(item, key):
+            if key == "tags":
+                tags = normalizar_tags(val)
+                item.tags = ",".join(tags)
+                _sincronizar_tags(db, "items", item_id, tags)
+            elif hasattr(item, key):
                 setattr(item, key, val)
         db.add(item)
         db.commit()
+        invalidar("items")
         db.refresh(item)
         logger.info(f"✏️ Item actualizado: {item.name} (id={item.id})")
         return item
@@ -258,11 +480,131 @@ def eliminar_item(item_id: int) -> bool:
         if not item:
             return False
         db.delete(item)
+        db.exec(delete(LibraryTag).where(LibraryTag.content_type == "items", LibraryTag.item_id == item_id))
         db.commit()
+        invalidar("items")
         logger.info(f"🗑️ Item eliminado: {item.name} (id={item_id})")
         return True
 
 
+# ─── Búsqueda de texto (FTS5) ────────────────────────────
+
+# tipo -> (tabla, desplazamiento del rowid, texto indexado como expresión SQL sobre la fila {f}).
+# rowid = id * 4 + desplazamiento, para que los triggers borren por rowid sin recorrer la tabla.
+_TEXTO_JSON = "coalesce(CASE WHEN json_valid({col}) THEN (SELECT group_concat(value, ' ') FROM json_tree({col}) WHERE type = 'text') END, '')"
+_FTS_TIPOS = {
+    "npcs": ("library_npcs", 0, "{f}.description || ' ' || {f}.personality || ' ' || {f}.race || ' ' || {f}.class_name"),
+    "enemies": ("library_enemies", 1, _TEXTO_JSON.format(col="{f}.abilities_json")),
+    "encounters": ("library_encounters", 2, "{f}.description || ' ' || {f}.environment || ' ' || {f}.loot || ' ' || "
+                   + _TEXTO_JSON.format(col="{f}.enemies_json")),
+    "items": ("library_items", 3, "{f}.description || ' ' || {f}.properties || ' ' || {f}.item_type || ' ' || {f}.rarity"),
+}
+# Coincidencias FTS que buscar_biblioteca considera por consulta
+FTS_CANDIDATOS = 500
+
+_fts_activo = False
+
+
+def crear_indice_fts() -> bool:
+    """
+    Crea library_fts y sus triggers si faltan, y la reconstruye si no cuadra
+    con las tablas (p. ej. la primera vez). Retorna False si SQLite no tiene FTS5.
+    """
+    global _fts_activo
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as con:
+            con.exec_driver_sql(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS library_fts USING fts5("
+                "content_type UNINDEXED, item_id UNINDEXED, name, body, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+            for content_type, (tabla, k, cuerpo) in _FTS_TIPOS.items():
+                insertar = (
+                    f"INSERT INTO library_fts(rowid, content_type, item_id, name, body) "
+                    f"VALUES (new.id * 4 + {k}, '{content_type}', new.id, new.name, {cuerpo.format(f='new')});"
+                )
+                borrar = f"DELETE FROM library_fts WHERE rowid = old.id * 4 + {k};"
+                con.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {tabla}_fts_ai AFTER INSERT ON {tabla} BEGIN {insertar} END")
+                con.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {tabla}_fts_au AFTER UPDATE ON {tabla} BEGIN {borrar} {insertar} END")
+                con.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {tabla}_fts_ad AFTER DELETE ON {tabla} BEGIN {borrar} END")
+
+            entradas = sum(con.exec_driver_sql(f"SELECT count(*) FROM {t}").scalar() for t, _, _ in _FTS_TIPOS.values())
+            if con.exec_driver_sql("SELECT count(*) FROM library_fts").scalar() != entradas:
+                con.exec_driver_sql("DELETE FROM library_fts")
+                for content_type, (tabla, k, cuerpo) in _FTS_TIPOS.items():
+                    con.exec_driver_sql(
+                        f"INSERT INTO library_fts(rowid, content_type, item_id, name, body) "
+                        f"SELECT f.id * 4 + {k}, '{content_type}', f.id, f.name, {cuerpo.format(f='f')} FROM {tabla} AS f"
+                    )
+                logger.info(f"🔎 Índice FTS de la biblioteca reconstruido ({entradas} entradas)")
+    except OperationalError as e:
+        logger.warning(f"⚠️ FTS5 no disponible, la búsqueda usará LIKE sobre el nombre: {e}")
+        _fts_activo = False
+        return False
+    _fts_activo = True
+    return True
+
+
+def _consulta_fts(q: str) -> str:
+    """Texto libre -> consulta FTS5: cada palabra como prefijo, todas requeridas."""
+    return " ".join(f'"{palabra}"*' for palabra in re.findall(r"\w+", q.lower()))
+
+
+def _buscar_fts(db, q: str, tipos: List[str], limit: int) -> List[Dict[str, Any]]:
+    consulta = _consulta_fts(q)
+    if not consulta:
+        return []
+    stmt = text(
+        "SELECT content_type, item_id, name, "
+        "snippet(library_fts, -1, '«', '»', '…', 12) AS snippet, "
+        "bm25(library_fts, 0, 0, 10.0, 1.0) AS score "
+        "FROM library_fts WHERE library_fts MATCH :consulta AND content_type IN :tipos "
+        "ORDER BY score LIMIT :limit"
+    ).bindparams(bindparam("tipos", expanding=True))
+    filas = db.exec(stmt, params={"consulta": consulta, "tipos": tipos, "limit": limit}).all()
+    return [
+        {"type": f.content_type, "id": f.item_id, "name": f.name, "snippet": f.snippet, "score": round(-f.score, 3)}
+        for f in filas
+    ]
+
+
+def buscar_texto(q: str, content_type: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Búsqueda de texto en toda la biblioteca con una sola consulta FTS5,
+    ordenada por relevancia: [{type, id, name, snippet, score}].
+    """
+    tipos = [content_type] if content_type else list(MODELOS)
+    if not _fts_activo:
+        resultados = buscar_biblioteca(q=q, content_type=content_type)
+        return [
+            {"type": tipo, "id": r["id"], "name": r["name"], "snippet": "", "score": 0.0}
+            for tipo in tipos for r in resultados.get(tipo, [])
+        ][:limit]
+    with get_session() as db:
+        return _buscar_fts(db, q, tipos, limit)
+
+
+def _filtro_texto(stmt, modelo, content_type: str, q: Optional[str], ranking: Optional[Dict[str, Dict[int, Any]]]):
+    if not q:
+        return stmt
+    if ranking is None:
+        return stmt.where(modelo.name.contains(q))
+    return stmt.where(modelo.id.in_(list(ranking.get(content_type, {}))))
+
+
+def _por_relevancia(filas: List[Dict[str, Any]], content_type: str,
+                    ranking: Optional[Dict[str, Dict[int, Any]]]) -> List[Dict[str, Any]]:
+    """Ordena por la posición FTS y agrega el fragmento resaltado."""
+    if ranking is None:
+        return filas
+    posiciones = ranking.get(content_type, {})
+    for fila in filas:
+        fila["snippet"] = posiciones[fila["id"]][1]
+    return sorted(filas, key=lambda fila: posiciones[fila["id"]][0])
+
+
 # ─── Búsqueda Global ─────────────────────────────────────
 
 def buscar_biblioteca(
@@ -271,74 +613,214 @@ def buscar_biblioteca(
     cr_min: Optional[float] = None,
     cr_max: Optional[float] = None,
     tag: Optional[str] = None,
+    match: str = "all",
 ) -> Dict[str, List[Dict[str, Any]]]:
-    """Búsqueda global en toda la biblioteca."""
+    """
+    Búsqueda global en toda la biblioteca. Con `q` y FTS5 activo, una sola
+    consulta de texto decide qué entradas entran y en qué orden (relevancia).
+    """
     results: Dict[str, List[Dict[str, Any]]] = {}
+    tags = normalizar_tags(tag)
 
     with get_session() as db:
+        ranking = None
+        if q and _fts_activo:
+            tipos = [content_type] if content_type else list(MODELOS)
+            ranking = {tipo: {} for tipo in tipos}
+            for pos, r in enumerate(_buscar_fts(db, q, tipos, FTS_CANDIDATOS)):
+                ranking[r["type"]][r["id"]] = (pos, r["snippet"])
+
         # Enemigos
         if not content_type or content_type == "enemies":
             stmt = select(LibraryEnemy).order_by(LibraryEnemy.name)
-            if q:
-                stmt = stmt.where(LibraryEnemy.name.contains(q))
-            if tag:
-                stmt = stmt.where(LibraryEnemy.tags.contains(tag))
+            stmt = _filtro_texto(stmt, LibraryEnemy, "enemies", q, ranking)
+            if tags:
+                stmt = stmt.where(_filtro_tags(LibraryEnemy.id, "enemies", tags, match))
             if cr_min is not None:
                 stmt = stmt.where(LibraryEnemy.cr >= cr_min)
             if cr_max is not None:
                 stmt = stmt.where(LibraryEnemy.cr <= cr_max)
             enemies = db.exec(stmt).all()
-            results["enemies"] = [
+            results["enemies"] = _por_relevancia([
                 {"id": e.id, "name": e.name, "cr": e.cr, "hp": e.hp, "ac": e.ac,
                  "attack": e.attack, "damage": e.damage, "tags": e.tags,
                  "abilities": json.loads(e.abilities_json) if e.abilities_json else []}
                 for e in enemies
-            ]
+            ], "enemies", ranking)
 
         # NPCs
         if not content_type or content_type == "npcs":
             stmt = select(LibraryNPC).order_by(LibraryNPC.name)
-            if q:
-                stmt = stmt.where(LibraryNPC.name.contains(q))
-            if tag:
-                stmt = stmt.where(LibraryNPC.tags.contains(tag))
+            stmt = _filtro_texto(stmt, LibraryNPC, "npcs", q, ranking)
+            if tags:
+                stmt = stmt.where(_filtro_tags(LibraryNPC.id, "npcs", tags, match))
             npcs = db.exec(stmt).all()
-            results["npcs"] = [
+            results["npcs"] = _por_relevancia([
                 {"id": n.id, "name": n.name, "race": n.race, "class_name": n.class_name,
                  "description": n.description, "personality": n.personality, "tags": n.tags,
                  "stats": json.loads(n.stats_json) if n.stats_json else {}}
                 for n in npcs
-            ]
+            ], "npcs", ranking)
 
         # Items
         if not content_type or content_type == "items":
             stmt = select(LibraryItem).order_by(LibraryItem.name)
-            if q:
-                stmt = stmt.where(LibraryItem.name.contains(q))
-            if tag:
-                stmt = stmt.where(LibraryItem.tags.contains(tag))
+            stmt = _filtro_texto(stmt, LibraryItem, "items", q, ranking)
+            if tags:
+                stmt = stmt.where(_filtro_tags(LibraryItem.id, "items", tags, match))
             items = db.exec(stmt).all()
-            results["items"] = [
+            results["items"] = _por_relevancia([
                 {"id": i.id, "name": i.name, "item_type": i.item_type,
                  "rarity": i.rarity, "damage": i.damage, "properties": i.properties,
                  "description": i.description, "value_gp": i.value_gp, "tags": i.tags}
                 for i in items
-            ]
+            ], "items", ranking)
 
         # Encuentros
         if not content_type or content_type == "encounters":
             stmt = select(LibraryEncounter).order_by(LibraryEncounter.name)
-            if q:
-                stmt = stmt.where(LibraryEncounter.name.contains(q))
-            if tag:
-                stmt = stmt.where(LibraryEncounter.tags.contains(tag))
+            stmt = _filtro_texto(stmt, LibraryEncounter, "encounters", q, ranking)
+            if tags:
+                stmt = stmt.where(_filtro_tags(LibraryEncounter.id, "encounters", tags, match))
             encounters = db.exec(stmt).all()
-            results["encounters"] = [
+            results["encounters"] = _por_relevancia([
                 {"id": enc.id, "name": enc.name, "description": enc.description,
                  "difficulty": enc.difficulty, "environment": enc.environment,
                  "loot": enc.loot, "tags": enc.tags,
                  "enemies": json.loads(enc.enemies_json) if enc.enemies_json else []}
                 for enc in encounters
-            ]
+            ], "encounters", ranking)
 
     return results
+
+
+# ─── Importar / exportar (NDJSON) ────────────────────────
+
+# Campos JSON que en NDJSON viajan decodificados: clave -> columna
+_CAMPOS_JSON = {
+    "npcs": {"stats": "stats_json"},
+    "enemies": {"abilities": "abilities_json"},
+    "encounters": {"enemies": "enemies_json"},
+    "items": {},
+}
+_NO_IMPORTABLES = {"id", "created_at"}
+
+
+def _a_registro(content_type: str, fila) -> Dict[str, Any]:
+    registro: Dict[str, Any] = {"type": content_type}
+    columnas_json = {col: clave for clave, col in _CAMPOS_JSON[content_type].items()}
+    for campo in MODELOS[content_type].model_fields:
+        if campo in _NO_IMPORTABLES:
+            continue
+        valor = getattr(fila, campo)
+        if campo in columnas_json:
+            registro[columnas_json[campo]] = json.loads(valor) if valor else None
+        else:
+            registro[campo] = valor
+    return registro
+
+
+def exportar_lote(content_type: str, desde_id: int, limit: int = LIBRARY_BULK_BATCH) -> Tuple[str, Optional[int]]:
+    """
+    Siguiente bloque de la exportación: líneas NDJSON de las entradas con
+    id > desde_id y el último id leído (None si no quedan).
+    """
+    modelo = MODELOS[content_type]
+    with get_session() as db:
+        filas = db.exec(select(modelo).where(modelo.id > desde_id).order_by(modelo.id).limit(limit)).all()
+        lineas = "".join(json.dumps(_a_registro(content_type, f), ensure_ascii=False) + "\n" for f in filas)
+    return lineas, (filas[-1].id if filas else None)
+
+
+def validar_registro(registro: Any) -> Tuple[str, Dict[str, Any]]:
+    """
+    Valida una entrada importada y la convierte en columnas del modelo.
+
+    Returns:
+        (content_type, {columna: valor})
+
+    Raises:
+        ValueError: con el motivo, si la entrada no es válida
+    """
+    if not isinstance(registro, dict):
+        raise ValueError("La línea no es un objeto JSON")
+    content_type = registro.get("type")
+    if content_type not in MODELOS:
+        raise ValueError(f"Tipo no válido: {content_type!r}")
+    nombre = registro.get("name")
+    if not isinstance(nombre, str) or not nombre.strip():
+        raise ValueError("Falta el nombre")
+
+    modelo = MODELOS[content_type]
+    campos_json = _CAMPOS_JSON[content_type]
+    columnas: Dict[str, Any] = {"name": nombre.strip()}
+    for clave, valor in registro.items():
+        if clave in ("type", "name") or clave in _NO_IMPORTABLES:
+            continue
+        if clave in campos_json:
+            columnas[campos_json[clave]] = json.dumps(valor, ensure_ascii=False)
+        elif clave == "tags":
+            columnas["tags"] = ",".join(normalizar_tags(valor))
+        elif clave in modelo.model_fields and clave not in campos_json.values():
+            esperado = modelo.model_fields[clave].annotation
+            if esperado is float and isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                valor = float(valor)
+            elif esperado is int and isinstance(valor, float) and valor.is_integer():
+                valor = int(valor)
+            if not isinstance(valor, esperado) or isinstance(valor, bool):
+                raise ValueError(f"{clave}: se esperaba {esperado.__name__}")
+            columnas[clave] = valor
+        else:
+            raise ValueError(f"Campo desconocido para {content_type}: {clave}")
+    return content_type, columnas
+
+
+def importar_lote(registros: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, int]:
+    """
+    Upsert por nombre de entradas ya validadas, en una sola transacción:
+    las que existen (mismo tipo y nombre) se actualizan con los campos
+    recibidos, el resto se crea. Los tags y el índice FTS quedan al día.
+
+    Returns:
+        {"created": n, "updated": n}
+    """
+    # Por tipo y nombre; si un nombre se repite en el lote gana la última línea
+    grupos: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for content_type, columnas in registros:
+        grupos.setdefault(content_type, {})[columnas["name"]] = columnas
+
+    creadas = actualizadas = 0
+    with get_session() as db:
+        for content_type, por_nombre in grupos.items():
+            modelo = MODELOS[content_type]
+            existentes: Dict[str, Any] = {}
+            for fila in db.exec(select(modelo).where(modelo.name.in_(list(por_nombre))).order_by(modelo.id)).all():
+                existentes.setdefault(fila.name, fila)
+
+            tocadas = []
+            for nombre, columnas in por_nombre.items():
+                fila = existentes.get(nombre)
+                if fila is None:
+                    fila = modelo(**columnas)
+                    creadas += 1
+                else:
+                    for clave, valor in columnas.items():
+                        setattr(fila, clave, valor)
+                    actualizadas += 1
+                db.add(fila)
+                tocadas.append(fila)
+            db.flush()
+
+            ids = [f.id for f in tocadas]
+            db.exec(delete(LibraryTag).where(LibraryTag.content_type == content_type, LibraryTag.item_id.in_(ids)))
+            tags = [
+                {"content_type": content_type, "item_id": f.id, "tag": tag}
+                for f in tocadas for tag in normalizar_tags(f.tags)
+            ]
+            if tags:
+                db.execute(insert(LibraryTag), tags)
+        db.commit()
+
+    if grupos:
+        invalidar(*grupos)
+    return {"created": creadas, "updated": actualizadas}
@@ -247,4 +247,9 @@ def seed_library_if_empty():
             db.add(LibraryEncounter(**data))
 
         db.commit()
-        logger.info(f"✅ SRD sembrado: {len(SRD_ENEMIES)} enemigos, {len(SRD_NPCS)} NPCs, {len(SRD_ITEMS)} items, {len(SRD_ENCOUNTERS)} encuentros")
+
+    # Las entradas sembradas entran al índice de tags
+    from app.components.dnd.library import indexar_tags_pendientes, invalidar
+    indexar_tags_pendientes()
+    invalidar()
+    logger.info(f"✅ SRD sembrado: {len(SRD_ENEMIES)} enemigos, {len(SRD_NPCS)} NPCs, {len(SRD_ITEMS)} items, {len(SRD_ENCOUNTERS)} encuentros")
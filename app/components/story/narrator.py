@@ -1,12 +1,111 @@
+import os
 import urllib.parse
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Awaitable
 from app.logger import setup_logger
-from app.components.ai.client import generar_con_ia
+from app.components.ai.client import generar_con_ia_async, ConversacionLLM
+from app.components.ai.scheduler import ColaLLMLlena
 
 logger = setup_logger("narrator")
 
-def _generar_esquema_aventura(setting: str, estilo: Dict[str, str], pjs: list, nivel: int) -> Optional[Dict[str, Any]]:
-    """Genera el esquema maestro de la aventura (Título, Sinopsis, 5 Actos)"""
+# Presupuesto (tokens aprox.) del resumen que la cascada arrastra de escena en escena
+RESUMEN_TOKENS_MAX = int(os.getenv("SCENE_SUMMARY_TOKENS", "350"))
+# Escenas recientes que se conservan literales antes de condensarse en el digest
+RESUMEN_ESCENAS_RECIENTES = int(os.getenv("SCENE_SUMMARY_RECENT", "2"))
+
+def _estimar_tokens(texto: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token)"""
+    return len(texto) // 4 + 1
+
+
+class ResumenRodante:
+    """
+    Contexto acotado que la cascada pasa a cada escena.
+    
+    Guarda la sinopsis, las últimas escenas casi literales y un digest de las
+    anteriores. Cuando el texto supera el presupuesto, las escenas más viejas
+    se condensan en el digest con una llamada corta a la IA (o se recortan si
+    falla), así el prompt de cada escena no crece con el largo de la aventura.
+    """
+    
+    def __init__(self, sinopsis: str, max_tokens: int = RESUMEN_TOKENS_MAX, recientes: int = RESUMEN_ESCENAS_RECIENTES):
+        self.sinopsis = sinopsis
+        self.max_tokens = max_tokens
+        self.max_recientes = max(1, recientes)
+        self.digest = ""
+        self.recientes: List[str] = []
+        self.compactaciones = 0
+    
+    def texto(self) -> str:
+        partes = [f"Sinopsis: {self.sinopsis}."]
+        if self.digest:
+            partes.append(f"Hasta ahora: {self.digest}")
+        partes.extend(self.recientes)
+        return " ".join(partes)
+    
+    def tokens(self) -> int:
+        return _estimar_tokens(self.texto())
+    
+    async def agregar(self, numero_escena: int, escena: Dict[str, Any]):
+        """Suma una escena terminada y compacta si se pasa del presupuesto"""
+        self.recientes.append(f"Escena {numero_escena}: {str(escena.get('narrativa', ''))[:200]}...")
+        if self.tokens() > self.max_tokens:
+            await self._compactar()
+    
+    async def _compactar(self):
+        """Condensa en el digest todas las escenas salvo las más recientes"""
+        if len(self.recientes) <= self.max_recientes:
+            return
+        
+        corte = max(1, len(self.recientes) - self.max_recientes)
+        viejas, self.recientes = self.recientes[:corte], self.recientes[corte:]
+        
+        # El digest ocupa como máximo un tercio del presupuesto (deja sitio a varias escenas)
+        palabras = max(20, self.max_tokens // 3 * 3 // 4)
+        prompt = f"""Resume en un DIGEST de máximo {palabras} palabras (español, 3ra persona) lo ocurrido hasta ahora
+en esta aventura, conservando nombres, pistas y objetos importantes.
+
+DIGEST PREVIO: {self.digest or "(vacío)"}
+ESCENAS A INCORPORAR:
+{chr(10).join(viejas)}
+
+JSON REQUERIDO: {{ "resumen": "..." }}"""
+
+        try:
+            resultado = await generar_con_ia_async(prompt, use_cache=True)
+        except ColaLLMLlena:
+            resultado = None
+        if isinstance(resultado, dict) and resultado.get('resumen'):
+            self.digest = str(resultado['resumen'])
+        else:
+            # Sin IA: recorte mecánico, quedándose con lo más reciente
+            logger.warning("Compactación del resumen sin respuesta de IA, se recorta el digest")
+            self.digest = f"{self.digest} {' '.join(viejas)}".strip()
+        
+        limite = self.max_tokens // 3 * 4
+        if len(self.digest) > limite:
+            self.digest = "..." + self.digest[-limite:]
+        
+        self.compactaciones += 1
+        logger.info(f"Resumen rodante compactado ({self.tokens()} tokens aprox., {self.compactaciones} compactaciones)")
+
+# Papel dramático de las escenas intermedias (la primera introduce, la última resuelve)
+_PAPELES_INTERMEDIOS = ["Desarrollo/Viaje/Investigación.", "Giro/Complicación/Dungeon.", "Clímax previo/Revelación."]
+
+def _plantilla_escenas(num_escenas: int) -> str:
+    """Líneas JSON de ejemplo del esquema para num_escenas escenas"""
+    lineas = []
+    for i in range(1, num_escenas + 1):
+        if i == 1:
+            papel = "Qué pasa aquí (1-2 líneas). Introducción."
+        elif i == num_escenas:
+            papel = "Confrontación Final y Resolución."
+        else:
+            papel = _PAPELES_INTERMEDIOS[min((i - 2) * 3 // (num_escenas - 2), 2)]
+        lineas.append(f'    {{ "id": {i}, "titulo": "Nombre Escena {i}", "resumen": "{papel}" }}')
+    return ",\n".join(lineas)
+
+async def _generar_esquema_aventura(setting: str, estilo: Dict[str, str], pjs: list, nivel: int, num_escenas: int = 5) -> Optional[Dict[str, Any]]:
+    """Genera el esquema maestro de la aventura (Título, Sinopsis, N Actos)"""
     nombres = ", ".join([f"{p['nombre']} ({p['clase']})" for p in pjs])
     
     prompt = f"""Eres un DUNGEON MASTER EXPERTO diseñando el esquema de una aventura de D&D 5e.
@@ -14,7 +113,7 @@ MUNDO: {setting}
 ESTILO: {estilo.get('desc', 'Fantasía heroica')}
 PERSONAJES (Nivel {nivel}): {nombres}
 
-OBJETIVO: Crea la ESTRUCTURA de una aventura de 5 ESCENAS (5 Actos).
+OBJETIVO: Crea la ESTRUCTURA de una aventura de {num_escenas} ESCENAS ({num_escenas} Actos).
 NO generes diálogos ni textos largos, solo el ESQUELETO.
 
 JSON REQUERIDO (ESPAÑOL):
@@ -23,36 +122,37 @@ JSON REQUERIDO (ESPAÑOL):
   "sinopsis": "Resumen general del conflicto (2-3 líneas)",
   "hook_principal": "Motivo por el que el grupo es contratado o involucrado",
   "esquema_escenas": [
-    {{ "id": 1, "titulo": "Nombre Escena 1", "resumen": "Qué pasa aquí (1-2 líneas). Introducción." }},
-    {{ "id": 2, "titulo": "Nombre Escena 2", "resumen": "Desarrollo/Viaje/Investigación." }},
-    {{ "id": 3, "titulo": "Nombre Escena 3", "resumen": "Giro/Complicación/Dungeon." }},
-    {{ "id": 4, "titulo": "Nombre Escena 4", "resumen": "Clímax previo/Revelación." }},
-    {{ "id": 5, "titulo": "Nombre Escena 5", "resumen": "Confrontación Final y Resolución." }}
+{_plantilla_escenas(num_escenas)}
   ],
   "plot_twist": "Revelación final inesperada"
 }}"""
 
-    esquema = generar_con_ia(prompt, use_cache=True)
+    # Sin caché, como los PJs: el mismo mundo y grupo no debe repetir la trama
+    esquema = await generar_con_ia_async(prompt, use_cache=False)
     if not esquema or 'esquema_escenas' not in esquema:
         logger.error("Fallo generando esquema, usando fallback")
         return None # El orquestador manejará el fallback
     return esquema
 
-def _expandir_escena(esquema: Dict, resumen_previo: str, nivel: int, numero_escena: int, pjs: list) -> Optional[Dict[str, Any]]:
-    """Genera el contenido detallado de una escena específica siguiendo el esquema"""
-    escena_target = next((e for e in esquema['esquema_escenas'] if e['id'] == numero_escena), None)
-    if not escena_target:
-        return None
-
+def _conversacion_escenas(esquema: Dict, nivel: int, pjs: list) -> ConversacionLLM:
+    """
+    Prefijo común a todas las escenas de la aventura (reglas, plantilla JSON,
+    esquema completo y grupo). Se evalúa una vez en Ollama y cada escena solo
+    envía su parte propia sobre ese contexto.
+    """
     nombres_pjs = ", ".join([p['nombre'] for p in pjs])
+    lineas_esquema = "\n".join(
+        f"  {e['id']}. {e['titulo']}: {e['resumen']}" for e in esquema.get('esquema_escenas', [])
+    )
     
-    prompt = f"""Eres un DUNGEON MASTER y ESCRITOR DE FANTASÍA EXPERTO.
-CONTEXTO: Aventura "{esquema['titulo']}".
-RESUMEN PREVIO: {resumen_previo}
-ESCENA ACTUAL ({numero_escena}/5): "{escena_target['titulo']}" - {escena_target['resumen']}
+    prefijo = f"""Eres un DUNGEON MASTER y ESCRITOR DE FANTASÍA EXPERTO.
+AVENTURA: "{esquema['titulo']}" - {esquema.get('sinopsis', '')}
+ESQUEMA COMPLETO:
+{lineas_esquema}
+GRUPO: {nombres_pjs}
 NIVEL DEL GRUPO: {nivel} (CRÍTICO para balance)
 
-OBJETIVO: Generar el contenido JSON detallado para la Escena {numero_escena}.
+Vas a generar, una por una, el contenido JSON detallado de las escenas de este esquema.
 
 REGLAS DE GENERACIÓN:
 1. NARRATIVA: Español, 3ra persona, sensorial (olores, luces, sonidos).
@@ -66,10 +166,10 @@ REGLAS DE GENERACIÓN:
    - El BOTÍN (loot) DEBE ser apropiado para Nivel {nivel}. Oro abundante y magia a nivel alto; miseria a nivel 1.
 4. AMBIENTE AUDIO: Describe el paisaje sonoro.
 
-JSON REQUERIDO (NO DEVOLVER MARDOWN, SOLO JSON PURO):
+JSON REQUERIDO POR ESCENA (NO DEVOLVER MARDOWN, SOLO JSON PURO):
 {{
-  "id": {numero_escena},
-  "nombre": "{escena_target['titulo']}",
+  "id": 0,
+  "nombre": "Título de la escena",
   "narrativa": "Texto literario en español...",
   "visual_prompt": "ENGLISH visual description...",
   "ambiente_audio": "Sonidos de fondo...",
@@ -83,10 +183,78 @@ JSON REQUERIDO (NO DEVOLVER MARDOWN, SOLO JSON PURO):
   "botin": ["10 po", "Daga oxidada"],
   "transicion": "Pista a la siguiente escena"
 }}"""
+    
+    return ConversacionLLM(prefijo)
+
+async def _expandir_escena(esquema: Dict, resumen_previo: str, nivel: int, numero_escena: int, pjs: list, on_chunk: Optional[Callable[[str], Awaitable[None]]] = None, conversacion: Optional[ConversacionLLM] = None) -> Optional[Dict[str, Any]]:
+    """
+    Genera el contenido detallado de una escena específica siguiendo el esquema.
+    Si se pasa on_chunk, el texto se recibe en streaming a medida que se genera.
+    Las escenas de una misma aventura deberían compartir `conversacion`
+    (ver _conversacion_escenas) para que el prefijo común se evalúe una sola vez.
+    """
+    escena_target = next((e for e in esquema['esquema_escenas'] if e['id'] == numero_escena), None)
+    if not escena_target:
+        return None
+    
+    conversacion = conversacion or _conversacion_escenas(esquema, nivel, pjs)
+    
+    total = len(esquema['esquema_escenas'])
+    prompt = f"""RESUMEN PREVIO: {resumen_previo}
+ESCENA ACTUAL ({numero_escena}/{total}): "{escena_target['titulo']}" - {escena_target['resumen']}
 
-    return generar_con_ia(prompt, use_cache=True)
+OBJETIVO: Generar el contenido JSON detallado para la Escena {numero_escena}.
+Usa "id": {numero_escena} y "nombre": "{escena_target['titulo']}"."""
+
+    return await generar_con_ia_async(prompt, use_cache=True, on_chunk=on_chunk, conversacion=conversacion)
+
+async def _revisar_consistencia(esquema: Dict, escenas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Pasada barata de consistencia para escenas generadas en paralelo:
+    la IA solo re-escribe las transiciones para que cada escena lleve a la siguiente.
+    Modifica las escenas in-place; si falla, las deja como están.
+    """
+    lineas = []
+    for e in escenas:
+        lineas.append(
+            f"- Escena {e.get('id')}: \"{e.get('nombre', '')}\". "
+            f"Inicio: {str(e.get('narrativa', ''))[:150]}... "
+            f"Transición actual: {e.get('transicion', '')}"
+        )
+    
+    prompt = f"""Eres un EDITOR de aventuras de D&D 5e.
+AVENTURA: "{esquema['titulo']}" - {esquema['sinopsis']}
+Las escenas se escribieron por separado. Revisa que formen un arco coherente.
+
+ESCENAS:
+{chr(10).join(lineas)}
+
+OBJETIVO: Re-escribe SOLO el campo "transicion" de cada escena (1-2 líneas, español, 3ra persona)
+para que conduzca de forma natural al inicio de la siguiente. La última cierra la aventura.
+
+JSON REQUERIDO:
+{{ "transiciones": [ {{ "id": 1, "transicion": "..." }} ] }}"""
+
+    try:
+        revision = await generar_con_ia_async(prompt, use_cache=True)
+    except ColaLLMLlena:
+        revision = None
+    if not revision or not isinstance(revision.get('transiciones'), list):
+        logger.warning("Pasada de consistencia sin resultado, se mantienen las transiciones originales")
+        return escenas
+    
+    por_id = {e.get('id'): e for e in escenas}
+    for t in revision['transiciones']:
+        if not isinstance(t, dict):
+            continue
+        escena = por_id.get(t.get('id'))
+        if escena is not None and t.get('transicion'):
+            escena['transicion'] = t['transicion']
+    
+    logger.info(f"✓ Pasada de consistencia aplicada a {len(escenas)} escenas")
+    return escenas
 
-def _generar_historia(setting: str, estilo: Dict[str, str], pjs: list, nivel: int) -> Dict[str, Any]:
+async def _generar_historia(setting: str, estilo: Dict[str, str], pjs: list, nivel: int) -> Dict[str, Any]:
     """Genera la estructura dramática de la aventura Nivel {nivel}"""
     nombres = ", ".join([p['nombre'] for p in pjs])
     
@@ -154,7 +322,7 @@ IMPORTANTE:
 - Enemigos balanceados para Nivel 1
 - SIEMPRE en ESPAÑOL (salvo visual_prompt) y TERCERA PERSONA"""
     
-    historia = generar_con_ia(prompt)
+    historia = await generar_con_ia_async(prompt, use_cache=False)
     
     if not historia or 'escenas' not in historia or len(historia.get('escenas', [])) < 5:
         logger.warning("Fallo generación de historia o menos de 5 escenas, usando historia enriquecida fallback")
@@ -171,10 +339,12 @@ IMPORTANTE:
 
 def _historia_fallback_enriquecida() -> Dict:
     """
-    Historia de emergencia ENRIQUECIDA con 5 escenas narrativamente ricas
+    Historia de emergencia ENRIQUECIDA con 5 escenas narrativamente ricas.
+    Lleva "emergencia": True para que el pool no la guarde como aventura de stock.
     """
     logger.info("Usando historia fallback ENRIQUECIDA (5 escenas)")
     return {
+        "emergencia": True,
         "titulo": "El Secreto de las Ruinas de Sombraluna",
         "sinopsis": "Un misterioso patrón contrata a los aventureros para recuperar un artefacto de unas ruinas antiguas. Pero las ruinas esconden secretos que algunos preferirían mantener enterrados para siempre.",
         
@@ -5,8 +5,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Configuración IA
-OLLAMA_URL = "http://localhost:11434/api/generate"
-MODELO = "mistral-nemo"
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
+MODELO = os.getenv("MODELO", "mistral-nemo")
 SAVE_DIR = "partidas_guardadas"
 
 if not os.path.exists(SAVE_DIR):
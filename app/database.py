@@ -1,21 +1,85 @@
 """
 Motor de base de datos SQLite con SQLModel.
+
+Cada conexión del pool se abre con WAL, synchronous=NORMAL, mmap y caché
+propia, y el trabajo de DB de los endpoints corre en un pool de hilos
+dedicado (run_db) para que los fsync de SQLite no bloqueen el event loop.
 """
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+from sqlalchemy import event
 from sqlmodel import create_engine, SQLModel, Session
 from app.logger import setup_logger
 
 logger = setup_logger("database")
 
-DATABASE_URL = "sqlite:///cronista.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///cronista.db")
+
+# Ajustes de SQLite y del pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_THREADS = int(os.getenv("DB_THREADS", "4"))
+DB_MMAP_MB = int(os.getenv("DB_MMAP_MB", "64"))
+DB_CACHE_MB = int(os.getenv("DB_CACHE_MB", "16"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+_ES_SQLITE = DATABASE_URL.startswith("sqlite")
+
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_SIZE,
+    # Las conexiones del pool se usan desde los hilos de run_db
+    connect_args={"check_same_thread": False} if _ES_SQLITE else {},
+)
+
+
+if _ES_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _configurar_sqlite(dbapi_connection, _connection_record):
+        """PRAGMAs por conexión (journal_mode=WAL además queda grabado en el archivo)"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={DB_MMAP_MB * 1024 * 1024}")
+        cursor.execute(f"PRAGMA cache_size=-{DB_CACHE_MB * 1024}")  # negativo = KiB
+        cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="cronista-db")
+
+T = TypeVar("T")
 
-engine = create_engine(DATABASE_URL, echo=False)
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Ejecuta una función síncrona de DB en el pool de hilos de la base de datos.
+
+    Uso:
+        campaigns = await run_db(_listar_campanas)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
 
 
 def init_db():
     """Crea todas las tablas si no existen y siembra datos SRD."""
-    from app.db_models import Campaign, JournalEntryDB, LibraryNPC, LibraryEnemy, LibraryEncounter, LibraryItem  # noqa: F401
+    from app.db_models import Campaign, CampaignSection, CampaignDelta, GenerationJob, PooledAdventure, JournalEntryDB, NarrativeSummary, LibraryNPC, LibraryEnemy, LibraryEncounter, LibraryItem, LibraryTag  # noqa: F401
     SQLModel.metadata.create_all(engine)
-    logger.info("✅ Base de datos SQLite inicializada (cronista.db)")
+    # create_all no agrega índices nuevos a tablas que ya existían
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    logger.info(f"✅ Base de datos SQLite inicializada ({DATABASE_URL})")
+
+    # Búsqueda de texto de la biblioteca (FTS5 + triggers), antes de sembrar
+    from app.components.dnd.library import crear_indice_fts
+    crear_indice_fts()
 
     # Sembrar datos SRD si la biblioteca está vacía
     try:
@@ -24,6 +88,19 @@ def init_db():
     except Exception as e:
         logger.warning(f"⚠️ No se pudo sembrar SRD: {e}")
 
+    # Tags de entradas creadas antes del índice normalizado (o sembradas sin él)
+    try:
+        from app.components.dnd.library import indexar_tags_pendientes
+        indexar_tags_pendientes()
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo indexar los tags de la biblioteca: {e}")
+
+
+def cerrar_db():
+    """Espera el trabajo de DB en curso y cierra las conexiones del pool."""
+    _db_executor.shutdown(wait=True)
+    engine.dispose()
+
 
 def get_session():
     """Retorna una sesión de base de datos."""
@@ -3,6 +3,7 @@ Modelos SQLModel para persistencia en SQLite.
 """
 from typing import Optional
 from datetime import datetime
+from sqlalchemy import Column, Index, LargeBinary
 from sqlmodel import SQLModel, Field
 
 
@@ -11,21 +12,83 @@ from sqlmodel import SQLModel, Field
 class Campaign(SQLModel, table=True):
     """Aventura/campaña completa guardada."""
     __tablename__ = "campaigns"
+    # Listado por más recientes con paginación por keyset sobre (updated_at, id)
+    __table_args__ = (Index("ix_campaigns_updated_at_id", "updated_at", "id"),)
 
     id: Optional[int] = Field(default=None, primary_key=True)
     session_id: str = Field(index=True, unique=True)
     title: str = Field(default="Sin título")
     style: str = Field(default="")
-    data_json: str = Field(default="{}")  # adventure dict serializado
+    data_json: str = Field(default="{}")  # legado: las partidas nuevas viven en campaign_sections
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class CampaignSection(SQLModel, table=True):
+    """Parte de una campaña (pjs, historia, escena:N, vtt, combat...), JSON comprimido con zlib."""
+    __tablename__ = "campaign_sections"
+    __table_args__ = (Index("ix_campaign_sections_campaign_key", "campaign_id", "key", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    campaign_id: int = Field(foreign_key="campaigns.id")
+    key: str
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    raw_size: int = Field(default=0)
+    checksum: int = Field(default=0)  # crc32 del JSON sin comprimir
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class CampaignDelta(SQLModel, table=True):
+    """Cambios de un guardado (JSON-Patch) sobre la base en campaign_sections, hasta la próxima compactación."""
+    __tablename__ = "campaign_deltas"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    campaign_id: int = Field(foreign_key="campaigns.id", index=True)
+    patch_json: str  # [{op, path, value}]
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# ─── Trabajos de generación ─────────────────────────────
+
+class GenerationJob(SQLModel, table=True):
+    """Generación de aventura en curso, con checkpoint para reanudarla."""
+    __tablename__ = "generation_jobs"
+
+    id: str = Field(primary_key=True)  # uuid hex
+    session_id: str = Field(index=True)
+    status: str = Field(default="pending", index=True)  # pending, running, done, failed, cancelled
+    setting: str = Field(default="")
+    style_json: str = Field(default="{}")
+    nivel: int = Field(default=1)
+    modo: Optional[str] = Field(default=None)
+    stage: str = Field(default="")  # personajes, esquema, escena:N, completada
+    checkpoint_json: str = Field(default="{}")  # {pjs, esquema, escenas: {id: escena}}
+    error: str = Field(default="")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# ─── Pool de aventuras pregeneradas ─────────────────────
+
+class PooledAdventure(SQLModel, table=True):
+    """Aventura generada en tiempo ocioso, lista para entregar en /new."""
+    __tablename__ = "adventure_pool"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    style: str = Field(index=True)
+    nivel: int = Field(default=1, index=True)
+    setting: str = Field(default="")
+    data_json: str = Field(default="{}")  # {pjs, historia}
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 # ─── Journal ─────────────────────────────────────────────
 
 class JournalEntryDB(SQLModel, table=True):
     """Evento del diario de sesión."""
     __tablename__ = "journal_entries"
+    # Historial paginado por sesión en orden cronológico (GET /journal)
+    __table_args__ = (Index("ix_journal_entries_session_ts", "session_id", "timestamp", "id"),)
 
     id: Optional[int] = Field(default=None, primary_key=True)
     campaign_id: Optional[int] = Field(default=None, foreign_key="campaigns.id")
@@ -35,6 +98,20 @@ class JournalEntryDB(SQLModel, table=True):
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 
+# ─── Memoria narrativa ───────────────────────────────────
+
+class NarrativeSummary(SQLModel, table=True):
+    """Resumen condensado por IA del journal de una sesión (nivel 'session' o 'arc')."""
+    __tablename__ = "narrative_summaries"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: str = Field(index=True)
+    level: str = Field(default="session")  # session, arc
+    content: str = Field(default="")
+    events_covered: int = Field(default=0)  # eventos del journal ya incorporados
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 # ─── Biblioteca: NPCs ────────────────────────────────────
 
 class LibraryNPC(SQLModel, table=True):
@@ -105,3 +182,21 @@ class LibraryItem(SQLModel, table=True):
     tags: str = Field(default="")  # "arma,marcial,cuerpo-a-cuerpo"
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+
+
+# ─── Biblioteca: Índice de tags ──────────────────────────
+
+class LibraryTag(SQLModel, table=True):
+    """Tag normalizado de una entrada de la biblioteca (una fila por tag y entrada)."""
+    __tablename__ = "library_tags"
+    __table_args__ = (
+        # Filtrar por tag: (tipo, tag) -> ids; y facetas contando por tag
+        Index("ix_library_tags_type_tag_item", "content_type", "tag", "item_id", unique=True),
+        # Mantenimiento al editar o borrar una entrada
+        Index("ix_library_tags_type_item", "content_type", "item_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    content_type: str  # npcs, enemies, encounters, items
+    item_id: int
+    tag: str  # en minúsculas y sin espacios alrededor
@@ -2,14 +2,15 @@ import uvicorn
 import os
 import json
 import random
+import asyncio
 import time
 from datetime import datetime
 from typing import Optional, Dict, List, Any
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException, Query
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+import httpx
 from pydantic import BaseModel, Field, validator
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -18,20 +19,26 @@ from slowapi.errors import RateLimitExceeded
 # Módulos Propios (Refactorizados)
 from app.config import ESTILOS, MICRO_SETTINGS, SAVE_DIR, OLLAMA_URL, MODELO, SYSTEM_INSTRUCTIONS
 from app.models import OracleRequest, SaveRequest, DiceRollRequest, CombatAction, JournalEntryRequest, NewGameRequest
-from app.state import manager, journal, combat_tracker, SESSIONS, vtt_state
-from app.components.dnd.generator import crear_datos_aventura
+from app.state import manager, journal, combat_tracker, SESSIONS, vtt_state, job_registry, campaign_saves, autosave
+from app.systems.pool import adventure_pool
+from app.systems.saves import CampaignSaves, SECCION_HISTORIA, PREFIJO_ESCENA, metadatos_campana
+from app.components.dnd.generator import crear_datos_aventura, lanzar_imagenes_aventura
 from app.components.dnd.dice import evaluar_formula_dados
 from app.components.combat.balance import adjust_encounter
-from app.components.ai.client import sanitizar_texto
+from app.components.ai.client import sanitizar_texto, llamar_ollama_async, cerrar_cliente_async
+from app.components.ai.scheduler import (
+    llm_scheduler, contexto_llm, ColaLLMLlena,
+    PRIORIDAD_INTERACTIVA, PRIORIDAD_GENERACION, PRIORIDAD_PREFETCH,
+)
 from app.logger import setup_logger, log_startup_info, log_request
-from app.components.ai.memory import get_narrative_context
-from app.state import image_skill
+from app.components.ai.memory import get_narrative_context, preparar_contexto, narrative_memory, journal_retriever
+from app.state import image_skill, legacy_importer
 from fastapi import BackgroundTasks
 
 # Base de datos
-from app.database import init_db, get_session
-from app.db_models import Campaign, JournalEntryDB
-from sqlmodel import select
+from app.database import init_db, get_session, run_db, cerrar_db, DATABASE_URL
+from app.db_models import Campaign, CampaignSection, CampaignDelta, JournalEntryDB
+from sqlmodel import select, delete, or_, and_
 from app.components.dnd import library
 
 # Logger para este módulo
@@ -161,64 +168,95 @@ async def player_interface(request: Request):
 
 # --- RUTAS DE API ---
 
-async def run_async_generation(sid: str, setting: str, estilo: Dict[str, str], nivel: int, background_tasks: BackgroundTasks):
-    """Wrapper para ejecutar la generación en background y guardar el resultado"""
+async def _guardar_campana(sid: str, title: str, style_name: str) -> int:
+    """Guarda la sesión: solo los cambios desde el último guardado (ver app/systems/saves.py)"""
+    return await campaign_saves.guardar(sid, title, style_name)
+
+async def _instalar_aventura(sid: str, data: Dict[str, Any], estilo: Dict[str, str], job_id: Optional[str] = None) -> str:
+    """Deja la aventura completa en la sesión, la registra, la guarda y avisa al cliente"""
+    # 1. Guardar en Sesión
+    if sid not in SESSIONS:
+        SESSIONS[sid] = {}
+    
+    SESSIONS[sid]["adventure"] = data
+    SESSIONS[sid]["current_style"] = estilo
+    
+    # 2. Registrar y Guardar DB
+    title = data['historia']['titulo']
+    await journal.register_event(sid, "campaign_start", f"Aventura iniciada: {title}")
+    await _guardar_campana(sid, title, estilo.get("nombre", ""))
+    
+    # 3. Notificar cliente para recargar/iniciar
+    await manager.send_to_session(sid, {
+        "type": "adventure_ready", 
+        "title": title,
+        "job_id": job_id,
+        "data": data # Opcional, si el cliente puede cargar sin reload
+    })
+    return title
+
+async def run_async_generation(job_id: str, sid: str, setting: str, estilo: Dict[str, str], nivel: int, modo: Optional[str] = None,
+                               checkpoint: Optional[Dict[str, Any]] = None, on_checkpoint=None) -> Optional[Dict[str, Any]]:
+    """
+    Runner del JobRegistry: ejecuta la generación (reanudando desde el checkpoint
+    si lo hay), guarda el resultado y lo retorna. Los errores se notifican al
+    cliente y se propagan para que el trabajo quede como fallido.
+    """
+    style_name = estilo.get("nombre", "")
+    
+    async def on_escena(pjs: list, historia: Dict[str, Any], escena: Dict[str, Any], indice: int):
+        """Publica la aventura parcial: la mesa puede empezar con la primera escena"""
+        estado = SESSIONS.setdefault(sid, {})
+        adventure = estado.get("adventure")
+        if isinstance(adventure, dict) and adventure.get("parcial") and adventure.get("historia") is historia:
+            # Misma aventura en construcción: solo cambian la cabecera y las escenas desde la nueva
+            # (en modo paralelo puede insertarse antes de otras ya publicadas)
+            posicion = next(i for i, e in enumerate(historia["escenas"]) if e is escena)
+            estado.marcar(SECCION_HISTORIA, *(f"{PREFIJO_ESCENA}{i}" for i in range(posicion, len(historia["escenas"]))))
+        else:
+            estado["adventure"] = {"pjs": pjs, "historia": historia, "parcial": True}
+        if estado.get("current_style") != estilo:
+            estado["current_style"] = estilo
+        await _guardar_campana(sid, historia.get("titulo", "Sin Título"), style_name)
+        
+        logger.info(f"📜 Escena {indice + 1} publicada ({len(historia['escenas'])} listas)")
+        await manager.send_to_session(sid, {
+            "type": "scene_ready",
+            "indice": indice,
+            "titulo": historia.get("titulo", ""),
+            "escenas_listas": len(historia["escenas"]),
+            "escena": escena,
+            "job_id": job_id
+        })
+    
     try:
-        # 1. Generar (Async + Streaming)
-        data = await crear_datos_aventura(
-            session_id=sid, 
-            setting=setting, 
-            estilo=estilo, 
-            nivel=nivel, 
-            background_tasks=background_tasks,
-            connection_manager=manager
-        )
+        # 1. Generar (Async + Streaming); cada escena se publica en cuanto está lista
+        with contexto_llm(PRIORIDAD_GENERACION, sid):
+            data = await crear_datos_aventura(
+                session_id=sid, 
+                setting=setting, 
+                estilo=estilo, 
+                nivel=nivel, 
+                connection_manager=manager,
+                modo=modo,
+                on_escena=on_escena,
+                checkpoint=checkpoint,
+                on_checkpoint=on_checkpoint
+            )
         
         if not data or 'pjs' not in data or 'historia' not in data:
             logger.error("Datos de aventura incompletos en background task")
             await manager.send_to_session(sid, {"type": "error", "message": "Fallo en generación"})
-            return
-
-        # 2. Guardar en Sesión
-        if sid not in SESSIONS:
-            SESSIONS[sid] = {}
-        
-        SESSIONS[sid]["adventure"] = data
-        SESSIONS[sid]["current_style"] = estilo
-        
-        # 3. Registrar y Guardar DB
-        journal.register_event(sid, "campaign_start", f"Aventura iniciada: {data['historia']['titulo']}")
-        
-        # Guardado en SQLite
-        title = data['historia']['titulo']
-        style_name = estilo.get("nombre", "")
-        data_blob = json.dumps(SESSIONS[sid], ensure_ascii=False)
-        
-        with get_session() as db:
-            stmt = select(Campaign).where(Campaign.session_id == sid)
-            existing = db.exec(stmt).first()
-            if existing:
-                existing.title = title
-                existing.style = style_name
-                existing.data_json = data_blob
-                existing.updated_at = datetime.utcnow()
-                db.add(existing)
-            else:
-                db.add(Campaign(session_id=sid, title=title, style=style_name, data_json=data_blob))
-            db.commit()
+            return None
 
+        title = await _instalar_aventura(sid, data, estilo, job_id)
         logger.info(f"✅ Aventura BG completada y guardada: {title}")
-        
-        # 4. Notificar cliente para recargar/iniciar
-        await manager.send_to_session(sid, {
-            "type": "adventure_ready", 
-            "title": title,
-            "data": data # Opcional, si el cliente puede cargar sin reload
-        })
+        return data
         
     except Exception as e:
         logger.error(f"Error en background generation: {e}", exc_info=True)
         await manager.send_to_session(sid, {"type": "error", "message": f"Error crítico: {str(e)}"})
+        raise
 
 
 # ============================================
@@ -227,11 +265,11 @@ async def run_async_generation(sid: str, setting: str, estilo: Dict[str, str], n
 
 class NewGameRequest(BaseModel):
     """Request body for creating a new game/campaign"""
-    setting: str = Field(
-        ...,
+    setting: Optional[str] = Field(
+        default=None,
         min_length=10,
         max_length=500,
-        description="Campaign setting description",
+        description="Campaign setting description (omit for a random micro-setting)",
         example="Una ciudad gótica asediada por vampiros"
     )
     style: str = Field(
@@ -247,6 +285,17 @@ class NewGameRequest(BaseModel):
         le=20,
         description="Starting level for PCs"
     )
+    modo: Optional[str] = Field(
+        default=None,
+        pattern=r'^(cascada|paralelo)$',
+        description="Scene expansion mode (default: GENERATION_MODE env var)"
+    )
+    num_escenas: Optional[int] = Field(
+        default=None,
+        ge=3,
+        le=12,
+        description="Number of scenes in the adventure (default: ADVENTURE_SCENES env var)"
+    )
     
     @validator('style')
     def validate_style_exists(cls, v):
@@ -285,6 +334,10 @@ class OracleRequest(BaseModel):
         pattern=r'^(narrativa|dialogo|descripcion|combate)$',
         description="Type of enrichment"
     )
+    stream: bool = Field(
+        default=False,
+        description="Relay tokens over the session websocket as oracle_chunk messages"
+    )
 
 
 class DiceRollRequest(BaseModel):
@@ -446,7 +499,7 @@ class ClearMapRequest(BaseModel):
 
 @app.post("/new")
 @limiter.limit("3/minute")
-async def new_game(request: Request, body: NewGameRequest, background_tasks: BackgroundTasks):
+async def new_game(request: Request, body: NewGameRequest):
     """Crea una nueva aventura aleatoria (Async Background)"""
     logger.info("📝 Iniciando solicitud de aventura (Async)")
     
@@ -462,14 +515,32 @@ async def new_game(request: Request, body: NewGameRequest, background_tasks: Bac
         estilo = next((e for e in ESTILOS if e['nombre'] == estilo_nombre), ESTILOS[0])
         sid = "default_session"
         
+        # Aventura de stock: solo si el setting es uno de los micro-settings (o aleatorio)
+        # y no se pidió un largo distinto del de las aventuras pregeneradas
+        if (not requested_setting or requested_setting in MICRO_SETTINGS) and body.num_escenas is None:
+            stock = await adventure_pool.tomar(estilo['nombre'], nivel, requested_setting or None)
+            if stock:
+                data = stock["data"]
+                title = await _instalar_aventura(sid, data, estilo)
+                lanzar_imagenes_aventura(data, sid)
+                return {
+                    "status": "ok",
+                    "source": "pool",
+                    "message": "Aventura lista",
+                    "title": title,
+                    "setting": stock["setting"],
+                    "style": estilo['nombre']
+                }
+        
         logger.info(f"Setting: {setting} | Estilo: {estilo['nombre']} | Nivel: {nivel}")
         
-        # Lanzar tarea en background
-        background_tasks.add_task(run_async_generation, sid, setting, estilo, nivel, background_tasks)
+        # Lanzar trabajo de generación (con checkpoints, cancelable y reanudable)
+        job_id = await job_registry.crear(sid, setting, estilo, nivel, body.modo, body.num_escenas)
         
         return {
             "status": "processing", 
             "message": "Generando aventura...", 
+            "job_id": job_id,
             "setting": setting,
             "style": estilo['nombre']
         }
@@ -493,39 +564,13 @@ async def save_game(request: Request, req: SaveGameRequest):
             logger.warning(f"Sesión {sid} no existe")
             return {"status": "error", "message": "Sesión no encontrada"}
             
-        # Preparar datos
-        session_data = SESSIONS[sid]
-        title = session_data.get("adventure", {}).get("historia", {}).get("titulo", "Sin Título")
-        style = session_data.get("adventure", {}).get("estilo", {})
-        style_name = style.get("nombre", "Unknown") if isinstance(style, dict) else "Unknown"
-        
-        # Serializar
-        data_blob = json.dumps(session_data, ensure_ascii=False)
+        # Preparar datos (tablero y combate viajan como secciones propias de la partida)
+        title, style_name = metadatos_campana(SESSIONS[sid])
+        autosave.capturar(sid)
         
-        # Guardar en DB
-        with get_session() as db:
-            # Buscar si ya existe
-            stmt = select(Campaign).where(Campaign.session_id == sid)
-            existing = db.exec(stmt).first()
-            
-            if existing:
-                existing.title = title
-                existing.style = style_name
-                existing.data_json = data_blob
-                existing.updated_at = datetime.utcnow()
-                db.add(existing)
-                logger.info(f"✅ Partida actualizada en DB (id={existing.id})")
-            else:
-                campaign = Campaign(
-                    session_id=sid,
-                    title=title,
-                    style=style_name,
-                    data_json=data_blob,
-                )
-                db.add(campaign)
-                logger.info(f"✅ Partida creada en DB")
-            
-            db.commit()
+        # Guardar en DB (upsert en el pool de hilos de la DB)
+        campaign_id = await _guardar_campana(sid, title, style_name)
+        logger.info(f"✅ Partida guardada en DB (id={campaign_id})")
         
         return {"status": "ok", "storage": "sqlite"}
         
@@ -541,15 +586,16 @@ async def load_game(request: Request, session_id: str = "default_session"):
     
     try:
         # 1. Intentar cargar desde SQLite
-        with get_session() as db:
-            stmt = select(Campaign).where(Campaign.session_id == session_id)
-            campaign = db.exec(stmt).first()
-            
-            if campaign:
-                data = json.loads(campaign.data_json)
-                SESSIONS[session_id] = data
-                logger.info(f"✅ Partida cargada desde SQLite (id={campaign.id})")
-                return {"status": "ok", "source": "sqlite", "title": campaign.title}
+        guardada = await campaign_saves.cargar(session_id)
+        if guardada:
+            campaign_id, title = guardada
+            data = SESSIONS[session_id]
+            if isinstance(data.get("vtt"), dict):
+                vtt_state.sessions[session_id] = data["vtt"]
+            if isinstance(data.get("combat"), dict):
+                combat_tracker.active_combats[session_id] = data["combat"]
+            logger.info(f"✅ Partida cargada desde SQLite (id={campaign_id})")
+            return {"status": "ok", "source": "sqlite", "title": title}
         
         # 2. Fallback: Cargar desde JSON legacy
         fname = f"{SAVE_DIR}/partida_{session_id}.json"
@@ -568,15 +614,8 @@ async def load_game(request: Request, session_id: str = "default_session"):
                 if isinstance(historia, dict):
                     title = historia.get("titulo", "Importada")
             
-            with get_session() as db:
-                campaign = Campaign(
-                    session_id=session_id,
-                    title=title,
-                    data_json=json.dumps(data, ensure_ascii=False),
-                )
-                db.add(campaign)
-                db.commit()
-                logger.info(f"🔄 Partida legacy auto-migrada a SQLite")
+            await _guardar_campana(session_id, title, "")
+            logger.info(f"🔄 Partida legacy auto-migrada a SQLite")
             
             return {"status": "ok", "source": "json_legacy", "migrated": True}
         
@@ -587,6 +626,43 @@ async def load_game(request: Request, session_id: str = "default_session"):
         logger.error(f"Error al cargar partida: {e}", exc_info=True)
         return {"status": "error", "message": str(e)}
 
+def _extraer_texto_oraculo(result: str) -> str:
+    """Limpia la respuesta del oráculo (bloques Markdown / JSON) y devuelve el texto narrativo"""
+    # Limpiar respuesta de bloques Markdown (```json ... ```)
+    cleaned_result = result.strip()
+    if cleaned_result.startswith("```"):
+        # Eliminar primera línea (```json) y última (```)
+        lines = cleaned_result.split('\n')
+        if len(lines) >= 2:
+            # Filtrar líneas de cierre
+            if lines[0].startswith("```"): lines = lines[1:]
+            if lines[-1].strip() == "```": lines = lines[:-1]
+            cleaned_result = "\n".join(lines).strip()
+    
+    # Intentar parsear si es JSON
+    try:
+        if cleaned_result.startswith("{"):
+            json_res = json.loads(cleaned_result)
+            # Buscar campos comunes
+            if "evento" in json_res and "descripcion" in json_res["evento"]:
+                result = json_res["evento"]["descripcion"]
+            elif "descripcion" in json_res:
+                result = json_res["descripcion"]
+            elif "narrativa" in json_res:
+                result = json_res["narrativa"]
+            elif "response" in json_res:
+                result = json_res["response"]
+            else:
+                # Fallback: Usar el primer valor string largo que encontremos
+                for v in json_res.values():
+                    if isinstance(v, str) and len(v) > 50:
+                        result = v
+                        break
+    except json.JSONDecodeError:
+        pass # No es JSON, usar tal cual
+    
+    return result
+
 @app.post("/oracle")
 @limiter.limit("10/minute")
 async def oracle(request: Request, req: OracleRequest, background_tasks: BackgroundTasks):
@@ -606,58 +682,23 @@ async def oracle(request: Request, req: OracleRequest, background_tasks: Backgro
         
         prompt = f"Expande este texto narrativo de D&D (3ra persona, español):\n{texto_limpio}"
         
-        # Obtener memoria narrativa
-        contexto = get_narrative_context(req.session_id)
+        # Obtener memoria narrativa (la carga desde la DB, si hace falta, va fuera del loop)
+        await preparar_contexto(req.session_id)
+        contexto = get_narrative_context(req.session_id, consulta=texto_limpio)
         if contexto:
             logger.debug(f"Inyectando contexto narrativo ({len(contexto)} chars)")
         
         logger.debug(f"Enviando a Ollama: {len(prompt)} caracteres")
         
-        response = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": MODELO, 
-                "prompt": f"{SYSTEM_INSTRUCTIONS}\n\nCONTEXTO:\n{contexto}\n\nTAREA:\n{prompt}", 
-                "stream": False
-            },
-            timeout=int(os.getenv("OLLAMA_TIMEOUT", "60"))
-        )
-        response.raise_for_status()
-        
-        result = response.json().get('response', '')
-        
-        # Limpiar respuesta de bloques Markdown (```json ... ```)
-        cleaned_result = result.strip()
-        if cleaned_result.startswith("```"):
-            # Eliminar primera línea (```json) y última (```)
-            lines = cleaned_result.split('\n')
-            if len(lines) >= 2:
-                # Filtrar líneas de cierre
-                if lines[0].startswith("```"): lines = lines[1:]
-                if lines[-1].strip() == "```": lines = lines[:-1]
-                cleaned_result = "\n".join(lines).strip()
+        async def _stream(delta: str):
+            await manager.send_to_session(req.session_id, {"type": "oracle_chunk", "delta": delta})
         
-        # Intentar parsear si es JSON
-        try:
-            if cleaned_result.startswith("{"):
-                json_res = json.loads(cleaned_result)
-                # Buscar campos comunes
-                if "evento" in json_res and "descripcion" in json_res["evento"]:
-                    result = json_res["evento"]["descripcion"]
-                elif "descripcion" in json_res:
-                    result = json_res["descripcion"]
-                elif "narrativa" in json_res:
-                    result = json_res["narrativa"]
-                elif "response" in json_res:
-                    result = json_res["response"]
-                else:
-                    # Fallback: Usar el primer valor string largo que encontremos
-                    for v in json_res.values():
-                        if isinstance(v, str) and len(v) > 50:
-                            result = v
-                            break
-        except json.JSONDecodeError:
-            pass # No es JSON, usar tal cual
+        with contexto_llm(PRIORIDAD_INTERACTIVA, req.session_id):
+            result = await llamar_ollama_async(
+                f"{SYSTEM_INSTRUCTIONS}\n\nCONTEXTO:\n{contexto}\n\nTAREA:\n{prompt}",
+                on_chunk=_stream if req.stream else None
+            )
+        result = _extraer_texto_oraculo(result)
         
         if not result:
             logger.error("Oráculo devolvió respuesta vacía")
@@ -665,13 +706,24 @@ async def oracle(request: Request, req: OracleRequest, background_tasks: Backgro
         
         logger.info(f"✅ Oráculo completado: {len(result)} caracteres generados")
         
+        if req.stream:
+            await manager.send_to_session(req.session_id, {"type": "oracle_done", "new_text": result})
+        
         return {"status": "ok", "new_text": result}
         
-    except requests.Timeout:
+    except ColaLLMLlena:
+        logger.warning("Oráculo rechazado: cola LLM llena")
+        return JSONResponse(
+            status_code=503,
+            content={"status": "error", "message": "La IA está saturada, intenta de nuevo en unos segundos"},
+            headers={"Retry-After": "5"},
+        )
+        
+    except httpx.TimeoutException:
         logger.error("Timeout en llamada a Oráculo")
         return {"status": "error", "message": "Timeout al conectar con IA"}
         
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Error de red en Oráculo: {e}")
         return {"status": "error", "message": "Error al conectar con IA"}
         
@@ -702,7 +754,7 @@ async def combat_api(request: Request, action: CombatActionRequest):
             logger.info(f"Iniciando combate con {len(enemigos)} grupos de enemigos")
             
             res = combat_tracker.start_combat(sid, enemigos, pjs)
-            journal.register_event(sid, "combat_start", "Combate iniciado")
+            await journal.register_event(sid, "combat_start", "Combate iniciado")
             
         elif action_type == "next_turn":
             res = combat_tracker.next_turn(sid)
@@ -731,12 +783,14 @@ async def combat_api(request: Request, action: CombatActionRequest):
         elif action_type == "end":
             logger.info("Finalizando combate")
             res = combat_tracker.end_combat(sid)
-            journal.register_event(sid, "combat_end", "Combate finalizado")
+            await journal.register_event(sid, "combat_end", "Combate finalizado")
         
         else:
             logger.warning(f"Acción de combate no reconocida: {action_type}")
             return {"status": "error", "message": f"Acción no válida: {action_type}"}
         
+        autosave.marcar(sid, "combat")
+        
         # Enviar actualización a todos los clientes conectados
         await manager.send_to_session(
             sid,
@@ -763,19 +817,41 @@ async def journal_add(entry: JournalEntryRequest):
     logger.info(f"📖 Agregando entrada al journal: {entry.event_type}")
     
     try:
-        journal.register_event(entry.session_id, entry.event_type, entry.description)
+        await journal.register_event(entry.session_id, entry.event_type, entry.description)
         return {"status": "ok"}
         
     except Exception as e:
         logger.error(f"Error al agregar entrada al journal: {e}", exc_info=True)
         return {"status": "error", "message": str(e)}
 
+@app.get("/journal")
+async def journal_history(
+    session_id: str = "default_session",
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    event_type: Optional[str] = None,
+):
+    """
+    Historial completo del journal paginado por cursor.
+    Sin cursor devuelve los eventos más recientes; `before` pagina hacia atrás
+    y `after` trae lo posterior (útil para sondear eventos nuevos).
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Usa before o after, no ambos")
+    try:
+        await journal.flush_async()
+        return {"status": "ok", **await run_db(journal.historial, session_id, limit, before, after, event_type)}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 @app.get("/journal/summary")
 async def journal_get(session_id: str = "default_session"):
-    """Obtiene el historial de eventos del journal"""
+    """Obtiene los eventos recientes del journal (los que se conservan en memoria)"""
     logger.info(f"📖 Obteniendo journal para sesión: {session_id}")
     
     try:
+        await journal.preparar(session_id)
         events = journal.get_log(session_id)
         logger.debug(f"Journal contiene {len(events)} eventos")
         
@@ -909,6 +985,9 @@ async def get_connections(session_id: str):
         "clients": clients
     }
 
+# Migración de campañas legacy lanzada al arrancar: el apagado espera a que termine
+_migracion_legacy: Optional[asyncio.Task] = None
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
@@ -918,17 +997,107 @@ async def startup_event():
     logger.info(f"Modelo IA: {MODELO}")
     logger.info(f"URL Ollama: {OLLAMA_URL}")
     logger.info(f"Directorio guardados: {SAVE_DIR} (legacy)")
-    logger.info(f"Base de datos: cronista.db (SQLite)")
+    logger.info(f"Base de datos: {DATABASE_URL}")
+    
+    # Trabajos de generación interrumpidos por el reinicio
+    job_registry.runner = run_async_generation
+    reanudados = await job_registry.reanudar_pendientes()
+    if reanudados:
+        logger.info(f"♻️ {reanudados} generaciones reanudadas desde checkpoint")
+    
+    # Stock de aventuras pregeneradas (solo avanza con la cola LLM ociosa)
+    adventure_pool.iniciar()
+    
+    # Eventos del journal persistidos en lote
+    journal.iniciar()
+    
+    # Campañas guardadas enteras en data_json -> secciones comprimidas
+    global _migracion_legacy
+    _migracion_legacy = asyncio.create_task(run_db(CampaignSaves.migrar_legacy))
+    
+    # Sesiones con cambios guardadas cada AUTOSAVE_INTERVAL segundos
+    autosave.iniciar()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Libera recursos al apagar la aplicación"""
+    # Las generaciones en curso quedan activas en DB y se reanudan al arrancar
+    await adventure_pool.detener()
+    await job_registry.detener()
+    await autosave.detener()
+    await legacy_importer.detener()
+    await journal.detener()
+    if _migracion_legacy is not None:
+        # Corre en un hilo de la DB (no se puede interrumpir): esperarla antes de cerrar el engine
+        resultado, = await asyncio.gather(_migracion_legacy, return_exceptions=True)
+        if isinstance(resultado, Exception):
+            logger.error(f"La migración de campañas legacy falló: {resultado}")
+    await cerrar_cliente_async()
+    cerrar_db()
+
+# ─── Trabajos de generación ──────────────────────────────
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Estado de un trabajo de generación (etapa, escenas listas, error)."""
+    job = await job_registry.estado(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancela un trabajo de generación en curso."""
+    job = await job_registry.estado(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if not await job_registry.cancelar(job_id):
+        return {"status": "error", "message": "El trabajo ya terminó"}
+    await manager.send_to_session(job["session_id"], {"type": "generation_cancelled", "job_id": job_id})
+    return {"status": "ok", "cancelled": job_id}
 
 # ─── Campañas (listar / eliminar) ────────────────────────
 
 @app.get("/campaigns")
-async def list_campaigns():
-    """Lista todas las campañas guardadas."""
+async def list_campaigns(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    """
+    Lista las campañas guardadas, de la más reciente a la más antigua.
+    `cursor` (el next_cursor de la página anterior) trae la siguiente página
+    y `q` filtra por título.
+    """
+    try:
+        return {"status": "ok", **await run_db(_listar_campanas, limit, cursor, q)}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def _listar_campanas(limit: int, cursor: Optional[str], q: Optional[str]) -> Dict[str, Any]:
+    """Página por keyset sobre (updated_at, id), leyendo solo las columnas del listado."""
+    stmt = select(
+        Campaign.id, Campaign.session_id, Campaign.title, Campaign.style,
+        Campaign.created_at, Campaign.updated_at,
+    )
+    if q:
+        stmt = stmt.where(Campaign.title.contains(q.strip(), autoescape=True))
+    if cursor:
+        ts, _, id_ = cursor.rpartition("|")
+        c_ts, c_id = datetime.fromisoformat(ts), int(id_)
+        stmt = stmt.where(or_(
+            Campaign.updated_at < c_ts,
+            and_(Campaign.updated_at == c_ts, Campaign.id < c_id),
+        ))
+    stmt = stmt.order_by(Campaign.updated_at.desc(), Campaign.id.desc()).limit(limit + 1)
+    
     with get_session() as db:
-        stmt = select(Campaign).order_by(Campaign.updated_at.desc())
-        campaigns = db.exec(stmt).all()
-        return [
+        filas = db.exec(stmt).all()
+    
+    hay_mas = len(filas) > limit
+    filas = filas[:limit]
+    return {
+        "campaigns": [
             {
                 "id": c.id,
                 "session_id": c.session_id,
@@ -937,65 +1106,114 @@ async def list_campaigns():
                 "created_at": c.created_at.isoformat(),
                 "updated_at": c.updated_at.isoformat(),
             }
-            for c in campaigns
-        ]
+            for c in filas
+        ],
+        "next_cursor": f"{filas[-1].updated_at.isoformat()}|{filas[-1].id}" if hay_mas else None,
+    }
 
 @app.delete("/campaigns/{campaign_id}")
 async def delete_campaign(campaign_id: int):
     """Elimina una campaña por ID."""
+    eliminada = await run_db(_eliminar_campana, campaign_id)
+    if not eliminada:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada")
+    session_id, title = eliminada
+    journal.olvidar_campana(session_id)
+    campaign_saves.olvidar(session_id)
+    logger.info(f"🗑️ Campaña eliminada: {title} (id={campaign_id})")
+    return {"status": "ok", "deleted": title}
+
+def _eliminar_campana(campaign_id: int) -> Optional[tuple]:
+    """Borra la campaña y retorna (session_id, title), o None si no existe."""
     with get_session() as db:
         campaign = db.get(Campaign, campaign_id)
         if not campaign:
-            raise HTTPException(status_code=404, detail="Campaña no encontrada")
+            return None
+        eliminada = (campaign.session_id, campaign.title)
+        db.exec(delete(CampaignDelta).where(CampaignDelta.campaign_id == campaign_id))
+        db.exec(delete(CampaignSection).where(CampaignSection.campaign_id == campaign_id))
         db.delete(campaign)
         db.commit()
-        logger.info(f"🗑️ Campaña eliminada: {campaign.title} (id={campaign_id})")
-        return {"status": "ok", "deleted": campaign.title}
+        return eliminada
+
+@app.get("/campaigns/{campaign_id}/escenas")
+async def list_campaign_scenes(campaign_id: int):
+    """Índice de escenas de una campaña (solo lee la cabecera de la historia)."""
+    secciones = await campaign_saves.leer_secciones(campaign_id, [SECCION_HISTORIA])
+    if secciones is None:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada")
+    historia = secciones.get(SECCION_HISTORIA) or {}
+    return {
+        "campaign_id": campaign_id,
+        "titulo": historia.get("titulo"),
+        "escenas": [
+            {"indice": i, **escena} for i, escena in enumerate(historia.get("_escenas", []))
+        ],
+    }
+
+@app.get("/campaigns/{campaign_id}/sections/{key}")
+async def get_campaign_section(campaign_id: int, key: str):
+    """Una sección de la partida (pjs, historia, escena:N, vtt, combat...) sin cargar el resto."""
+    secciones = await campaign_saves.leer_secciones(campaign_id, [key])
+    if secciones is None:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada")
+    if key not in secciones:
+        raise HTTPException(status_code=404, detail="Sección no encontrada")
+    return {"campaign_id": campaign_id, "key": key, "data": secciones[key]}
 
 # ─── Importar JSON legacy ────────────────────────────────
 
 @app.post("/import/json")
-async def import_json_save():
-    """Importa todas las partidas JSON de partidas_guardadas/ a SQLite."""
-    imported = 0
-    for fname in os.listdir(SAVE_DIR):
-        if not fname.endswith(".json"):
-            continue
-        fpath = os.path.join(SAVE_DIR, fname)
-        try:
-            with open(fpath, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            sid = fname.replace("partida_", "").replace(".json", "")
-            title = "Importada"
-            adventure = data.get("adventure", {})
-            if isinstance(adventure, dict):
-                historia = adventure.get("historia", {})
-                if isinstance(historia, dict):
-                    title = historia.get("titulo", "Importada")
-            
-            with get_session() as db:
-                existing = db.exec(select(Campaign).where(Campaign.session_id == sid)).first()
-                if not existing:
-                    campaign = Campaign(
-                        session_id=sid,
-                        title=title,
-                        data_json=json.dumps(data, ensure_ascii=False),
-                    )
-                    db.add(campaign)
-                    db.commit()
-                    imported += 1
-        except Exception as e:
-            logger.error(f"Error importando {fname}: {e}")
-    
-    logger.info(f"📥 Importadas {imported} partidas JSON a SQLite")
-    return {"status": "ok", "imported": imported}
+async def import_json_save(session_id: str = "default_session"):
+    """
+    Importa en segundo plano todas las partidas JSON de partidas_guardadas/ a
+    SQLite. El progreso llega por websocket a `session_id` (legacy_import_progress)
+    y en GET /import/json. Relanzarla retoma donde quedó.
+    """
+    iniciada = legacy_importer.iniciar(session_id)
+    if iniciada:
+        logger.info(f"📥 Importación de partidas JSON lanzada (progreso a {session_id})")
+    return {"status": "ok", "started": iniciada, **legacy_importer.estado()}
+
+@app.get("/import/json")
+async def import_json_status():
+    """Progreso de la importación de partidas JSON legacy."""
+    return {"status": "ok", **legacy_importer.estado()}
+
+# ─── Biblioteca: caché de respuestas ─────────────────────
+
+async def _biblioteca_cacheada(request: Request, clave: tuple, tipos: List[str], construir, *args) -> Response:
+    """
+    Respuesta JSON de la biblioteca desde la caché (ver library.leer_cache), con
+    ETag. Si el cliente ya tiene esa versión (If-None-Match) responde 304.
+    """
+    entrada = library.leer_cache(clave, tipos)
+    if entrada is None:
+        entrada = await run_db(library.construir_en_cache, clave, tipos, construir, *args)
+    cuerpo, etag = entrada
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_coincide(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+def _etag_coincide(if_none_match: str, etag: str) -> bool:
+    """If-None-Match (RFC 9110): "*" o lista de ETags separados por comas, comparación débil (ignora W/)."""
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        if candidato == "*" or candidato == etag:
+            return True
+    return False
 
 # ─── Biblioteca: NPCs ────────────────────────────────────
 
 @app.get("/library/npcs")
-async def api_list_npcs(tag: Optional[str] = None):
-    npcs = library.listar_npcs(tag)
+async def api_list_npcs(request: Request, tag: Optional[str] = None, match: str = Query("all", pattern="^(all|any)$")):
+    return await _biblioteca_cacheada(request, ("npcs", tag, match), ["npcs"], _listar_npcs_json, tag, match)
+
+def _listar_npcs_json(tag: Optional[str], match: str) -> List[Dict[str, Any]]:
+    npcs = library.listar_npcs(tag, match=match)
     return [
         {
             "id": n.id, "name": n.name, "race": n.race,
@@ -1009,27 +1227,30 @@ async def api_list_npcs(tag: Optional[str] = None):
 
 @app.post("/library/npcs")
 async def api_create_npc(data: dict):
-    npc = library.crear_npc(data)
+    npc = await run_db(library.crear_npc, data)
     return {"status": "ok", "id": npc.id, "name": npc.name}
 
 @app.put("/library/npcs/{npc_id}")
 async def api_update_npc(npc_id: int, data: dict):
-    npc = library.actualizar_npc(npc_id, data)
+    npc = await run_db(library.actualizar_npc, npc_id, data)
     if not npc:
         raise HTTPException(status_code=404, detail="NPC no encontrado")
     return {"status": "ok", "id": npc.id, "name": npc.name}
 
 @app.delete("/library/npcs/{npc_id}")
 async def api_delete_npc(npc_id: int):
-    if not library.eliminar_npc(npc_id):
+    if not await run_db(library.eliminar_npc, npc_id):
         raise HTTPException(status_code=404, detail="NPC no encontrado")
     return {"status": "ok"}
 
 # ─── Biblioteca: Enemigos ────────────────────────────────
 
 @app.get("/library/enemies")
-async def api_list_enemies(tag: Optional[str] = None):
-    enemies = library.listar_enemies(tag)
+async def api_list_enemies(request: Request, tag: Optional[str] = None, match: str = Query("all", pattern="^(all|any)$")):
+    return await _biblioteca_cacheada(request, ("enemies", tag, match), ["enemies"], _listar_enemies_json, tag, match)
+
+def _listar_enemies_json(tag: Optional[str], match: str) -> List[Dict[str, Any]]:
+    enemies = library.listar_enemies(tag, match=match)
     return [
         {
             "id": e.id, "name": e.name, "cr": e.cr,
@@ -1043,27 +1264,32 @@ async def api_list_enemies(tag: Optional[str] = None):
 
 @app.post("/library/enemies")
 async def api_create_enemy(data: dict):
-    enemy = library.crear_enemy(data)
+    enemy = await run_db(library.crear_enemy, data)
     return {"status": "ok", "id": enemy.id, "name": enemy.name}
 
 @app.put("/library/enemies/{enemy_id}")
 async def api_update_enemy(enemy_id: int, data: dict):
-    enemy = library.actualizar_enemy(enemy_id, data)
+    enemy = await run_db(library.actualizar_enemy, enemy_id, data)
     if not enemy:
         raise HTTPException(status_code=404, detail="Enemigo no encontrado")
     return {"status": "ok", "id": enemy.id, "name": enemy.name}
 
 @app.delete("/library/enemies/{enemy_id}")
 async def api_delete_enemy(enemy_id: int):
-    if not library.eliminar_enemy(enemy_id):
+    if not await run_db(library.eliminar_enemy, enemy_id):
         raise HTTPException(status_code=404, detail="Enemigo no encontrado")
     return {"status": "ok"}
 
 # ─── Biblioteca: Encuentros ──────────────────────────────
 
 @app.get("/library/encounters")
-async def api_list_encounters(tag: Optional[str] = None):
-    encounters = library.listar_encounters(tag)
+async def api_list_encounters(request: Request, tag: Optional[str] = None, match: str = Query("all", pattern="^(all|any)$")):
+    return await _biblioteca_cacheada(
+        request, ("encounters", tag, match), ["encounters"], _listar_encounters_json, tag, match
+    )
+
+def _listar_encounters_json(tag: Optional[str], match: str) -> List[Dict[str, Any]]:
+    encounters = library.listar_encounters(tag, match=match)
     return [
         {
             "id": enc.id, "name": enc.name, "description": enc.description,
@@ -1077,27 +1303,32 @@ async def api_list_encounters(tag: Optional[str] = None):
 
 @app.post("/library/encounters")
 async def api_create_encounter(data: dict):
-    encounter = library.crear_encounter(data)
+    encounter = await run_db(library.crear_encounter, data)
     return {"status": "ok", "id": encounter.id, "name": encounter.name}
 
 @app.put("/library/encounters/{encounter_id}")
 async def api_update_encounter(encounter_id: int, data: dict):
-    encounter = library.actualizar_encounter(encounter_id, data)
+    encounter = await run_db(library.actualizar_encounter, encounter_id, data)
     if not encounter:
         raise HTTPException(status_code=404, detail="Encuentro no encontrado")
     return {"status": "ok", "id": encounter.id, "name": encounter.name}
 
 @app.delete("/library/encounters/{encounter_id}")
 async def api_delete_encounter(encounter_id: int):
-    if not library.eliminar_encounter(encounter_id):
+    if not await run_db(library.eliminar_encounter, encounter_id):
         raise HTTPException(status_code=404, detail="Encuentro no encontrado")
     return {"status": "ok"}
 
 # ─── Biblioteca: Items ───────────────────────────────────
 
 @app.get("/library/items")
-async def api_list_items(tag: Optional[str] = None, item_type: Optional[str] = None):
-    items = library.listar_items(tag, item_type)
+async def api_list_items(request: Request, tag: Optional[str] = None, item_type: Optional[str] = None, match: str = Query("all", pattern="^(all|any)$")):
+    return await _biblioteca_cacheada(
+        request, ("items", tag, item_type, match), ["items"], _listar_items_json, tag, item_type, match
+    )
+
+def _listar_items_json(tag: Optional[str], item_type: Optional[str], match: str) -> List[Dict[str, Any]]:
+    items = library.listar_items(tag, item_type, match=match)
     return [
         {
             "id": i.id, "name": i.name, "item_type": i.item_type,
@@ -1110,19 +1341,19 @@ async def api_list_items(tag: Optional[str] = None, item_type: Optional[str] = N
 
 @app.post("/library/items")
 async def api_create_item(data: dict):
-    item = library.crear_item(data)
+    item = await run_db(library.crear_item, data)
     return {"status": "ok", "id": item.id, "name": item.name}
 
 @app.put("/library/items/{item_id}")
 async def api_update_item(item_id: int, data: dict):
-    item = library.actualizar_item(item_id, data)
+    item = await run_db(library.actualizar_item, item_id, data)
     if not item:
         raise HTTPException(status_code=404, detail="Item no encontrado")
     return {"status": "ok", "id": item.id, "name": item.name}
 
 @app.delete("/library/items/{item_id}")
 async def api_delete_item(item_id: int):
-    if not library.eliminar_item(item_id):
+    if not await run_db(library.eliminar_item, item_id):
         raise HTTPException(status_code=404, detail="Item no encontrado")
     return {"status": "ok"}
 
@@ -1130,20 +1361,137 @@ async def api_delete_item(item_id: int):
 
 @app.get("/library/search")
 async def api_search_library(
+    request: Request,
     q: Optional[str] = None,
     type: Optional[str] = None,
     cr_min: Optional[float] = None,
     cr_max: Optional[float] = None,
     tag: Optional[str] = None,
+    match: str = Query("all", pattern="^(all|any)$"),
 ):
-    """Búsqueda global en toda la biblioteca."""
-    return library.buscar_biblioteca(q=q, content_type=type, cr_min=cr_min, cr_max=cr_max, tag=tag)
+    """Búsqueda global en toda la biblioteca. `tag` admite varios separados por coma."""
+    tipos = [type] if type in library.MODELOS else list(library.MODELOS)
+    return await _biblioteca_cacheada(
+        request, ("search", q, type, cr_min, cr_max, tag, match), tipos,
+        library.buscar_biblioteca, q, type, cr_min, cr_max, tag, match,
+    )
+
+@app.get("/library/search/text")
+async def api_search_library_text(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    type: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+):
+    """Búsqueda de texto en toda la biblioteca: una lista ordenada por relevancia, con fragmentos."""
+    if type and type not in library.MODELOS:
+        raise HTTPException(status_code=400, detail="Tipo de contenido no válido")
+    tipos = [type] if type else list(library.MODELOS)
+    return await _biblioteca_cacheada(request, ("text", q, type, limit), tipos, _buscar_texto_json, q, type, limit)
+
+def _buscar_texto_json(q: str, type: Optional[str], limit: int) -> Dict[str, Any]:
+    return {"status": "ok", "results": library.buscar_texto(q, type, limit)}
+
+@app.get("/library/tags")
+async def api_library_tags(
+    request: Request,
+    type: Optional[str] = None,
+    tag: Optional[str] = None,
+    match: str = Query("all", pattern="^(all|any)$"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Facetas: cuántas entradas tienen cada tag (dentro del filtro `tag`, si lo hay)."""
+    if type and type not in library.MODELOS:
+        raise HTTPException(status_code=400, detail="Tipo de contenido no válido")
+    tipos = [type] if type else list(library.MODELOS)
+    return await _biblioteca_cacheada(request, ("tags", type, tag, match, limit), tipos, _facetas_json, type, tag, match, limit)
+
+def _facetas_json(type: Optional[str], tag: Optional[str], match: str, limit: int) -> Dict[str, Any]:
+    return {"status": "ok", "tags": library.facetas_tags(type, tag, match, limit)}
+
+@app.get("/library/cache/stats")
+async def api_library_cache_stats():
+    """Aciertos, fallos e invalidaciones de la caché de respuestas de la biblioteca."""
+    return {"status": "ok", "cache": library.cache_stats()}
+
+# ─── Importar / exportar (NDJSON) ────────────────────────
+
+@app.get("/library/export")
+async def api_export_library(type: Optional[str] = None):
+    """Exporta la biblioteca (o un tipo) como NDJSON, leyendo por bloques sin cargarla entera."""
+    if type and type not in library.MODELOS:
+        raise HTTPException(status_code=400, detail="Tipo de contenido no válido")
+    tipos = [type] if type else list(library.MODELOS)
+
+    async def lineas():
+        for tipo in tipos:
+            desde = 0
+            while True:
+                bloque, ultimo = await run_db(library.exportar_lote, tipo, desde)
+                if ultimo is None:
+                    break
+                yield bloque
+                desde = ultimo
+
+    return StreamingResponse(
+        lineas(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="biblioteca.ndjson"'},
+    )
+
+@app.post("/library/import")
+async def api_import_library(request: Request):
+    """
+    Importa NDJSON (una entrada por línea, con "type" y "name") en streaming:
+    valida cada línea y hace upsert por nombre en lotes de LIBRARY_BULK_BATCH.
+    Las líneas inválidas se omiten y se informan.
+    """
+    resumen = {"created": 0, "updated": 0, "rejected": 0}
+    errores: List[Dict[str, Any]] = []
+    lote: List[tuple] = []
+    numero = 0
+
+    async def volcar():
+        if lote:
+            hechos = await run_db(library.importar_lote, list(lote))
+            resumen["created"] += hechos["created"]
+            resumen["updated"] += hechos["updated"]
+            lote.clear()
+
+    def procesar(linea: bytes):
+        nonlocal numero
+        numero += 1
+        if not linea.strip():
+            return
+        try:
+            lote.append(library.validar_registro(json.loads(linea)))
+        except ValueError as e:  # incluye JSONDecodeError
+            resumen["rejected"] += 1
+            if len(errores) < 100:
+                errores.append({"line": numero, "error": str(e)})
+
+    resto = b""
+    async for trozo in request.stream():
+        resto += trozo
+        *lineas, resto = resto.split(b"\n")
+        for linea in lineas:
+            procesar(linea)
+        if len(lote) >= library.LIBRARY_BULK_BATCH:
+            await volcar()
+    procesar(resto)
+    await volcar()
+
+    logger.info(
+        f"📥 Biblioteca importada: {resumen['created']} nuevas, {resumen['updated']} actualizadas, "
+        f"{resumen['rejected']} rechazadas"
+    )
+    return {"status": "ok", **resumen, "errors": errores}
 
 @app.post("/library/seed")
 async def api_seed_library():
     """Recarga datos SRD manualmente."""
     from app.components.dnd.srd_data import seed_library_if_empty
-    seed_library_if_empty()
+    await run_db(seed_library_if_empty)
     return {"status": "ok", "message": "SRD seed ejecutado"}
 
 # ─── Sistema de Botín (Loot) ──────────────────────────────
@@ -1347,7 +1695,7 @@ async def get_rate_limit_status(request: Request):
 # AI CACHE MANAGEMENT ENDPOINTS
 # ============================================
 
-from app.components.ai.client import get_cache_stats, clear_prompt_cache
+from app.components.ai.client import get_cache_stats, get_kv_stats, clear_prompt_cache
 
 @app.get("/api/ai/cache/stats")
 async def get_ai_cache_stats():
@@ -1355,11 +1703,15 @@ async def get_ai_cache_stats():
     Get AI prompt cache statistics.
     Shows hit rate, size, and performance metrics.
     """
-    stats = get_cache_stats()
+    # El tamaño de L2 es un COUNT(*) en SQLite: fuera del event loop
+    stats = await asyncio.to_thread(get_cache_stats)
     
     return {
         "status": "ok",
         "cache": stats,
+        "kv_context": get_kv_stats(),
+        "narrative_memory": narrative_memory.stats(),
+        "journal_retrieval": journal_retriever.stats(),
         "recommendations": _get_cache_recommendations(stats)
     }
 
@@ -1394,14 +1746,14 @@ async def clear_ai_cache():
     - Model updated/changed
     - Suspected stale content
     """
-    clear_prompt_cache()
+    await asyncio.to_thread(clear_prompt_cache)
     
     logger.info("AI cache cleared via API endpoint")
     
     return {
         "status": "cleared",
         "message": "All cached AI responses have been cleared",
-        "new_stats": get_cache_stats()
+        "new_stats": await asyncio.to_thread(get_cache_stats)
     }
 
 
@@ -1411,7 +1763,7 @@ async def warmup_cache(background_tasks: BackgroundTasks):
     Pre-populate cache with common prompts.
     Useful after cache clear or server restart.
     """
-    from app.components.ai.client import generar_con_ia
+    from app.components.ai.client import generar_con_ia_async
     
     common_prompts = [
         # Common character archetypes
@@ -1424,10 +1776,15 @@ async def warmup_cache(background_tasks: BackgroundTasks):
         ("Describe: poción de curación", False),
     ]
     
-    def _warmup():
-        for prompt, json_mode in common_prompts:
-            generar_con_ia(prompt, json_mode=json_mode, use_cache=True)
-            logger.info(f"Cache warmup: {prompt}")
+    async def _warmup():
+        with contexto_llm(PRIORIDAD_PREFETCH):
+            for prompt, json_mode in common_prompts:
+                try:
+                    await generar_con_ia_async(prompt, json_mode=json_mode, use_cache=True)
+                except ColaLLMLlena:
+                    logger.warning("Cache warmup interrumpido: cola LLM llena")
+                    return
+                logger.info(f"Cache warmup: {prompt}")
     
     background_tasks.add_task(_warmup)
     
@@ -1437,6 +1794,31 @@ async def warmup_cache(background_tasks: BackgroundTasks):
     }
 
 
+@app.get("/api/ai/queue/stats")
+async def get_ai_queue_stats():
+    """
+    LLM scheduler metrics: running jobs, queue depth per priority class,
+    average wait and rejected requests.
+    """
+    return {"status": "ok", "queue": llm_scheduler.stats()}
+
+@app.get("/api/adventures/pool/stats")
+async def get_adventure_pool_stats():
+    """
+    Pre-generated adventure pool: stock per (style, level) bucket,
+    served / missed requests and background generations.
+    """
+    return {"status": "ok", "pool": await adventure_pool.stats()}
+
+@app.get("/api/saves/stats")
+async def get_saves_stats():
+    """
+    Campaign persistence: full / delta / no-op saves, compactions,
+    sections written and autosave flushes.
+    """
+    return {"status": "ok", "saves": campaign_saves.stats(), "autosave": autosave.stats()}
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("🎲 CRONISTA V80.1 (MODULARIZADO)")
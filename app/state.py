@@ -1,15 +1,19 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Callable, Optional
 from app.systems.manager import ConnectionManager
 from app.systems.journal import JournalSystem
+from app.systems.jobs import JobRegistry
+from app.systems.saves import RegistroSesiones, CampaignSaves
 from app.components.combat.tracker import CombatTracker
 
-# Estado Global del Servidor
-SESSIONS: Dict[str, Dict[str, Any]] = {}
+# Estado Global del Servidor (cada sesión anota qué claves cambiaron para el guardado incremental)
+SESSIONS: Dict[str, Dict[str, Any]] = RegistroSesiones()
 
 # Instancias Singleton
 manager = ConnectionManager()
 journal = JournalSystem()
 combat_tracker = CombatTracker()
+job_registry = JobRegistry()
+campaign_saves = CampaignSaves(SESSIONS)
 
 
 # ─── VTT State Manager ──────────────────────────────────
@@ -19,6 +23,12 @@ class VTTStateManager:
 
     def __init__(self):
         self.sessions: Dict[str, Dict[str, Any]] = {}
+        # Avisado con el session_id tras cada cambio del tablero (autoguardado)
+        self.on_cambio: Optional[Callable[[str], None]] = None
+
+    def _cambio(self, session_id: str):
+        if self.on_cambio:
+            self.on_cambio(session_id)
 
     def get_session(self, session_id: str) -> Dict[str, Any]:
         if session_id not in self.sessions:
@@ -31,15 +41,18 @@ class VTTStateManager:
 
     def set_background(self, session_id: str, image_url: str):
         self.get_session(session_id)["background"] = image_url
+        self._cambio(session_id)
 
     def add_token(self, session_id: str, token_id: str, token_data: dict):
         self.get_session(session_id)["tokens"][token_id] = token_data
+        self._cambio(session_id)
 
     def update_token_position(self, session_id: str, token_id: str, x: int, y: int) -> bool:
         tokens = self.get_session(session_id)["tokens"]
         if token_id in tokens:
             tokens[token_id]["x"] = x
             tokens[token_id]["y"] = y
+            self._cambio(session_id)
             return True
         return False
 
@@ -47,6 +60,7 @@ class VTTStateManager:
         tokens = self.get_session(session_id)["tokens"]
         if token_id in tokens:
             del tokens[token_id]
+            self._cambio(session_id)
             return True
         return False
 
@@ -55,10 +69,17 @@ class VTTStateManager:
 
     def clear_tokens(self, session_id: str):
         self.get_session(session_id)["tokens"].clear()
+        self._cambio(session_id)
 
 
 vtt_state = VTTStateManager()
 
+# Autoguardado periódico de las sesiones con cambios
+from app.systems.autosave import AutosaveService
+
+autosave = AutosaveService(campaign_saves, SESSIONS, vtt_state, combat_tracker)
+vtt_state.on_cambio = lambda session_id: autosave.marcar(session_id, "vtt")
+
 
 # IA & ComfyUI
 from app.components.ai.comfy_client import ComfyClient
@@ -66,3 +87,14 @@ from app.components.ai.skill_images import ImageGeneratorSkill
 
 comfy_client = ComfyClient()
 image_skill = ImageGeneratorSkill(comfy_client, manager)
+
+# Posición en la cola LLM enviada a los clientes que esperan
+from app.components.ai.scheduler import llm_scheduler
+
+llm_scheduler.notifier = manager.send_to_session
+
+# Importación masiva de partidas JSON legacy (progreso por websocket)
+from app.systems.legacy_import import ImportadorLegacy
+
+legacy_importer = ImportadorLegacy()
+legacy_importer.notifier = manager.send_to_session
@@ -0,0 +1,111 @@
+"""
+Autoguardado periódico de las partidas.
+
+Las sesiones se marcan como sucias al cambiar (SESSIONS lo anota solo; el
+tablero VTT y el combate avisan con marcar) y cada AUTOSAVE_INTERVAL
+segundos todas las sucias se guardan juntas: los deltas de todas van en una
+sola transacción (CampaignSaves.guardar_lote). Al apagar se hace un último
+guardado con lo que quede pendiente.
+"""
+import asyncio
+import os
+from typing import Any, Dict, Iterable, Optional, Set
+from app.systems.saves import CampaignSaves, metadatos_campana
+from app.logger import setup_logger
+
+logger = setup_logger("autosave")
+
+AUTOSAVE_INTERVAL = float(os.getenv("AUTOSAVE_INTERVAL", "5"))
+
+# Claves de la sesión que viven fuera de SESSIONS y se copian al guardar
+CLAVES_EXTERNAS = ("vtt", "combat")
+
+
+class AutosaveService:
+    """Junta los cambios de cada sesión y los persiste como mucho una vez por intervalo."""
+
+    def __init__(self, saves: CampaignSaves, sesiones: Dict[str, Any], vtt, combates):
+        self.saves = saves
+        self.sesiones = sesiones
+        self.vtt = vtt
+        self.combates = combates
+        # Sesiones con cambios fuera de SESSIONS -> qué claves externas cambiaron
+        self._sucias: Dict[str, Set[str]] = {}
+        self._tarea: Optional[asyncio.Task] = None
+        self._stats = {"flushes": 0, "sessions_saved": 0, "failed_flushes": 0}
+
+    def marcar(self, session_id: str, clave: str):
+        """Anota que `clave` ("vtt" o "combat") cambió y la sesión debe entrar en el próximo autoguardado."""
+        self._sucias.setdefault(session_id, set()).add(clave)
+
+    def capturar(self, session_id: str, claves: Iterable[str] = CLAVES_EXTERNAS):
+        """
+        Copia en la sesión el tablero VTT y/o el combate activo para que se
+        guarden con ella. Solo las claves indicadas quedan sucias: el guardado
+        no compara lo que no cambió.
+        """
+        estado = self.sesiones[session_id]
+        if "vtt" in claves and session_id in self.vtt.sessions:
+            estado["vtt"] = self.vtt.sessions[session_id]
+        if "combat" in claves:
+            if session_id in self.combates.active_combats:
+                estado["combat"] = self.combates.active_combats[session_id]
+            elif "combat" in estado:
+                estado.pop("combat")
+
+    def iniciar(self):
+        """Arranca el bucle de autoguardado (requiere un event loop activo)"""
+        self._tarea = asyncio.create_task(self._bucle())
+        logger.info(f"Autoguardado activo (cada {AUTOSAVE_INTERVAL}s)")
+
+    async def detener(self):
+        """Detiene el bucle y guarda lo que quede pendiente"""
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """Guarda ahora todas las sesiones sucias. Retorna cuántas escribieron algo."""
+        externas, self._sucias = self._sucias, {}
+        sucias = set(externas) | {sid for sid, estado in self.sesiones.items() if estado.sucias}
+
+        pedidos = []
+        for session_id in sucias:
+            estado = self.sesiones.get(session_id)
+            # Sin aventura no hay campaña que guardar (p. ej. tablero suelto)
+            if not estado or "adventure" not in estado:
+                continue
+            self.capturar(session_id, externas.get(session_id, ()))
+            pedidos.append((session_id, *metadatos_campana(estado)))
+        if not pedidos:
+            return 0
+
+        try:
+            guardadas = await self.saves.guardar_lote(pedidos)
+        except Exception as e:
+            # Las claves sucias ya se restauraron: reintentar en el próximo ciclo
+            for p in pedidos:
+                self._sucias.setdefault(p[0], set())
+            self._stats["failed_flushes"] += 1
+            logger.error(f"❌ Autoguardado fallido ({len(pedidos)} sesiones): {e}")
+            return 0
+
+        self._stats["flushes"] += 1
+        self._stats["sessions_saved"] += guardadas
+        if guardadas:
+            logger.debug(f"💾 Autoguardado: {guardadas} sesiones")
+        return guardadas
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "pending": len(self._sucias),
+            "running": self._tarea is not None and not self._tarea.done(),
+        }
+
+    async def _bucle(self):
+        while True:
+            await asyncio.sleep(AUTOSAVE_INTERVAL)
+            await self.flush()
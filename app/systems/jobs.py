@@ -0,0 +1,220 @@
+"""
+Registro de trabajos de generación de aventuras.
+
+Cada generación es una tarea asyncio con id propio, persistida en SQLite
+(generation_jobs). El generador guarda un checkpoint tras los personajes,
+el esquema y cada escena; si el servidor se reinicia, los trabajos que
+quedaron a medias se relanzan desde su último checkpoint. Las lecturas y
+escrituras de la tabla corren en el pool de hilos de la DB (run_db).
+"""
+import asyncio
+import json
+import uuid
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable, Awaitable
+from sqlmodel import select, update
+from app.database import get_session, run_db
+from app.db_models import GenerationJob
+from app.logger import setup_logger
+
+logger = setup_logger("jobs")
+
+ESTADOS_ACTIVOS = ("pending", "running")
+
+
+class JobRegistry:
+    """Lanza, sigue, cancela y reanuda trabajos de generación."""
+
+    def __init__(self):
+        # runner(job_id, session_id, setting, estilo, nivel, modo, checkpoint, on_checkpoint) -> data
+        self.runner: Optional[Callable[..., Awaitable[Optional[Dict[str, Any]]]]] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._sesiones: Dict[str, str] = {}  # job_id -> session_id de las tareas vivas
+        logger.info("JobRegistry inicializado")
+
+    # ─── API pública ─────────────────────────────────────
+
+    async def crear(self, session_id: str, setting: str, estilo: Dict[str, Any], nivel: int, modo: Optional[str] = None,
+                    num_escenas: Optional[int] = None) -> str:
+        """Registra un trabajo nuevo y lo lanza. Cancela el que hubiera activo para la sesión."""
+        for job_id, task in list(self._tasks.items()):
+            if not task.done() and self._sesiones.get(job_id) == session_id:
+                logger.info(f"Cancelando trabajo previo {job_id} de la sesión {session_id}")
+                await self.cancelar(job_id)
+
+        job = GenerationJob(
+            id=uuid.uuid4().hex,
+            session_id=session_id,
+            setting=setting,
+            style_json=json.dumps(estilo, ensure_ascii=False),
+            nivel=nivel,
+            modo=modo,
+            # El número de escenas viaja en el checkpoint para sobrevivir a un reinicio
+            checkpoint_json=json.dumps({"num_escenas": num_escenas} if num_escenas else {}),
+        )
+        job_id = job.id
+        await run_db(self._insertar, job)
+
+        self._lanzar(job_id, session_id)
+        logger.info(f"🧾 Trabajo {job_id} creado para sesión {session_id}")
+        return job_id
+
+    async def estado(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Retorna el estado público del trabajo o None si no existe."""
+        return await run_db(self._leer_estado, job_id)
+
+    async def cancelar(self, job_id: str) -> bool:
+        """Cancela un trabajo activo. Retorna False si no existe o ya terminó."""
+        if not await run_db(self._esta_activo, job_id):
+            return False
+
+        task = self._tasks.get(job_id)
+        if task and not task.done():
+            task.cancel()
+        # Si no hay tarea viva (p. ej. aún no reanudado) se marca directamente
+        await self._actualizar(job_id, status="cancelled")
+        logger.info(f"🛑 Trabajo {job_id} cancelado")
+        return True
+
+    async def reanudar_pendientes(self) -> int:
+        """Relanza los trabajos que quedaron activos antes de un reinicio."""
+        pendientes = await run_db(self._leer_pendientes)
+
+        for job_id, session_id in pendientes:
+            logger.info(f"♻️ Reanudando trabajo {job_id} desde su checkpoint")
+            self._lanzar(job_id, session_id)
+        return len(pendientes)
+
+    async def detener(self):
+        """Cancela las tareas en curso sin marcarlas: se reanudarán al arrancar."""
+        tasks = [t for t in self._tasks.values() if not t.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ─── Internos ────────────────────────────────────────
+
+    def _lanzar(self, job_id: str, session_id: str):
+        task = asyncio.create_task(self._ejecutar(job_id))
+        self._tasks[job_id] = task
+        self._sesiones[job_id] = session_id
+        task.add_done_callback(lambda _t, jid=job_id: self._olvidar(jid))
+
+    def _olvidar(self, job_id: str):
+        self._tasks.pop(job_id, None)
+        self._sesiones.pop(job_id, None)
+
+    async def _ejecutar(self, job_id: str):
+        datos = await run_db(self._leer_trabajo, job_id)
+        if datos is None:
+            return
+        session_id, setting, estilo, nivel, modo, checkpoint = datos
+
+        await self._actualizar(job_id, status="running")
+
+        async def on_checkpoint(nuevo: Dict[str, Any], etapa: str):
+            await self._actualizar(job_id, checkpoint=nuevo, stage=etapa)
+
+        try:
+            data = await self.runner(
+                job_id, session_id, setting, estilo, nivel, modo, checkpoint, on_checkpoint
+            )
+        except asyncio.CancelledError:
+            # Cancelado por DELETE (ya marcado) o por apagado (queda activo para reanudar)
+            raise
+        except Exception as e:
+            logger.error(f"Trabajo {job_id} falló: {e}", exc_info=True)
+            await self._actualizar(job_id, status="failed", error=str(e))
+            return
+
+        if data:
+            await self._actualizar(job_id, status="done", stage="completada")
+            logger.info(f"✅ Trabajo {job_id} completado")
+        else:
+            await self._actualizar(job_id, status="failed", error="Datos de aventura incompletos")
+
+    async def _actualizar(self, job_id: str, status: Optional[str] = None, stage: Optional[str] = None,
+                          checkpoint: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        valores: Dict[str, Any] = {"updated_at": datetime.utcnow()}
+        if status is not None:
+            valores["status"] = status
+        if stage is not None:
+            valores["stage"] = stage
+        if checkpoint is not None:
+            # Se serializa en el loop: el generador sigue modificando el checkpoint
+            valores["checkpoint_json"] = json.dumps(checkpoint, ensure_ascii=False)
+        if error is not None:
+            valores["error"] = error
+        try:
+            await run_db(self._escribir, job_id, valores, status == "cancelled")
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar el trabajo {job_id}: {e}")
+
+    # ─── Acceso a la DB (en el pool de hilos) ────────────
+
+    @staticmethod
+    def _insertar(job: GenerationJob):
+        with get_session() as db:
+            db.add(job)
+            db.commit()
+
+    @staticmethod
+    def _escribir(job_id: str, valores: Dict[str, Any], cancelando: bool):
+        stmt = update(GenerationJob).where(GenerationJob.id == job_id).values(**valores)
+        if not cancelando:
+            # Un trabajo cancelado no vuelve a cambiar de estado (en la misma sentencia: sin carreras)
+            stmt = stmt.where(GenerationJob.status != "cancelled")
+        with get_session() as db:
+            db.execute(stmt)
+            db.commit()
+
+    @staticmethod
+    def _esta_activo(job_id: str) -> bool:
+        with get_session() as db:
+            job = db.get(GenerationJob, job_id)
+            return job is not None and job.status in ESTADOS_ACTIVOS
+
+    @staticmethod
+    def _leer_pendientes() -> list:
+        with get_session() as db:
+            return list(db.exec(
+                select(GenerationJob.id, GenerationJob.session_id).where(GenerationJob.status.in_(ESTADOS_ACTIVOS))
+            ).all())
+
+    @staticmethod
+    def _leer_trabajo(job_id: str) -> Optional[tuple]:
+        with get_session() as db:
+            job = db.get(GenerationJob, job_id)
+            if not job:
+                return None
+            return (
+                job.session_id,
+                job.setting,
+                json.loads(job.style_json or "{}"),
+                job.nivel,
+                job.modo,
+                json.loads(job.checkpoint_json or "{}"),
+            )
+
+    @staticmethod
+    def _leer_estado(job_id: str) -> Optional[Dict[str, Any]]:
+        with get_session() as db:
+            job = db.get(GenerationJob, job_id)
+            if not job:
+                return None
+            checkpoint = json.loads(job.checkpoint_json or "{}")
+            return {
+                "id": job.id,
+                "session_id": job.session_id,
+                "status": job.status,
+                "stage": job.stage,
+                "setting": job.setting,
+                "nivel": job.nivel,
+                "modo": job.modo,
+                "titulo": (checkpoint.get("esquema") or {}).get("titulo"),
+                "escenas_listas": len(checkpoint.get("escenas", {})),
+                "error": job.error,
+                "created_at": job.created_at.isoformat(),
+                "updated_at": job.updated_at.isoformat(),
+            }
@@ -1,17 +1,64 @@
-from typing import List, Dict, Optional, Any
+import asyncio
+import os
+from collections import deque
+from types import SimpleNamespace
+from typing import List, Dict, Optional, Any, Callable, Deque, Tuple
 from datetime import datetime
 from app.logger import setup_logger
 
 logger_journal = setup_logger("journal")
 
+# Escritura diferida: los eventos se insertan en lote cada JOURNAL_FLUSH_INTERVAL
+# segundos o al juntarse JOURNAL_FLUSH_BATCH, en una sola transacción
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "0.25"))
+JOURNAL_FLUSH_BATCH = int(os.getenv("JOURNAL_FLUSH_BATCH", "100"))
+# Eventos recientes que se conservan en memoria por sesión; el resto se lee de la DB
+JOURNAL_MEMORY_EVENTS = int(os.getenv("JOURNAL_MEMORY_EVENTS", "200"))
+
 class JournalSystem:
     """Sistema de registro de eventos de la campaña (memoria + SQLite)"""
     
     def __init__(self):
-        self.sessions: Dict[str, List[Dict[str, Any]]] = {}
+        # Cola acotada con los últimos JOURNAL_MEMORY_EVENTS eventos de cada sesión
+        self.sessions: Dict[str, Deque[Dict[str, Any]]] = {}
+        # Eventos totales de cada sesión (memoria + DB): posición absoluta del siguiente
+        self.totales: Dict[str, int] = {}
+        # Observadores de cada evento registrado: fn(session_id, entry, total_eventos)
+        self.listeners: List[Callable[[str, Dict[str, Any], int], None]] = []
+        # Filas pendientes de persistir y caché session_id -> campaign_id
+        self._pendientes: List[Dict[str, Any]] = []
+        self._campaign_ids: Dict[str, int] = {}
+        self._escritor: Optional[asyncio.Task] = None
+        self._hay_pendientes: Optional[asyncio.Event] = None
+        self._lote_lleno: Optional[asyncio.Event] = None
+        # Un flush a la vez: quien lee de la DB espera a que termine el lote en vuelo
+        self._flush_lock = asyncio.Lock()
+        # Cargas en curso desde la DB (una por sesión, compartida por quien llegue)
+        self._cargas: Dict[str, asyncio.Task] = {}
+        self._stats = {"events": 0, "flushes": 0, "rows_written": 0, "failed_flushes": 0}
         logger_journal.info("JournalSystem inicializado")
     
-    def register_event(
+    def add_listener(self, listener: Callable[[str, Dict[str, Any], int], None]):
+        """Registra un observador que se invoca tras cada register_event"""
+        self.listeners.append(listener)
+    
+    async def preparar(self, session_id: str):
+        """
+        Carga (una vez) la cola reciente y el total de una sesión que ya tenga
+        historial en DB. La lectura corre en el pool de hilos de la DB; después
+        get_log, total y los observadores solo leen memoria.
+        """
+        if session_id in self.sessions:
+            return
+        carga = self._cargas.get(session_id)
+        if carga is None:
+            carga = asyncio.get_running_loop().create_task(self._cargar(session_id))
+            self._cargas[session_id] = carga
+            carga.add_done_callback(lambda _t, sid=session_id: self._cargas.pop(sid, None))
+        # shield: cancelar a quien espera no cancela la carga que comparten los demás
+        await asyncio.shield(carga)
+    
+    async def register_event(
         self,
         session_id: str,
         event_type: str,
@@ -22,88 +69,345 @@ class JournalSystem:
         Registra un evento en el journal (memoria + DB)
         """
         if session_id not in self.sessions:
-            self.sessions[session_id] = []
-            logger_journal.info(f"Nuevo journal creado para sesión: {session_id}")
+            # Retomar la cola reciente y el total de una sesión que ya tenga historial en DB
+            await self.preparar(session_id)
+            if not self.totales[session_id]:
+                logger_journal.info(f"Nuevo journal creado para sesión: {session_id}")
         
+        # UTC en memoria y en DB: el mismo instante ordena igual en ambos
+        ahora = datetime.utcnow()
         entry = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": ahora.isoformat(),
             "event_type": event_type,
             "description": description,
             "metadata": metadata or {}
         }
         
         self.sessions[session_id].append(entry)
+        self.totales[session_id] += 1
         
-        # Persistir a SQLite
-        try:
-            from app.database import get_session
-            from app.db_models import JournalEntryDB, Campaign
-            from sqlmodel import select
-            
-            with get_session() as db:
-                # Buscar campaign_id
-                campaign_id = None
-                campaign = db.exec(
-                    select(Campaign).where(Campaign.session_id == session_id)
-                ).first()
-                if campaign:
-                    campaign_id = campaign.id
-                
-                db_entry = JournalEntryDB(
-                    campaign_id=campaign_id,
-                    session_id=session_id,
-                    event_type=event_type,
-                    description=description,
-                )
-                db.add(db_entry)
-                db.commit()
-        except Exception as e:
-            logger_journal.warning(f"No se pudo persistir evento en DB: {e}")
+        # Persistir a SQLite: en lote si el escritor está activo, si no en el acto
+        self._pendientes.append({
+            "session_id": session_id,
+            "event_type": event_type,
+            "description": description,
+            "timestamp": ahora,
+        })
+        self._stats["events"] += 1
+        if self._escritor is not None and not self._escritor.done():
+            self._hay_pendientes.set()
+            if len(self._pendientes) >= JOURNAL_FLUSH_BATCH:
+                self._lote_lleno.set()
+        else:
+            await self.flush_async()
         
         logger_journal.info(f"[{session_id}] {event_type}: {description}")
-        logger_journal.debug(f"Journal size: {len(self.sessions[session_id])} eventos")
+        logger_journal.debug(f"Journal size: {self.totales[session_id]} eventos")
+        
+        for listener in self.listeners:
+            try:
+                listener(session_id, entry, self.totales[session_id])
+            except Exception as e:
+                logger_journal.warning(f"Observador del journal falló: {e}")
         
         return entry
     
-    def get_log(self, session_id: str) -> List[Dict[str, Any]]:
-        """Obtiene todos los eventos de una sesión (memoria o DB)"""
-        events = self.sessions.get(session_id, [])
+    # ─── Escritura diferida ──────────────────────────────
+    
+    def iniciar(self):
+        """Arranca el escritor en lote (requiere un event loop activo)"""
+        self._hay_pendientes = asyncio.Event()
+        self._lote_lleno = asyncio.Event()
+        self._escritor = asyncio.create_task(self._bucle_escritura())
+        logger_journal.info(
+            f"Escritura diferida del journal activa (cada {JOURNAL_FLUSH_INTERVAL}s o {JOURNAL_FLUSH_BATCH} eventos)"
+        )
+    
+    async def detener(self):
+        """Detiene el escritor y persiste lo que quede pendiente"""
+        if self._escritor:
+            self._escritor.cancel()
+            await asyncio.gather(self._escritor, return_exceptions=True)
+            self._escritor = None
+        await self.flush_async()
+    
+    async def flush_async(self) -> int:
+        """Inserta todos los eventos pendientes en una sola transacción (en el pool de hilos de la DB)"""
+        async with self._flush_lock:
+            return await self._flush_sin_lock()
+    
+    async def _flush_sin_lock(self) -> int:
+        from app.database import run_db
         
-        # Si no hay en memoria, intentar cargar desde DB
-        if not events:
+        # El lote se toma en el loop: register_event nunca compite con el hilo
+        lote, self._pendientes = self._pendientes, []
+        if not lote:
+            return 0
+        try:
+            await run_db(self._escribir_lote, lote)
+        except Exception as e:
+            return self._reencolar(lote, e)
+        return self._contar(lote)
+    
+    def olvidar_campana(self, session_id: str):
+        """Invalida el campaign_id cacheado (p. ej. al eliminar la campaña)"""
+        self._campaign_ids.pop(session_id, None)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "pending": len(self._pendientes),
+            "write_behind": self._escritor is not None and not self._escritor.done(),
+            "cached_campaign_ids": len(self._campaign_ids),
+        }
+    
+    async def _bucle_escritura(self):
+        while True:
+            await self._hay_pendientes.wait()
+            # Juntar eventos durante el intervalo, salvo que el lote ya esté lleno.
+            # asyncio.wait (y no wait_for) para no tragarse una cancelación simultánea
+            lleno = asyncio.ensure_future(self._lote_lleno.wait())
             try:
-                from app.database import get_session
-                from app.db_models import JournalEntryDB
-                from sqlmodel import select
-                
-                with get_session() as db:
-                    stmt = select(JournalEntryDB).where(
-                        JournalEntryDB.session_id == session_id
-                    ).order_by(JournalEntryDB.timestamp)
-                    db_entries = db.exec(stmt).all()
-                    
-                    events = [
-                        {
-                            "timestamp": e.timestamp.isoformat(),
-                            "event_type": e.event_type,
-                            "description": e.description,
-                            "metadata": {}
-                        }
-                        for e in db_entries
-                    ]
-                    if events:
-                        self.sessions[session_id] = events
-                        logger_journal.info(f"Cargados {len(events)} eventos desde DB para {session_id}")
-            except Exception as e:
-                logger_journal.warning(f"No se pudo cargar journal desde DB: {e}")
+                await asyncio.wait({lleno}, timeout=JOURNAL_FLUSH_INTERVAL)
+            finally:
+                lleno.cancel()
+            self._hay_pendientes.clear()
+            self._lote_lleno.clear()
+            await self.flush_async()
+            if self._pendientes:
+                # Un flush fallido deja filas pendientes: reintentar tras el intervalo
+                await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+                self._hay_pendientes.set()
+    
+    def _contar(self, lote: List[Dict[str, Any]]) -> int:
+        self._stats["flushes"] += 1
+        self._stats["rows_written"] += len(lote)
+        return len(lote)
+    
+    def _reencolar(self, lote: List[Dict[str, Any]], error: Exception) -> int:
+        # Se reintentan en el próximo flush, delante de los nuevos
+        self._pendientes = lote + self._pendientes
+        self._stats["failed_flushes"] += 1
+        logger_journal.warning(f"No se pudo persistir {len(lote)} eventos en DB: {error}")
+        return 0
+    
+    def _escribir_lote(self, lote: List[Dict[str, Any]]):
+        from app.database import get_session
+        from app.db_models import JournalEntryDB, Campaign
+        from sqlmodel import select
         
+        with get_session() as db:
+            # Resolver campaign_id una vez por sesión (solo se cachean los encontrados,
+            # la campaña puede guardarse después de los primeros eventos)
+            faltantes = {f["session_id"] for f in lote} - self._campaign_ids.keys()
+            if faltantes:
+                for campaign_id, sid in db.exec(
+                    select(Campaign.id, Campaign.session_id).where(Campaign.session_id.in_(faltantes))
+                ).all():
+                    self._campaign_ids[sid] = campaign_id
+            
+            db.add_all([
+                JournalEntryDB(
+                    campaign_id=self._campaign_ids.get(f["session_id"]),
+                    session_id=f["session_id"],
+                    event_type=f["event_type"],
+                    description=f["description"],
+                    timestamp=f["timestamp"],
+                )
+                for f in lote
+            ])
+            db.commit()
+    
+    def get_log(self, session_id: str) -> List[Dict[str, Any]]:
+        """
+        Eventos recientes de una sesión (hasta JOURNAL_MEMORY_EVENTS, en orden).
+        Solo memoria: para una sesión que aún no se usó, await preparar() antes.
+        """
+        events = list(self.sessions.get(session_id, ()))
         logger_journal.debug(f"Recuperando {len(events)} eventos para {session_id}")
         return events
     
+    def total(self, session_id: str) -> int:
+        """
+        Cantidad total de eventos de la sesión, incluidos los que ya no están en memoria.
+        Solo memoria, como get_log.
+        """
+        return self.totales.get(session_id, 0)
+    
+    async def eventos(self, session_id: str, desde: int, hasta: int) -> List[Dict[str, Any]]:
+        """
+        Eventos por posición absoluta [desde, hasta) en el historial de la sesión.
+        Se sirven de memoria si están en la cola reciente; si no, de la DB.
+        """
+        from app.database import run_db
+        
+        await self.preparar(session_id)
+        total = self.total(session_id)
+        hasta = min(hasta, total)
+        if desde >= hasta:
+            return []
+        
+        reciente = self.sessions.get(session_id, ())
+        inicio_memoria = total - len(reciente)
+        if desde >= inicio_memoria:
+            return list(reciente)[desde - inicio_memoria:hasta - inicio_memoria]
+        
+        try:
+            # Lo pendiente de la escritura diferida también es historial
+            async with self._flush_lock:
+                await self._flush_sin_lock()
+                filas = await run_db(self._leer_eventos, session_id, desde, hasta)
+            return [self._fila_a_evento(f) for f in filas]
+        except Exception as e:
+            logger_journal.warning(f"No se pudo leer el historial desde DB: {e}")
+            return []
+    
+    @staticmethod
+    def _leer_eventos(session_id: str, desde: int, hasta: int) -> list:
+        from app.database import get_session
+        from app.db_models import JournalEntryDB
+        from sqlmodel import select
+        
+        with get_session() as db:
+            return list(db.exec(
+                select(JournalEntryDB)
+                .where(JournalEntryDB.session_id == session_id)
+                .order_by(JournalEntryDB.timestamp, JournalEntryDB.id)
+                .offset(desde)
+                .limit(hasta - desde)
+            ).all())
+    
+    def historial(
+        self,
+        session_id: str,
+        limit: int = 50,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        event_type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Página del historial persistido, por keyset sobre (timestamp, id).
+        No vacía la escritura diferida: quien llama hace flush_async antes.
+        
+        Args:
+            before: cursor; devuelve los `limit` eventos inmediatamente anteriores
+            after: cursor; devuelve los `limit` eventos inmediatamente posteriores
+            event_type: filtra por tipo de evento
+        
+        Returns:
+            {"events": [...] en orden cronológico, "prev_cursor", "next_cursor"}.
+            prev_cursor es None si no hay eventos más antiguos.
+        
+        Raises:
+            ValueError: si el cursor no es válido
+        """
+        from app.database import get_session
+        from app.db_models import JournalEntryDB
+        from sqlmodel import select, or_, and_
+        
+        ts, id_ = JournalEntryDB.timestamp, JournalEntryDB.id
+        stmt = select(JournalEntryDB).where(JournalEntryDB.session_id == session_id)
+        if event_type:
+            stmt = stmt.where(JournalEntryDB.event_type == event_type)
+        
+        if after:
+            c_ts, c_id = self._leer_cursor(after)
+            stmt = stmt.where(or_(ts > c_ts, and_(ts == c_ts, id_ > c_id))).order_by(ts, id_)
+        else:
+            if before:
+                c_ts, c_id = self._leer_cursor(before)
+                stmt = stmt.where(or_(ts < c_ts, and_(ts == c_ts, id_ < c_id)))
+            stmt = stmt.order_by(ts.desc(), id_.desc())
+        
+        with get_session() as db:
+            filas = list(db.exec(stmt.limit(limit + 1)).all())
+        
+        hay_mas = len(filas) > limit
+        filas = filas[:limit]
+        if not after:
+            filas.reverse()
+        
+        events = [
+            {"id": f.id, "cursor": self._cursor(f), **self._fila_a_evento(f)}
+            for f in filas
+        ]
+        # Hacia atrás hay más si sobró una fila (o, yendo hacia adelante, si partimos de un cursor)
+        mas_antiguos = hay_mas if not after else bool(events)
+        return {
+            "events": events,
+            "prev_cursor": events[0]["cursor"] if events and mas_antiguos else None,
+            "next_cursor": events[-1]["cursor"] if events else after,
+        }
+    
     def clear_session(self, session_id: str):
         """Limpia el journal de una sesión"""
         if session_id in self.sessions:
             count = len(self.sessions[session_id])
             del self.sessions[session_id]
+            self.totales.pop(session_id, None)
             logger_journal.info(f"Journal limpiado para {session_id} ({count} eventos eliminados)")
-
+    
+    async def _cargar(self, session_id: str):
+        """Carga desde la DB la cola reciente y el total de la sesión."""
+        from app.database import run_db
+        
+        reciente: Deque[Dict[str, Any]] = deque(maxlen=JOURNAL_MEMORY_EVENTS)
+        total = 0
+        try:
+            # Lo pendiente de la escritura diferida también es historial
+            async with self._flush_lock:
+                await self._flush_sin_lock()
+                total, filas = await run_db(self._leer_recientes, session_id)
+            reciente.extend(self._fila_a_evento(f) for f in reversed(filas))
+            if total:
+                logger_journal.info(f"Cargados {len(reciente)} de {total} eventos desde DB para {session_id}")
+        except Exception as e:
+            logger_journal.warning(f"No se pudo cargar journal desde DB: {e}")
+        
+        # Filas que no se pudieron persistir (flush fallido): siguen siendo historial
+        for fila in self._pendientes:
+            if fila["session_id"] == session_id:
+                reciente.append(self._fila_a_evento(SimpleNamespace(**fila)))
+                total += 1
+        
+        self.sessions[session_id] = reciente
+        self.totales[session_id] = total
+    
+    @staticmethod
+    def _leer_recientes(session_id: str) -> Tuple[int, list]:
+        """Total de eventos y los JOURNAL_MEMORY_EVENTS más recientes (del más nuevo al más viejo)."""
+        from app.database import get_session
+        from app.db_models import JournalEntryDB
+        from sqlmodel import select, func
+        
+        with get_session() as db:
+            total = db.exec(
+                select(func.count(JournalEntryDB.id)).where(JournalEntryDB.session_id == session_id)
+            ).one()
+            if not total:
+                return 0, []
+            filas = db.exec(
+                select(JournalEntryDB)
+                .where(JournalEntryDB.session_id == session_id)
+                .order_by(JournalEntryDB.timestamp.desc(), JournalEntryDB.id.desc())
+                .limit(JOURNAL_MEMORY_EVENTS)
+            ).all()
+        return total, list(filas)
+    
+    @staticmethod
+    def _cursor(fila) -> str:
+        return f"{fila.timestamp.isoformat()}|{fila.id}"
+    
+    @staticmethod
+    def _leer_cursor(cursor: str):
+        ts, _, id_ = cursor.rpartition("|")
+        return datetime.fromisoformat(ts), int(id_)
+    
+    @staticmethod
+    def _fila_a_evento(fila) -> Dict[str, Any]:
+        return {
+            "timestamp": fila.timestamp.isoformat(),
+            "event_type": fila.event_type,
+            "description": fila.description,
+            "metadata": {}
+        }
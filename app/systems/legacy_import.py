@@ -0,0 +1,218 @@
+"""
+Importación masiva de partidas JSON legacy (partidas_guardadas/).
+
+Los archivos se leen y se parten en secciones comprimidas en un pool de
+procesos; el proceso principal solo inserta, en una transacción por cada
+LEGACY_IMPORT_BATCH partidas, mientras el pool ya prepara el lote
+siguiente. Los session_id ya guardados se consultan una sola vez al
+empezar y sus archivos ni se abren, así que relanzar una importación
+interrumpida retoma donde quedó. El progreso se publica por websocket.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from app.config import SAVE_DIR
+from app.database import get_session, run_db
+from app.db_models import Campaign, CampaignSection
+from app.systems.saves import comprimir_secciones
+from app.logger import setup_logger
+
+logger = setup_logger("legacy_import")
+
+LEGACY_IMPORT_BATCH = int(os.getenv("LEGACY_IMPORT_BATCH", "200"))
+LEGACY_IMPORT_WORKERS = int(os.getenv("LEGACY_IMPORT_WORKERS", "0")) or os.cpu_count() or 2
+
+
+# ─── Trabajo de cada proceso ────────────────────────────
+
+def preparar_partida(session_id: str, ruta: str) -> Dict[str, Any]:
+    """Lee un JSON legacy y lo deja listo para insertar (corre en el pool de procesos)."""
+    with open(ruta, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("El archivo no contiene una partida")
+
+    title, style_name = "Importada", ""
+    adventure = data.get("adventure", {})
+    if isinstance(adventure, dict):
+        historia = adventure.get("historia", {})
+        if isinstance(historia, dict):
+            title = historia.get("titulo", "Importada")
+        estilo = adventure.get("estilo", {})
+        if isinstance(estilo, dict):
+            style_name = estilo.get("nombre", "")
+    return {
+        "session_id": session_id,
+        "title": title,
+        "style": style_name,
+        "secciones": comprimir_secciones(data),
+    }
+
+
+# ─── DB ─────────────────────────────────────────────────
+
+def _listar_archivos(directorio: str) -> List[Tuple[str, str]]:
+    """[(session_id, ruta)] de los .json del directorio, en orden estable."""
+    if not os.path.isdir(directorio):
+        return []
+    archivos = [
+        (e.name.replace("partida_", "").replace(".json", ""), e.path)
+        for e in os.scandir(directorio)
+        if e.is_file() and e.name.endswith(".json")
+    ]
+    return sorted(archivos)
+
+
+def _session_ids_guardados() -> set:
+    with get_session() as db:
+        return set(db.exec(select(Campaign.session_id)).all())
+
+
+def _insertar_lote(partidas: List[Dict[str, Any]]) -> int:
+    """Inserta campañas y secciones de un lote en una sola transacción. Retorna cuántas insertó."""
+    with get_session() as db:
+        # Alguna pudo guardarse mientras tanto (p. ej. /load con fallback JSON)
+        ya = set(db.exec(
+            select(Campaign.session_id).where(Campaign.session_id.in_([p["session_id"] for p in partidas]))
+        ).all())
+        nuevas = [p for p in partidas if p["session_id"] not in ya]
+        campanas = [Campaign(session_id=p["session_id"], title=p["title"], style=p["style"]) for p in nuevas]
+        db.add_all(campanas)
+        db.flush()
+
+        ahora = datetime.utcnow()
+        filas = [
+            {"campaign_id": c.id, "key": clave, "data": datos, "raw_size": tamano,
+             "checksum": crc, "updated_at": ahora}
+            for c, p in zip(campanas, nuevas)
+            for clave, (datos, tamano, crc) in p["secciones"].items()
+        ]
+        if filas:
+            db.execute(insert(CampaignSection), filas)
+        db.commit()
+        return len(nuevas)
+
+
+# ─── Orquestación ───────────────────────────────────────
+
+class ImportadorLegacy:
+    """Una importación a la vez, en segundo plano, con progreso consultable y por websocket."""
+
+    def __init__(self, directorio: str = SAVE_DIR):
+        self.directorio = directorio
+        # notifier(session_id, mensaje): lo conecta state.py al ConnectionManager
+        self.notifier: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self.progreso: Dict[str, Any] = {"state": "idle"}
+
+    def iniciar(self, session_id: str) -> bool:
+        """Lanza la importación. False si ya hay una en curso."""
+        if self._tarea and not self._tarea.done():
+            return False
+        self.progreso = {
+            "state": "running", "total": 0, "skipped": 0, "imported": 0,
+            "failed": 0, "done": 0, "errors": [],
+        }
+        self._tarea = asyncio.create_task(self._ejecutar(session_id))
+        return True
+
+    def estado(self) -> Dict[str, Any]:
+        return dict(self.progreso)
+
+    async def detener(self):
+        """Cancela la importación en curso; lo ya insertado queda y se retoma al relanzarla."""
+        if self._tarea and not self._tarea.done():
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+
+    async def _ejecutar(self, session_id: str):
+        progreso = self.progreso
+        try:
+            archivos = await run_db(_listar_archivos, self.directorio)
+            guardados = await run_db(_session_ids_guardados)
+            pendientes = [(sid, ruta) for sid, ruta in archivos if sid not in guardados]
+            progreso.update(total=len(archivos), skipped=len(archivos) - len(pendientes))
+            progreso["done"] = progreso["skipped"]
+            await self._notificar(session_id)
+            logger.info(
+                f"📥 Importación legacy: {len(pendientes)} partidas pendientes de {len(archivos)} "
+                f"({LEGACY_IMPORT_WORKERS} procesos, lotes de {LEGACY_IMPORT_BATCH})"
+            )
+
+            loop = asyncio.get_running_loop()
+            lotes = [pendientes[i:i + LEGACY_IMPORT_BATCH] for i in range(0, len(pendientes), LEGACY_IMPORT_BATCH)]
+            # spawn: los procesos no heredan hilos ni conexiones abiertas del servidor
+            pool = ProcessPoolExecutor(LEGACY_IMPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            siguiente = None
+            try:
+                def preparar(lote):
+                    return asyncio.gather(
+                        *(loop.run_in_executor(pool, preparar_partida, sid, ruta) for sid, ruta in lote),
+                        return_exceptions=True,
+                    )
+
+                siguiente = preparar(lotes[0]) if lotes else None
+                for i, lote in enumerate(lotes):
+                    resultados = await siguiente
+                    # El pool prepara el lote siguiente mientras este se inserta
+                    siguiente = preparar(lotes[i + 1]) if i + 1 < len(lotes) else None
+
+                    validas = []
+                    for (sid, ruta), resultado in zip(lote, resultados):
+                        if isinstance(resultado, Exception):
+                            progreso["failed"] += 1
+                            if len(progreso["errors"]) < 50:
+                                progreso["errors"].append({"file": os.path.basename(ruta), "error": str(resultado)})
+                            logger.error(f"Error importando {ruta}: {resultado}")
+                        else:
+                            validas.append(resultado)
+                    if validas:
+                        try:
+                            insertadas = await run_db(_insertar_lote, validas)
+                        except IntegrityError as e:
+                            # Una partida se guardó justo entre la comprobación y el commit:
+                            # el lote se descarta entero y se reintentará al relanzar
+                            progreso["failed"] += len(validas)
+                            if len(progreso["errors"]) < 50:
+                                progreso["errors"].append({"file": f"lote {i + 1}", "error": str(e.orig)})
+                            logger.error(f"Lote {i + 1} de la importación legacy descartado: {e.orig}")
+                        else:
+                            progreso["imported"] += insertadas
+                            progreso["skipped"] += len(validas) - insertadas
+                    progreso["done"] += len(lote)
+                    await self._notificar(session_id)
+            finally:
+                # Sin esperar en el loop: al cancelar se descarta lo que quedaba en cola
+                if siguiente is not None:
+                    siguiente.cancel()
+                pool.shutdown(wait=False, cancel_futures=True)
+
+            progreso["state"] = "done"
+            logger.info(
+                f"📥 Importación legacy terminada: {progreso['imported']} importadas, "
+                f"{progreso['skipped']} ya existían, {progreso['failed']} con error"
+            )
+        except asyncio.CancelledError:
+            progreso["state"] = "cancelled"
+            raise
+        except Exception as e:
+            progreso["state"] = "failed"
+            progreso["error"] = str(e)
+            logger.error(f"❌ Importación legacy falló: {e}", exc_info=True)
+        finally:
+            if progreso["state"] != "cancelled":
+                await self._notificar(session_id)
+
+    async def _notificar(self, session_id: str):
+        if self.notifier:
+            try:
+                await self.notifier(session_id, {"type": "legacy_import_progress", **self.estado()})
+            except Exception as e:
+                logger.warning(f"No se pudo notificar el progreso de la importación: {e}")
@@ -0,0 +1,223 @@
+"""
+Pool de aventuras pregeneradas.
+
+Mantiene en SQLite hasta ADVENTURE_POOL_SIZE aventuras listas por cada
+cubo (estilo, nivel). El relleno solo avanza mientras la cola LLM está
+ociosa y sus llamadas van con prioridad de prefetch, así que nunca
+retrasa a una mesa real. /new entrega una del pool al instante cuando la
+petición encaja en un cubo.
+"""
+import asyncio
+import json
+import os
+import random
+from typing import Optional, Dict, Any, List, Tuple
+from sqlmodel import select, func
+from app.config import ESTILOS, MICRO_SETTINGS
+from app.database import get_session, run_db
+from app.db_models import PooledAdventure
+from app.components.ai.scheduler import llm_scheduler, contexto_llm, PRIORIDAD_PREFETCH
+from app.logger import setup_logger
+
+logger = setup_logger("adventure_pool")
+
+POOL_ENABLED = os.getenv("ADVENTURE_POOL_ENABLED", "True") == "True"
+POOL_SIZE = int(os.getenv("ADVENTURE_POOL_SIZE", "1"))
+POOL_LEVELS = [int(n) for n in os.getenv("ADVENTURE_POOL_LEVELS", "1,3,5").split(",") if n.strip()]
+POOL_IDLE_CHECK = float(os.getenv("ADVENTURE_POOL_IDLE_CHECK", "30"))
+# Tras un relleno fallido se espera IDLE_CHECK * 2^fallos, hasta este máximo
+POOL_BACKOFF_MAX = float(os.getenv("ADVENTURE_POOL_BACKOFF_MAX", "600"))
+
+
+class AdventurePool:
+    """Stock de aventuras por (estilo, nivel), rellenado en tiempo ocioso."""
+
+    def __init__(self, size: int, niveles: List[int]):
+        self.size = size
+        self.niveles = niveles
+        self._task: Optional[asyncio.Task] = None
+        self._despertar: Optional[asyncio.Event] = None
+        self._stats = {"served": 0, "misses": 0, "generated": 0, "failed": 0}
+        self._fallos_seguidos = 0
+
+    def cubos(self) -> List[Tuple[str, int]]:
+        return [(e["nombre"], n) for e in ESTILOS for n in self.niveles]
+
+    # ─── Entrega ─────────────────────────────────────────
+
+    async def tomar(self, estilo: str, nivel: int, setting: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Saca la aventura más antigua del cubo (y del setting, si se pide uno).
+
+        Returns:
+            {"setting", "data"} o None si el cubo no existe o está vacío
+        """
+        if (estilo, nivel) not in self.cubos():
+            return None
+
+        resultado = await run_db(self._sacar, estilo, nivel, setting)
+        if resultado is None:
+            self._stats["misses"] += 1
+            return None
+
+        self._stats["served"] += 1
+        logger.info(f"📦 Aventura servida desde el pool ({estilo}, nivel {nivel})")
+        self.despertar()
+        return resultado
+
+    async def stats(self) -> Dict[str, Any]:
+        stock = {f"{estilo}|{nivel}": cantidad for (estilo, nivel), cantidad in (await run_db(self._contar_stock)).items()}
+        return {
+            "enabled": POOL_ENABLED,
+            "size_per_bucket": self.size,
+            "levels": self.niveles,
+            "buckets": len(self.cubos()),
+            "stocked": sum(stock.values()),
+            "capacity": len(self.cubos()) * self.size,
+            "stock": stock,
+            "backoff_seconds": self._espera() if self._fallos_seguidos else 0,
+            **self._stats,
+        }
+
+    # ─── Relleno en segundo plano ────────────────────────
+
+    def iniciar(self):
+        if not POOL_ENABLED or self.size <= 0:
+            logger.info("Pool de aventuras desactivado")
+            return
+        self._despertar = asyncio.Event()
+        self._task = asyncio.create_task(self._bucle())
+        logger.info(f"Pool de aventuras iniciado ({len(self.cubos())} cubos x {self.size})")
+
+    async def detener(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def despertar(self):
+        """Pide revisar el pool ya (p. ej. tras servir una aventura)."""
+        if self._despertar:
+            self._despertar.set()
+
+    def _espera(self) -> float:
+        """Pausa hasta el próximo ciclo: crece con cada relleno fallido seguido."""
+        return min(POOL_IDLE_CHECK * 2 ** self._fallos_seguidos, POOL_BACKOFF_MAX)
+
+    async def _bucle(self):
+        while True:
+            if self._fallos_seguidos:
+                # En backoff (p. ej. Ollama caído): servir una aventura no adelanta el reintento
+                await asyncio.sleep(self._espera())
+            else:
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), timeout=POOL_IDLE_CHECK)
+                except asyncio.TimeoutError:
+                    pass
+            self._despertar.clear()
+
+            # Rellenar mientras la cola siga ociosa
+            while await self._ocioso():
+                cubo = await self._cubo_mas_vacio()
+                if cubo is None:
+                    break
+                if not await self._rellenar(*cubo):
+                    self._fallos_seguidos += 1
+                    logger.info(f"Pool en pausa {self._espera():.0f}s tras {self._fallos_seguidos} fallo(s)")
+                    break
+                self._fallos_seguidos = 0
+
+    async def _ocioso(self) -> bool:
+        """Cola LLM vacía y sin actividad durante un instante (no entre dos llamadas de una generación)."""
+        if not llm_scheduler.is_idle():
+            return False
+        await asyncio.sleep(1.0)
+        return llm_scheduler.is_idle()
+
+    async def _cubo_mas_vacio(self) -> Optional[Tuple[str, int]]:
+        stock = await run_db(self._contar_stock)
+        faltantes = [c for c in self.cubos() if stock.get(c, 0) < self.size]
+        if not faltantes:
+            return None
+        return min(faltantes, key=lambda c: stock.get(c, 0))
+
+    async def _rellenar(self, estilo_nombre: str, nivel: int) -> bool:
+        from app.components.dnd.generator import crear_datos_aventura
+
+        estilo = next(e for e in ESTILOS if e["nombre"] == estilo_nombre)
+        setting = random.choice(MICRO_SETTINGS)
+        logger.info(f"🧺 Pregenerando aventura ({estilo_nombre}, nivel {nivel})")
+
+        try:
+            with contexto_llm(PRIORIDAD_PREFETCH):
+                data = await crear_datos_aventura(
+                    session_id="__pool__",
+                    setting=setting,
+                    estilo=estilo,
+                    nivel=nivel,
+                    imagenes=False,
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.warning(f"Fallo pregenerando aventura: {e}")
+            return False
+
+        if not data or not data.get("historia", {}).get("escenas"):
+            self._stats["failed"] += 1
+            return False
+
+        if data.get("emergencia"):
+            # PJs o historia de emergencia: no es una aventura nueva, no va al stock
+            self._stats["failed"] += 1
+            logger.warning("Pregeneración descartada: el generador usó datos de emergencia")
+            return False
+
+        await run_db(self._guardar, PooledAdventure(
+            style=estilo_nombre,
+            nivel=nivel,
+            setting=setting,
+            data_json=json.dumps(data, ensure_ascii=False),
+        ))
+        self._stats["generated"] += 1
+        logger.info(f"✓ Aventura guardada en el pool: {data['historia'].get('titulo')}")
+        return True
+
+    # ─── Acceso a la DB (en el pool de hilos) ────────────
+
+    @staticmethod
+    def _sacar(estilo: str, nivel: int, setting: Optional[str]) -> Optional[Dict[str, Any]]:
+        with get_session() as db:
+            stmt = select(PooledAdventure).where(
+                PooledAdventure.style == estilo,
+                PooledAdventure.nivel == nivel,
+            )
+            if setting:
+                stmt = stmt.where(PooledAdventure.setting == setting)
+            item = db.exec(stmt.order_by(PooledAdventure.created_at)).first()
+            if not item:
+                return None
+
+            resultado = {"setting": item.setting, "data": json.loads(item.data_json)}
+            db.delete(item)
+            db.commit()
+        return resultado
+
+    @staticmethod
+    def _contar_stock() -> Dict[Tuple[str, int], int]:
+        with get_session() as db:
+            filas = db.exec(
+                select(PooledAdventure.style, PooledAdventure.nivel, func.count(PooledAdventure.id))
+                .group_by(PooledAdventure.style, PooledAdventure.nivel)
+            ).all()
+        return {(estilo, nivel): cantidad for estilo, nivel, cantidad in filas}
+
+    @staticmethod
+    def _guardar(item: PooledAdventure):
+        with get_session() as db:
+            db.add(item)
+            db.commit()
+
+
+adventure_pool = AdventurePool(size=POOL_SIZE, niveles=POOL_LEVELS)
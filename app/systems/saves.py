@@ -0,0 +1,674 @@
+"""
+Guardado incremental de campañas.
+
+La foto base de una partida vive en campaign_sections: pjs, cabecera de la
+historia, cada escena, vtt, combate... cada una como JSON comprimido con
+zlib, de modo que se puede leer una sola sin tocar el resto. Cada guardado
+posterior solo agrega a campaign_deltas las operaciones JSON-Patch (RFC
+6902: add, replace, remove) de lo que cambió desde el anterior. Qué revisar
+lo dicen las claves sucias de EstadoSesion (de primer nivel o secciones de
+la aventura: pjs, historia, escena:N...), así que el costo del guardado
+depende del tamaño del cambio y no del de la campaña. Cada
+SAVE_COMPACT_EVERY deltas (o cuando ya pesan más que SAVE_COMPACT_RATIO
+veces la base) se compactan reescribiendo solo las secciones que cambiaron.
+
+Las campañas anteriores guardadas enteras en Campaign.data_json se migran
+a secciones al cargarlas o en segundo plano al arrancar (migrar_legacy).
+"""
+import asyncio
+import contextlib
+import copy
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sqlmodel import select, delete, func
+from app.database import get_session, run_db
+from app.db_models import Campaign, CampaignSection, CampaignDelta
+from app.logger import setup_logger
+
+logger = setup_logger("saves")
+
+SAVE_COMPACT_EVERY = int(os.getenv("SAVE_COMPACT_EVERY", "50"))
+SAVE_COMPACT_RATIO = float(os.getenv("SAVE_COMPACT_RATIO", "0.5"))
+SAVE_COMPRESS_LEVEL = int(os.getenv("SAVE_COMPRESS_LEVEL", "6"))
+
+_FALTA = object()
+
+
+# ─── Estado de sesión con claves sucias ─────────────────
+
+class EstadoSesion(dict):
+    """
+    dict de sesión que anota qué claves de primer nivel cambiaron desde el
+    último guardado. Las mutaciones anidadas in-place deben avisarse con
+    marcar(): con la clave de primer nivel o, dentro de "adventure", con la
+    sección tocada ("pjs", "historia", "aventura", "escena:N") para que el
+    guardado compare solo esa parte.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sucias = set(self.keys())
+
+    def __setitem__(self, clave, valor):
+        super().__setitem__(clave, valor)
+        self.sucias.add(clave)
+
+    def __delitem__(self, clave):
+        super().__delitem__(clave)
+        self.sucias.add(clave)
+
+    def pop(self, clave, *default):
+        self.sucias.add(clave)
+        return super().pop(clave, *default)
+
+    def setdefault(self, clave, default=None):
+        if clave not in self:
+            self.sucias.add(clave)
+        return super().setdefault(clave, default)
+
+    def update(self, *args, **kwargs):
+        cambios = dict(*args, **kwargs)
+        super().update(cambios)
+        self.sucias.update(cambios)
+
+    def clear(self):
+        self.sucias.update(self.keys())
+        super().clear()
+
+    def marcar(self, *claves: str):
+        """Avisa de una mutación in-place dentro de estas claves (o secciones de la aventura)."""
+        self.sucias.update(claves)
+
+    def tomar_sucias(self) -> set:
+        sucias, self.sucias = self.sucias, set()
+        return sucias
+
+
+class RegistroSesiones(dict):
+    """SESSIONS: convierte cada estado asignado en EstadoSesion."""
+
+    def __setitem__(self, session_id, estado):
+        if not isinstance(estado, EstadoSesion):
+            estado = EstadoSesion(estado)
+        super().__setitem__(session_id, estado)
+
+    def setdefault(self, session_id, default=None):
+        if session_id not in self:
+            self[session_id] = default if default is not None else {}
+        return self[session_id]
+
+
+# ─── JSON-Patch ─────────────────────────────────────────
+
+def _puntero(ruta: str, clave: Any) -> str:
+    return f"{ruta}/{str(clave).replace('~', '~0').replace('/', '~1')}"
+
+
+def diff_json(antes: Any, despues: Any, ruta: str, ops: List[Dict[str, Any]]):
+    """Agrega a `ops` las operaciones que llevan `antes` a `despues` (bajo `ruta`)."""
+    if antes is _FALTA:
+        if despues is not _FALTA:
+            ops.append({"op": "add", "path": ruta, "value": despues})
+        return
+    if despues is _FALTA:
+        ops.append({"op": "remove", "path": ruta})
+        return
+
+    if isinstance(antes, dict) and isinstance(despues, dict):
+        for clave in antes.keys() - despues.keys():
+            ops.append({"op": "remove", "path": _puntero(ruta, clave)})
+        for clave, valor in despues.items():
+            diff_json(antes.get(clave, _FALTA), valor, _puntero(ruta, clave), ops)
+    elif isinstance(antes, list) and isinstance(despues, list):
+        comun = min(len(antes), len(despues))
+        for i in range(comun):
+            diff_json(antes[i], despues[i], _puntero(ruta, i), ops)
+        for valor in despues[comun:]:
+            ops.append({"op": "add", "path": f"{ruta}/-", "value": valor})
+        # Quitar sobrantes desde el final para que los índices sigan siendo válidos
+        for i in range(len(antes) - 1, comun - 1, -1):
+            ops.append({"op": "remove", "path": _puntero(ruta, i)})
+    elif type(antes) is not type(despues) or antes != despues:
+        ops.append({"op": "replace", "path": ruta, "value": despues})
+
+
+def _en(doc: Any, ruta: Tuple) -> Any:
+    """Valor en `ruta` (claves e índices) dentro de `doc`, o _FALTA si no existe."""
+    for parte in ruta:
+        if isinstance(doc, dict):
+            doc = doc.get(parte, _FALTA)
+        elif isinstance(doc, list) and isinstance(parte, int) and parte < len(doc):
+            doc = doc[parte]
+        else:
+            return _FALTA
+        if doc is _FALTA:
+            return _FALTA
+    return doc
+
+
+def _ruta_a_puntero(ruta: Tuple) -> str:
+    puntero = ""
+    for parte in ruta:
+        puntero = _puntero(puntero, parte)
+    return puntero
+
+
+def aplicar_patch(doc: Dict[str, Any], ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Aplica operaciones add/replace/remove in-place sobre `doc` y lo retorna."""
+    for op in ops:
+        partes = [p.replace("~1", "/").replace("~0", "~") for p in op["path"].split("/")[1:]]
+        padre = doc
+        for parte in partes[:-1]:
+            padre = padre[int(parte)] if isinstance(padre, list) else padre[parte]
+        ultima = partes[-1]
+
+        if isinstance(padre, list):
+            if op["op"] == "add":
+                if ultima == "-":
+                    padre.append(op["value"])
+                else:
+                    padre.insert(int(ultima), op["value"])
+            elif op["op"] == "replace":
+                padre[int(ultima)] = op["value"]
+            else:
+                del padre[int(ultima)]
+        else:
+            if op["op"] == "remove":
+                padre.pop(ultima, None)
+            else:
+                padre[ultima] = op["value"]
+    return doc
+
+
+# ─── Secciones ──────────────────────────────────────────
+
+# Claves de campaign_sections. Las demás claves de primer nivel de la sesión
+# (current_style, vtt, combat...) son una sección cada una con su propio nombre.
+SECCION_PJS = "pjs"
+SECCION_HISTORIA = "historia"  # cabecera: historia sin escenas + índice "_escenas"
+SECCION_AVENTURA = "aventura"  # resto de adventure (estilo, parcial...)
+PREFIJO_ESCENA = "escena:"
+
+
+def _es_seccion_aventura(clave: str) -> bool:
+    return clave in (SECCION_PJS, SECCION_HISTORIA, SECCION_AVENTURA) or clave.startswith(PREFIJO_ESCENA)
+
+
+def rutas_sucias(claves: set, antes: Dict[str, Any], despues: Dict[str, Any]) -> List[Tuple]:
+    """
+    Rutas que hay que comparar entre la sombra (`antes`) y el estado
+    (`despues`) para unas claves sucias: las de primer nivel enteras y, para
+    las secciones de la aventura, solo su parte. Si cambió el número de
+    escenas se agregan las escenas que sobran o faltan al final.
+    """
+    secciones = {c for c in claves if _es_seccion_aventura(c)}
+    rutas: List[Tuple] = [(c,) for c in sorted(claves - secciones, key=str)]
+    if not secciones or "adventure" in claves:
+        return rutas
+
+    aventura_antes, aventura_despues = antes.get("adventure", _FALTA), despues.get("adventure", _FALTA)
+    if not (isinstance(aventura_antes, dict) and isinstance(aventura_despues, dict)):
+        return rutas + [("adventure",)]
+
+    if SECCION_AVENTURA in secciones:
+        for clave in sorted((aventura_antes.keys() | aventura_despues.keys()) - {"pjs", "historia"}):
+            rutas.append(("adventure", clave))
+    if SECCION_PJS in secciones:
+        rutas.append(("adventure", "pjs"))
+
+    historia_antes, historia_despues = aventura_antes.get("historia"), aventura_despues.get("historia")
+    escenas_antes, escenas_despues = _en(historia_antes, ("escenas",)), _en(historia_despues, ("escenas",))
+    if not (isinstance(escenas_antes, list) and isinstance(escenas_despues, list)):
+        if secciones - {SECCION_AVENTURA, SECCION_PJS}:
+            rutas.append(("adventure", "historia"))
+        return rutas
+
+    if SECCION_HISTORIA in secciones:
+        for clave in sorted((historia_antes.keys() | historia_despues.keys()) - {"escenas"}):
+            rutas.append(("adventure", "historia", clave))
+
+    comun = min(len(escenas_antes), len(escenas_despues))
+    indices = {int(c[len(PREFIJO_ESCENA):]) for c in secciones if c.startswith(PREFIJO_ESCENA)}
+    rutas.extend(("adventure", "historia", "escenas", i) for i in sorted(indices) if i < comun)
+    # Escenas nuevas al final (add en orden) o sobrantes (remove desde el final)
+    rutas.extend(("adventure", "historia", "escenas", i) for i in range(comun, len(escenas_despues)))
+    rutas.extend(("adventure", "historia", "escenas", i) for i in range(len(escenas_antes) - 1, comun - 1, -1))
+    return rutas
+
+
+def dividir_en_secciones(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Parte el estado de una sesión en secciones independientes."""
+    secciones: Dict[str, Any] = {}
+    for clave, valor in data.items():
+        if clave != "adventure" or not isinstance(valor, dict):
+            secciones[clave] = valor
+            continue
+
+        resto = {k: v for k, v in valor.items() if k not in ("pjs", "historia")}
+        secciones[SECCION_AVENTURA] = resto
+        if "pjs" in valor:
+            secciones[SECCION_PJS] = valor["pjs"]
+        historia = valor.get("historia")
+        if isinstance(historia, dict) and isinstance(historia.get("escenas"), list):
+            cabecera = {k: v for k, v in historia.items() if k != "escenas"}
+            cabecera["_escenas"] = [
+                {"id": e.get("id"), "nombre": e.get("nombre")} if isinstance(e, dict) else {}
+                for e in historia["escenas"]
+            ]
+            secciones[SECCION_HISTORIA] = cabecera
+            for i, escena in enumerate(historia["escenas"]):
+                secciones[f"{PREFIJO_ESCENA}{i}"] = escena
+        elif "historia" in valor:
+            resto["historia"] = historia
+    return secciones
+
+
+def unir_secciones(secciones: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverso de dividir_en_secciones."""
+    data: Dict[str, Any] = {}
+    for clave, valor in secciones.items():
+        if clave not in (SECCION_PJS, SECCION_HISTORIA, SECCION_AVENTURA) and not clave.startswith(PREFIJO_ESCENA):
+            data[clave] = valor
+
+    if SECCION_AVENTURA in secciones:
+        aventura = dict(secciones[SECCION_AVENTURA])
+        if SECCION_PJS in secciones:
+            aventura["pjs"] = secciones[SECCION_PJS]
+        if SECCION_HISTORIA in secciones:
+            historia = dict(secciones[SECCION_HISTORIA])
+            indice = historia.pop("_escenas", [])
+            historia["escenas"] = [secciones[f"{PREFIJO_ESCENA}{i}"] for i in range(len(indice))]
+            aventura["historia"] = historia
+        data["adventure"] = aventura
+    return data
+
+
+def _serializar_secciones(data: Dict[str, Any]) -> Dict[str, str]:
+    return {k: json.dumps(v, ensure_ascii=False) for k, v in dividir_en_secciones(data).items()}
+
+
+def comprimir_secciones(data: Dict[str, Any]) -> Dict[str, Tuple[bytes, int, int]]:
+    """Estado de sesión -> {clave: (JSON comprimido, tamaño sin comprimir, crc32)}. Sin DB: apto para otro proceso."""
+    comprimidas = {}
+    for clave, texto in _serializar_secciones(data).items():
+        crudo = texto.encode("utf-8")
+        comprimidas[clave] = (zlib.compress(crudo, SAVE_COMPRESS_LEVEL), len(crudo), zlib.crc32(crudo))
+    return comprimidas
+
+
+def _escribir_secciones(db, campaign_id: int, secciones_json: Dict[str, str],
+                        checksums: Dict[str, int]) -> Dict[str, int]:
+    """
+    Escribe (comprimidas) solo las secciones cuyo crc cambió respecto a
+    `checksums` y borra las que ya no existen. Retorna los crc nuevos.
+    """
+    nuevos = {k: zlib.crc32(v.encode("utf-8")) for k, v in secciones_json.items()}
+    existentes = {
+        s.key: s for s in db.exec(select(CampaignSection).where(CampaignSection.campaign_id == campaign_id)).all()
+    }
+    ahora = datetime.utcnow()
+    for clave, texto in secciones_json.items():
+        fila = existentes.get(clave)
+        if fila is not None and checksums.get(clave) == nuevos[clave] and fila.checksum == nuevos[clave]:
+            continue
+        fila = fila or CampaignSection(campaign_id=campaign_id, key=clave, data=b"")
+        crudo = texto.encode("utf-8")
+        fila.data = zlib.compress(crudo, SAVE_COMPRESS_LEVEL)
+        fila.raw_size = len(crudo)
+        fila.checksum = nuevos[clave]
+        fila.updated_at = ahora
+        db.add(fila)
+    for clave, fila in existentes.items():
+        if clave not in secciones_json:
+            db.delete(fila)
+    return nuevos
+
+
+def _leer_fila_seccion(fila: CampaignSection) -> Any:
+    return json.loads(zlib.decompress(fila.data).decode("utf-8"))
+
+
+# ─── Guardado ───────────────────────────────────────────
+
+def metadatos_campana(estado: Dict[str, Any]) -> Tuple[str, str]:
+    """(título, nombre del estilo) de la aventura de una sesión."""
+    adventure = estado.get("adventure", {})
+    if not isinstance(adventure, dict):
+        return "Sin Título", "Unknown"
+    historia = adventure.get("historia", {})
+    title = historia.get("titulo", "Sin Título") if isinstance(historia, dict) else "Sin Título"
+    style = adventure.get("estilo", {})
+    style_name = style.get("nombre", "Unknown") if isinstance(style, dict) else "Unknown"
+    return title, style_name
+
+class CampaignSaves:
+    """Guarda campañas como secciones base + deltas y las reconstruye al cargar."""
+
+    def __init__(self, sesiones: Dict[str, EstadoSesion]):
+        self.sesiones = sesiones
+        # Última versión persistida de cada sesión (copia propia) y metadatos
+        self._sombras: Dict[str, Dict[str, Any]] = {}
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._stats = {
+            "full_saves": 0, "delta_saves": 0, "noop_saves": 0, "compactions": 0,
+            "sections_written": 0, "bytes_written": 0, "legacy_migrated": 0,
+        }
+
+    async def guardar(self, session_id: str, title: str, style_name: str) -> int:
+        """Persiste el estado de la sesión: delta si hay base conocida, foto completa si no. Retorna el id."""
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            if session_id not in self._sombras:
+                return await self._guardar_base(session_id, title, style_name)
+            return await self._guardar_delta(session_id, title, style_name)
+
+    async def guardar_lote(self, pedidos: List[Tuple[str, str, str]]) -> int:
+        """
+        Guarda varias sesiones (session_id, title, style_name): los deltas de
+        todas van en una sola transacción. Las que aún no tienen base se
+        guardan completas una por una. Retorna cuántas escribieron algo.
+        """
+        nuevas = [p for p in pedidos if p[0] not in self._sombras]
+        for session_id, title, style_name in nuevas:
+            await self.guardar(session_id, title, style_name)
+        escritas = len(nuevas)
+
+        conocidas = sorted(p for p in pedidos if p not in nuevas and p[0] in self._sombras)
+        async with contextlib.AsyncExitStack() as pila:
+            # Orden fijo de locks: guardar() solo toma uno, así que no hay interbloqueo
+            for session_id, _, _ in conocidas:
+                await pila.enter_async_context(self._locks.setdefault(session_id, asyncio.Lock()))
+
+            preparados = []
+            for session_id, title, style_name in conocidas:
+                if session_id not in self._sombras:  # olvidada mientras se esperaba el lock
+                    continue
+                preparado = self._preparar_delta(session_id, title, style_name)
+                if preparado:
+                    preparados.append((session_id, title, style_name, *preparado))
+            if not preparados:
+                return escritas
+
+            try:
+                await run_db(self._escribir_deltas, [
+                    (self._meta[sid]["id"], patch_json, title, style_name)
+                    for sid, title, style_name, patch_json, _ in preparados
+                ])
+            except Exception:
+                for sid, _, _, _, claves in preparados:
+                    self.sesiones[sid].marcar(*claves)
+                raise
+
+            for sid, title, style_name, patch_json, _ in preparados:
+                if self._confirmar_delta(sid, patch_json, title, style_name):
+                    await self._compactar(sid)
+        return escritas + len(preparados)
+
+    async def cargar(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """
+        Reconstruye la partida (secciones + deltas) y la deja en SESSIONS.
+
+        Returns:
+            (campaign_id, title) o None si no hay campaña guardada
+        """
+        leida = await run_db(self._leer, session_id)
+        if not leida:
+            return None
+        data, meta = leida
+        if meta.pop("migrada"):
+            self._stats["legacy_migrated"] += 1
+
+        self.sesiones[session_id] = data
+        self.sesiones[session_id].tomar_sucias()
+        self._sombras[session_id] = copy.deepcopy(data)
+        self._meta[session_id] = meta
+        return meta["id"], meta["title"]
+
+    async def leer_secciones(self, campaign_id: int, claves: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Lee solo las secciones pedidas de una campaña, sin reconstruirla entera.
+
+        Returns:
+            {clave: valor} (las claves inexistentes se omiten) o None si la campaña no existe
+        """
+        for session_id, meta in self._meta.items():
+            if meta["id"] == campaign_id and session_id in self._sombras:
+                # En memoria: la sombra ya incluye los deltas pendientes
+                secciones = dividir_en_secciones(self._sombras[session_id])
+                return {k: secciones[k] for k in claves if k in secciones}
+        return await run_db(self._leer_secciones_db, campaign_id, claves)
+
+    def olvidar(self, session_id: str):
+        """Descarta la base conocida (p. ej. al eliminar la campaña)."""
+        self._sombras.pop(session_id, None)
+        self._meta.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracked_sessions": len(self._sombras),
+            "pending_deltas": sum(m["deltas"] for m in self._meta.values()),
+            **self._stats,
+        }
+
+    @staticmethod
+    def migrar_legacy(lote: int = 20) -> int:
+        """Pasa a secciones las campañas guardadas enteras en data_json. Retorna cuántas migró."""
+        migradas = 0
+        while True:
+            with get_session() as db:
+                campanas = db.exec(
+                    select(Campaign).where(Campaign.data_json != "{}").limit(lote)
+                ).all()
+                if not campanas:
+                    break
+                for campaign in campanas:
+                    _escribir_secciones(db, campaign.id, _serializar_secciones(json.loads(campaign.data_json)), {})
+                    campaign.data_json = "{}"
+                    db.add(campaign)
+                db.commit()
+                migradas += len(campanas)
+        if migradas:
+            logger.info(f"🗂️ {migradas} campañas legacy migradas a secciones comprimidas")
+        return migradas
+
+    # ─── Internos ────────────────────────────────────────
+
+    async def _guardar_base(self, session_id: str, title: str, style_name: str) -> int:
+        estado = self.sesiones[session_id]
+        estado.tomar_sucias()
+        # Serializar en el loop: SESSIONS puede cambiar mientras el hilo de DB escribe
+        secciones_json = _serializar_secciones(estado)
+        campaign_id, checksums = await run_db(self._escribir_base, session_id, title, style_name, secciones_json)
+
+        self._sombras[session_id] = unir_secciones({k: json.loads(v) for k, v in secciones_json.items()})
+        tamano = sum(len(v) for v in secciones_json.values())
+        self._meta[session_id] = {
+            "id": campaign_id, "title": title, "style": style_name,
+            "deltas": 0, "bytes_deltas": 0, "bytes_base": tamano, "checksums": checksums,
+        }
+        self._stats["full_saves"] += 1
+        self._stats["sections_written"] += len(secciones_json)
+        self._stats["bytes_written"] += tamano
+        return campaign_id
+
+    async def _guardar_delta(self, session_id: str, title: str, style_name: str) -> int:
+        meta = self._meta[session_id]
+        preparado = self._preparar_delta(session_id, title, style_name)
+        if preparado is None:
+            return meta["id"]
+
+        patch_json, claves = preparado
+        try:
+            await run_db(self._escribir_deltas, [(meta["id"], patch_json, title, style_name)])
+        except Exception:
+            self.sesiones[session_id].marcar(*claves)
+            raise
+
+        if self._confirmar_delta(session_id, patch_json, title, style_name):
+            await self._compactar(session_id)
+        return meta["id"]
+
+    def _preparar_delta(self, session_id: str, title: str, style_name: str) -> Optional[Tuple[str, set]]:
+        """(patch_json, claves revisadas) del estado contra la sombra, o None si no cambió nada."""
+        estado = self.sesiones[session_id]
+        sombra = self._sombras[session_id]
+        meta = self._meta[session_id]
+
+        claves = estado.tomar_sucias()
+        ops: List[Dict[str, Any]] = []
+        for ruta in rutas_sucias(claves, sombra, estado):
+            diff_json(_en(sombra, ruta), _en(estado, ruta), _ruta_a_puntero(ruta), ops)
+
+        renombrada = (title, style_name) != (meta["title"], meta["style"])
+        if not ops and not renombrada:
+            self._stats["noop_saves"] += 1
+            return None
+        return (json.dumps(ops, ensure_ascii=False) if ops else ""), claves
+
+    def _confirmar_delta(self, session_id: str, patch_json: str, title: str, style_name: str) -> bool:
+        """Avanza sombra y metadatos tras escribir el delta. Retorna True si toca compactar."""
+        meta = self._meta[session_id]
+        # La sombra avanza con una copia de los valores (no con referencias al estado vivo)
+        if patch_json:
+            aplicar_patch(self._sombras[session_id], json.loads(patch_json))
+            meta["deltas"] += 1
+            meta["bytes_deltas"] += len(patch_json)
+        meta["title"], meta["style"] = title, style_name
+        self._stats["delta_saves"] += 1
+        self._stats["bytes_written"] += len(patch_json)
+        return meta["deltas"] >= SAVE_COMPACT_EVERY or meta["bytes_deltas"] > meta["bytes_base"] * SAVE_COMPACT_RATIO
+
+    async def _compactar(self, session_id: str):
+        meta = self._meta[session_id]
+        # La sombra es una copia privada (y el lock de la sesión está tomado): se serializa fuera del loop
+        checksums, escritas, tamano = await run_db(
+            self._escribir_compactacion, meta["id"], self._sombras[session_id], meta["checksums"]
+        )
+        logger.info(
+            f"🗜️ Campaña {session_id}: {meta['deltas']} deltas compactados "
+            f"({escritas} secciones reescritas)"
+        )
+        meta.update({"deltas": 0, "bytes_deltas": 0, "bytes_base": tamano, "checksums": checksums})
+        self._stats["compactions"] += 1
+        self._stats["sections_written"] += escritas
+
+    @staticmethod
+    def _escribir_base(session_id: str, title: str, style_name: str,
+                       secciones_json: Dict[str, str]) -> Tuple[int, Dict[str, int]]:
+        with get_session() as db:
+            campaign = db.exec(select(Campaign).where(Campaign.session_id == session_id)).first()
+            if campaign:
+                campaign.title = title
+                campaign.style = style_name
+                campaign.data_json = "{}"
+                campaign.updated_at = datetime.utcnow()
+                # La base nueva reemplaza a cualquier delta anterior
+                db.exec(delete(CampaignDelta).where(CampaignDelta.campaign_id == campaign.id))
+            else:
+                campaign = Campaign(session_id=session_id, title=title, style=style_name)
+            db.add(campaign)
+            db.flush()
+            checksums = _escribir_secciones(db, campaign.id, secciones_json, {})
+            db.commit()
+            return campaign.id, checksums
+
+    @staticmethod
+    def _escribir_deltas(lote: List[Tuple[int, str, str, str]]):
+        """Escribe varios (campaign_id, patch_json, title, style) en una sola transacción."""
+        with get_session() as db:
+            ahora = datetime.utcnow()
+            for campaign_id, patch_json, title, style_name in lote:
+                if patch_json:
+                    db.add(CampaignDelta(campaign_id=campaign_id, patch_json=patch_json))
+                # La fila de la campaña ya no lleva la partida: actualizarla es barato
+                campaign = db.get(Campaign, campaign_id)
+                if campaign:
+                    campaign.title = title
+                    campaign.style = style_name
+                    campaign.updated_at = ahora
+                    db.add(campaign)
+            db.commit()
+
+    @staticmethod
+    def _escribir_compactacion(campaign_id: int, data: Dict[str, Any],
+                               checksums: Dict[str, int]) -> Tuple[Dict[str, int], int, int]:
+        secciones_json = _serializar_secciones(data)
+        with get_session() as db:
+            antes = dict(checksums)
+            nuevos = _escribir_secciones(db, campaign_id, secciones_json, checksums)
+            db.exec(delete(CampaignDelta).where(CampaignDelta.campaign_id == campaign_id))
+            db.commit()
+        escritas = sum(1 for k, crc in nuevos.items() if antes.get(k) != crc)
+        return nuevos, escritas, sum(len(v) for v in secciones_json.values())
+
+    @staticmethod
+    def _reconstruir(db, campaign: Campaign) -> Tuple[Dict[str, Any], Dict[str, int], bool, List[str]]:
+        """Estado completo (secciones o data_json legacy) + deltas. Migra las legacy al vuelo."""
+        migrada = False
+        filas = db.exec(select(CampaignSection).where(CampaignSection.campaign_id == campaign.id)).all()
+        if not filas and campaign.data_json not in ("", "{}"):
+            data = json.loads(campaign.data_json)
+            checksums = _escribir_secciones(db, campaign.id, _serializar_secciones(data), {})
+            campaign.data_json = "{}"
+            db.add(campaign)
+            migrada = True
+        else:
+            data = unir_secciones({f.key: _leer_fila_seccion(f) for f in filas})
+            checksums = {f.key: f.checksum for f in filas}
+
+        patches = db.exec(
+            select(CampaignDelta.patch_json)
+            .where(CampaignDelta.campaign_id == campaign.id)
+            .order_by(CampaignDelta.id)
+        ).all()
+        for patch_json in patches:
+            aplicar_patch(data, json.loads(patch_json))
+        return data, checksums, migrada, list(patches)
+
+    @classmethod
+    def _leer(cls, session_id: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        with get_session() as db:
+            campaign = db.exec(select(Campaign).where(Campaign.session_id == session_id)).first()
+            if not campaign:
+                return None
+            data, checksums, migrada, patches = cls._reconstruir(db, campaign)
+            meta = {
+                "id": campaign.id, "title": campaign.title, "style": campaign.style,
+                "deltas": len(patches), "bytes_deltas": sum(len(p) for p in patches),
+                "bytes_base": sum(f for f in db.exec(
+                    select(CampaignSection.raw_size).where(CampaignSection.campaign_id == campaign.id)
+                ).all()),
+                "checksums": checksums, "migrada": migrada,
+            }
+            if migrada:
+                db.commit()
+            return data, meta
+
+    @classmethod
+    def _leer_secciones_db(cls, campaign_id: int, claves: List[str]) -> Optional[Dict[str, Any]]:
+        with get_session() as db:
+            campaign = db.get(Campaign, campaign_id)
+            if not campaign:
+                return None
+            pendientes = db.exec(
+                select(func.count(CampaignDelta.id)).where(CampaignDelta.campaign_id == campaign_id)
+            ).one()
+            if pendientes or campaign.data_json not in ("", "{}"):
+                # Deltas sin compactar (o partida legacy): reconstruir en memoria sin
+                # escribir nada; compactar y migrar es cosa del guardado y de cargar()
+                data, _, _, _ = cls._reconstruir(db, campaign)
+                db.rollback()
+                secciones = dividir_en_secciones(data)
+                return {k: secciones[k] for k in claves if k in secciones}
+
+            filas = db.exec(
+                select(CampaignSection).where(
+                    CampaignSection.campaign_id == campaign_id,
+                    CampaignSection.key.in_(claves),
+                )
+            ).all()
+            return {f.key: _leer_fila_seccion(f) for f in filas}
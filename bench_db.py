@@ -0,0 +1,104 @@
+"""
+Benchmark: guardados concurrentes en SQLite y lag del event loop.
+
+Compara sobre bases temporales:
+  1. engine por defecto (journal DELETE, synchronous=FULL) con el trabajo de
+     DB ejecutado directamente dentro de las corrutinas
+  2. engine de app.database (WAL, synchronous=NORMAL, mmap) vía run_db
+
+Uso:
+    python bench_db.py [concurrencia] [guardados_por_tarea] [kb_por_partida]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+
+CONCURRENCIA = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+GUARDADOS = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+KB = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+TICK = 0.01
+
+
+def guardar(engine, sid: str, blob: str):
+    """Upsert de una campaña, igual que /save"""
+    from datetime import datetime
+    from sqlmodel import Session, select
+    from app.db_models import Campaign
+
+    with Session(engine) as db:
+        existing = db.exec(select(Campaign).where(Campaign.session_id == sid)).first()
+        if existing:
+            existing.data_json = blob
+            existing.updated_at = datetime.utcnow()
+            db.add(existing)
+        else:
+            db.add(Campaign(session_id=sid, title="Bench", data_json=blob))
+        db.commit()
+
+
+async def medir_lag(stop: asyncio.Event, muestras: list):
+    """Duerme TICK segundos en bucle y registra cuánto se retrasa cada despertar."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        esperado = loop.time() + TICK
+        await asyncio.sleep(TICK)
+        muestras.append(max(0.0, loop.time() - esperado))
+
+
+async def escenario(nombre: str, factory):
+    stop = asyncio.Event()
+    muestras: list = []
+    monitor = asyncio.create_task(medir_lag(stop, muestras))
+    await asyncio.sleep(0.05)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(factory(i) for i in range(CONCURRENCIA)))
+    total = time.perf_counter() - inicio
+
+    stop.set()
+    await monitor
+
+    muestras.sort()
+    p95 = muestras[int(len(muestras) * 0.95) - 1] if muestras else 0.0
+    guardados = CONCURRENCIA * GUARDADOS
+    print(
+        f"{nombre:<24} {guardados / total:8.0f} guardados/s  total={total:6.2f}s  "
+        f"lag_max={max(muestras, default=0) * 1000:8.1f}ms  lag_p95={p95 * 1000:8.1f}ms"
+    )
+
+
+async def main(tmp: str):
+    from sqlmodel import SQLModel, create_engine
+    from app.database import engine, run_db, cerrar_db
+    import app.db_models  # noqa: F401  (registra las tablas en la metadata)
+
+    blob = json.dumps({"adventure": {"historia": {"narrativa": "x" * (KB * 1024)}}})
+
+    plano = create_engine(f"sqlite:///{os.path.join(tmp, 'plano.db')}")
+    for e in (plano, engine):
+        SQLModel.metadata.create_all(e)
+
+    async def en_el_loop(i: int):
+        for n in range(GUARDADOS):
+            guardar(plano, f"s{i}", blob)
+            await asyncio.sleep(0)
+
+    async def con_run_db(i: int):
+        for n in range(GUARDADOS):
+            await run_db(guardar, engine, f"s{i}", blob)
+
+    print(f"Concurrencia={CONCURRENCIA}  guardados por tarea={GUARDADOS}  partida={KB}KB")
+    await escenario("por defecto, en el loop", en_el_loop)
+    await escenario("WAL + run_db", con_run_db)
+    plano.dispose()
+    cerrar_db()
+
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'tuned.db')}"
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    asyncio.run(main(tmp))
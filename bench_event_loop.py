@@ -0,0 +1,106 @@
+"""
+Benchmark: lag del event loop durante generaciones concurrentes de IA.
+
+Levanta un Ollama falso (responde tras OLLAMA_FAKE_DELAY segundos) y compara:
+  1. requests bloqueante llamado desde corrutinas (el patrón anterior)
+  2. generar_con_ia_async (httpx + pool keep-alive)
+
+Uso:
+    python bench_event_loop.py [concurrencia] [delay_segundos]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONCURRENCIA = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+DELAY = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+TICK = 0.01
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        time.sleep(DELAY)
+        body = json.dumps({"response": json.dumps({"ok": True}), "done": True}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_ollama() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def medir_lag(stop: asyncio.Event, muestras: list):
+    """Duerme TICK segundos en bucle y registra cuánto se retrasa cada despertar."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        esperado = loop.time() + TICK
+        await asyncio.sleep(TICK)
+        muestras.append(max(0.0, loop.time() - esperado))
+
+
+async def escenario(nombre: str, factory):
+    stop = asyncio.Event()
+    muestras: list = []
+    monitor = asyncio.create_task(medir_lag(stop, muestras))
+    await asyncio.sleep(0.05)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(factory(i) for i in range(CONCURRENCIA)))
+    total = time.perf_counter() - inicio
+
+    stop.set()
+    await monitor
+
+    muestras.sort()
+    p95 = muestras[int(len(muestras) * 0.95) - 1] if muestras else 0.0
+    print(
+        f"{nombre:<28} total={total:6.2f}s  "
+        f"lag_max={max(muestras, default=0) * 1000:8.1f}ms  "
+        f"lag_p95={p95 * 1000:8.1f}ms  ticks={len(muestras)}"
+    )
+
+
+async def main():
+    from app.components.ai import client
+
+    async def bloqueante(i: int):
+        # Patrón antiguo: llamada síncrona directamente dentro de una corrutina
+        requests.post(os.environ["OLLAMA_URL"], json={"prompt": f"bench {i}", "stream": False}, timeout=60)
+
+    async def asincrono(i: int):
+        await client.generar_con_ia_async(f"bench {i}", use_cache=False)
+
+    # Crear el pool antes de medir (el contexto SSL de httpx tarda ~200ms en construirse)
+    client._get_async_client()
+
+    print(f"Concurrencia={CONCURRENCIA}  delay Ollama={DELAY}s  "
+          f"OLLAMA_MAX_CONCURRENCY={client.llm_scheduler.max_concurrency}")
+    await escenario("requests (bloqueante)", bloqueante)
+    await escenario("httpx async (pool)", asincrono)
+    await client.cerrar_cliente_async()
+
+
+if __name__ == "__main__":
+    server = start_fake_ollama()
+    os.environ["OLLAMA_URL"] = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+    os.environ.setdefault("OLLAMA_MAX_CONCURRENCY", str(CONCURRENCIA))
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        asyncio.run(main())
+    finally:
+        server.shutdown()
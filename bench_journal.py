@@ -0,0 +1,63 @@
+"""
+Benchmark: eventos/segundo de JournalSystem.register_event.
+
+Compara sobre una base SQLite temporal:
+  1. escritura inmediata (una sesión + SELECT de campaña + COMMIT por evento)
+  2. escritura diferida (lotes de JOURNAL_FLUSH_BATCH en una transacción)
+
+Uso:
+    python bench_journal.py [eventos]
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+EVENTOS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+async def main():
+    from sqlmodel import select, func
+    from app.database import init_db, get_session
+    from app.db_models import Campaign, JournalEntryDB
+    from app.systems.journal import JournalSystem
+
+    init_db()
+    with get_session() as db:
+        db.add(Campaign(session_id="bench", title="Bench", style="bench", data_json="{}"))
+        db.commit()
+
+    # 1. Inmediata: sin escritor activo cada evento se persiste en el acto
+    inmediato = JournalSystem()
+    inicio = time.perf_counter()
+    for i in range(EVENTOS):
+        await inmediato.register_event("bench", "dice_roll", f"Tirada {i}")
+    t_inmediato = time.perf_counter() - inicio
+
+    # 2. Diferida: el escritor agrupa los eventos en lotes
+    diferido = JournalSystem()
+    diferido.iniciar()
+    inicio = time.perf_counter()
+    for i in range(EVENTOS):
+        await diferido.register_event("bench", "dice_roll", f"Tirada {i}")
+        if i % 50 == 0:
+            await asyncio.sleep(0)  # como entre peticiones reales
+    t_encolado = time.perf_counter() - inicio
+    await diferido.detener()
+    t_diferido = time.perf_counter() - inicio
+
+    with get_session() as db:
+        filas = db.exec(select(func.count(JournalEntryDB.id))).one()
+
+    print(f"Eventos={EVENTOS}  filas en DB={filas}")
+    print(f"{'inmediata':<12} {EVENTOS / t_inmediato:10.0f} ev/s  ({t_inmediato:.2f}s)")
+    print(f"{'diferida':<12} {EVENTOS / t_diferido:10.0f} ev/s  ({t_diferido:.2f}s, "
+          f"encolado {t_encolado * 1000:.0f}ms, flushes={diferido.stats()['flushes']})")
+
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+"""
+Configuración común de los tests.
+
+Antes de importar la app se apuntan la base de datos, la caché L2 de prompts
+y los logs a un directorio temporal, así los tests nunca tocan cronista.db
+ni logs/ del repositorio. El pool de aventuras y el autoguardado no se
+arrancan (los tests no levantan el servidor).
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_TMP = Path(tempfile.mkdtemp(prefix="cronista-tests-"))
+
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP / 'test.db'}"
+os.environ["AI_CACHE_DISK_PATH"] = str(_TMP / "ai_cache.db")
+os.environ.setdefault("LEGACY_IMPORT_WORKERS", "2")
+os.environ.setdefault("CONSOLE_LOG_LEVEL", "CRITICAL")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app.logger  # noqa: E402
+
+app.logger.LOG_DIR = _TMP / "logs"
+app.logger.LOG_DIR.mkdir(exist_ok=True)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def db():
+    """Crea el esquema (tablas, FTS5, triggers) una vez por corrida."""
+    from app.database import init_db
+    init_db()
+    yield
+
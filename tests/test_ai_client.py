@@ -0,0 +1,215 @@
+"""Caché de prompts (L1/L2), single-flight y prefijo compartido de generar_con_ia_async."""
+import asyncio
+import itertools
+import json
+
+import httpx
+import pytest
+
+from app.components.ai import client
+from app.components.ai.scheduler import LLMScheduler, ColaLLMLlena
+from app.components.dnd import generator
+
+
+def _respuestas_distintas(monkeypatch):
+    """Sustituye a Ollama por un contador: cada llamada devuelve un PJ distinto."""
+    contador = itertools.count(1)
+
+    async def falso_ollama(full_prompt, json_mode=False, timeout=None, on_chunk=None):
+        n = next(contador)
+        return json.dumps({"personajes": [{"nombre": f"PJ {n}", "raza": "Humano", "clase": "Guerrero"}]})
+
+    monkeypatch.setattr(client, "llamar_ollama_async", falso_ollama)
+    return contador
+
+
+def test_personajes_de_partida_nueva_no_se_cachean(monkeypatch):
+    _respuestas_distintas(monkeypatch)
+    en_disco = len(client._disk_cache)
+
+    primera = asyncio.run(generator._generar_personajes("Taberna en ruinas", 3))
+    segunda = asyncio.run(generator._generar_personajes("Taberna en ruinas", 3))
+
+    assert primera[0]["nombre"] != segunda[0]["nombre"]
+    assert len(client._disk_cache) == en_disco
+
+
+def test_prompt_cacheable_se_sirve_de_l1_y_l2(monkeypatch):
+    contador = _respuestas_distintas(monkeypatch)
+    prompt = "Describe: test de caché persistente"
+
+    primera = asyncio.run(client.generar_con_ia_async(prompt))
+    client._prompt_cache.clear()  # forzar la lectura desde disco
+    segunda = asyncio.run(client.generar_con_ia_async(prompt))
+
+    assert primera == segunda
+    assert next(contador) == 2  # Ollama se llamó una sola vez
+
+
+class _Generacion:
+    """
+    Sustituye a _generar_sin_cache: la primera llamada avisa con `en_curso`,
+    espera a `liberar` y luego hace `primera()` (por defecto devuelve "uno");
+    las demás responden "otra" al instante. Los eventos se crean dentro del
+    loop de cada escenario (preparar).
+    """
+
+    def __init__(self):
+        self.llamadas = []
+        self.primera = None
+
+    def preparar(self):
+        self.en_curso, self.liberar = asyncio.Event(), asyncio.Event()
+
+    async def falsa(self, task_prompt, json_mode, contexto, cache_key, timeout, on_chunk, conversacion=None):
+        self.llamadas.append(task_prompt)
+        if len(self.llamadas) == 1:
+            self.en_curso.set()
+            await self.liberar.wait()
+            return self.primera() if self.primera else "uno"
+        return "otra"
+
+    async def lanzar(self, prompt: str, seguidores: int):
+        """Lanza el primer llamador y, con su generación ya en vuelo, los que se le suman."""
+        self.preparar()
+        previos = client._cache_stats["coalesced"]
+        lider = asyncio.create_task(client.generar_con_ia_async(prompt, json_mode=False))
+        await self.en_curso.wait()
+        otros = [asyncio.create_task(client.generar_con_ia_async(prompt, json_mode=False)) for _ in range(seguidores)]
+        while client._cache_stats["coalesced"] < previos + seguidores:
+            await asyncio.sleep(0.005)
+        return lider, otros
+
+
+@pytest.fixture
+def generacion(monkeypatch) -> _Generacion:
+    g = _Generacion()
+    monkeypatch.setattr(client, "_generar_sin_cache", g.falsa)
+    return g
+
+
+def test_llamadas_identicas_comparten_una_generacion(generacion):
+    async def escenario():
+        lider, otros = await generacion.lanzar("coalescer", 4)
+        generacion.liberar.set()
+        return await asyncio.gather(lider, *otros)
+
+    assert asyncio.run(escenario()) == ["uno"] * 5
+    assert len(generacion.llamadas) == 1
+    assert not client._inflight
+
+
+def test_error_del_primero_llega_a_quien_espera(generacion):
+    def fallar():
+        raise RuntimeError("Ollama explotó")
+    generacion.primera = fallar
+
+    async def escenario():
+        lider, (seguidor,) = await generacion.lanzar("falla", 1)
+        generacion.liberar.set()
+        return await asyncio.gather(lider, seguidor, return_exceptions=True)
+
+    lider, seguidor = asyncio.run(escenario())
+    assert isinstance(lider, RuntimeError)
+    assert isinstance(seguidor, RuntimeError)
+    assert not client._inflight
+
+
+def test_cancelar_al_primero_hace_reintentar_a_quien_espera(generacion):
+    async def escenario():
+        lider, (seguidor,) = await generacion.lanzar("cancela", 1)
+        lider.cancel()
+        await asyncio.gather(lider, return_exceptions=True)
+        return await seguidor, lider
+
+    resultado, lider = asyncio.run(escenario())
+    assert lider.cancelled()
+    assert resultado == "otra"  # no None: el seguidor generó por su cuenta
+    assert len(generacion.llamadas) == 2
+
+
+def test_cancelar_a_quien_espera_no_afecta_al_primero(generacion):
+    async def escenario():
+        lider, (seguidor,) = await generacion.lanzar("seguidor", 1)
+        seguidor.cancel()
+        await asyncio.gather(seguidor, return_exceptions=True)
+        generacion.liberar.set()
+        return await lider, seguidor
+
+    resultado, seguidor = asyncio.run(escenario())
+    assert seguidor.cancelled()
+    assert resultado == "uno"
+    assert len(generacion.llamadas) == 1
+
+
+def _ollama_falso(monkeypatch, planificador):
+    """Ollama simulado con httpx.MockTransport detrás de un planificador propio."""
+    def responder(request):
+        return httpx.Response(200, json={"response": "respuesta", "done": True})
+
+    monkeypatch.setattr(client, "llm_scheduler", planificador)
+    monkeypatch.setattr(
+        client, "_get_async_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(responder))
+    )
+
+
+def test_version_sincrona_pasa_por_el_planificador(monkeypatch):
+    planificador = LLMScheduler(max_concurrency=1, max_queue=5)
+    _ollama_falso(monkeypatch, planificador)
+
+    assert client.generar_con_ia("sincrona", json_mode=False, use_cache=False) == "respuesta"
+    assert planificador.stats()["completed"] == 1
+
+
+def test_version_sincrona_no_se_usa_dentro_del_loop():
+    async def escenario():
+        client.generar_con_ia("dentro del loop", json_mode=False)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(escenario())
+
+
+def test_cola_llena_se_propaga(monkeypatch):
+    _ollama_falso(monkeypatch, LLMScheduler(max_concurrency=0, max_queue=0))
+
+    with pytest.raises(ColaLLMLlena):
+        asyncio.run(client.generar_con_ia_async("sin sitio", json_mode=False, use_cache=False))
+
+
+def test_prefijo_se_reintenta_si_la_primera_evaluacion_falla(monkeypatch):
+    respuestas = [httpx.ConnectError("Ollama caído"), ("OK", {}), ("OK", {"context": [1, 2, 3]})]
+
+    async def falso_llamar(full_prompt, json_mode=False, timeout=None, options=None, **kwargs):
+        respuesta = respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    monkeypatch.setattr(client, "_llamar_ollama", falso_llamar)
+    conversacion = client.ConversacionLLM("Prefijo de prueba")
+
+    async def escenario():
+        for _ in range(4):
+            await conversacion.preparar()
+
+    asyncio.run(escenario())
+    assert conversacion.context == [1, 2, 3]
+    assert not respuestas  # error y respuesta sin contexto no la dieron por preparada
+
+
+def test_prefijo_cancelado_no_queda_marcado_como_preparado(monkeypatch):
+    async def colgada(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(client, "_llamar_ollama", colgada)
+    conversacion = client.ConversacionLLM("Prefijo cancelado")
+
+    async def escenario():
+        tarea = asyncio.create_task(conversacion.preparar())
+        await asyncio.sleep(0.01)
+        tarea.cancel()
+        await asyncio.gather(tarea, return_exceptions=True)
+
+    asyncio.run(escenario())
+    assert conversacion.context is None
+    assert not conversacion._preparada
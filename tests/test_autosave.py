@@ -0,0 +1,39 @@
+"""Autoguardado: solo se copian a la sesión las claves externas (tablero, combate) que cambiaron."""
+import asyncio
+from types import SimpleNamespace
+
+from app.systems.autosave import AutosaveService
+from app.systems.saves import CampaignSaves, RegistroSesiones
+
+
+def _recargar(session_id: str) -> dict:
+    sesiones = RegistroSesiones()
+    asyncio.run(CampaignSaves(sesiones).cargar(session_id))
+    return dict(sesiones[session_id])
+
+
+def test_solo_se_capturan_las_claves_marcadas():
+    sid = "autosave-claves"
+    sesiones = RegistroSesiones()
+    sesiones[sid] = {"adventure": {"pjs": [], "historia": {"titulo": "El faro", "escenas": []}}}
+    vtt = SimpleNamespace(sessions={sid: {"tokens": []}})
+    combates = SimpleNamespace(active_combats={sid: {"round": 1}})
+    autosave = AutosaveService(CampaignSaves(sesiones), sesiones, vtt, combates)
+
+    vtt.sessions[sid]["tokens"].append({"id": "aria"})
+    autosave.marcar(sid, "vtt")
+    assert asyncio.run(autosave.flush()) == 1
+    assert sesiones[sid]["vtt"] == {"tokens": [{"id": "aria"}]}
+    assert "combat" not in sesiones[sid]  # el combate no avisó: no se toca
+
+    autosave.marcar(sid, "combat")
+    asyncio.run(autosave.flush())
+    assert _recargar(sid)["combat"] == {"round": 1}
+
+    combates.active_combats.clear()
+    autosave.marcar(sid, "combat")
+    asyncio.run(autosave.flush())
+    recargada = _recargar(sid)
+    assert "combat" not in recargada
+    assert recargada["vtt"] == {"tokens": [{"id": "aria"}]}
+    assert autosave.stats()["pending"] == 0
@@ -0,0 +1,48 @@
+"""Listado de campañas: paginación por keyset sobre (updated_at, id) y búsqueda por título."""
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app.database import get_session
+from app.db_models import Campaign
+from app.main import app
+
+
+def _crear(titulos_y_fechas) -> list:
+    with get_session() as db:
+        filas = [
+            Campaign(session_id=f"keyset-{titulo}", title=titulo, updated_at=fecha)
+            for titulo, fecha in titulos_y_fechas
+        ]
+        db.add_all(filas)
+        db.commit()
+        return [f.id for f in filas]
+
+
+def test_paginas_sin_huecos_ni_repetidas_aunque_empaten_en_fecha():
+    base = datetime(2026, 1, 1)
+    # Tres campañas comparten updated_at: el id desempata
+    ids = _crear([(f"Marca Norte {n}", base + timedelta(minutes=n // 3)) for n in range(7)])
+    esperado = sorted(ids, key=lambda i: (ids.index(i) // 3, i), reverse=True)
+
+    cliente = TestClient(app)
+    vistos, cursor = [], None
+    while True:
+        params = {"limit": 2, "q": "Marca Norte", **({"cursor": cursor} if cursor else {})}
+        pagina = cliente.get("/campaigns", params=params).json()
+        vistos += [c["id"] for c in pagina["campaigns"]]
+        cursor = pagina["next_cursor"]
+        if cursor is None:
+            break
+
+    assert vistos == esperado
+
+
+def test_busqueda_escapa_comodines_y_cursor_invalido_da_400():
+    _crear([("100% Dragones", datetime(2026, 2, 1)), ("100 Dragones", datetime(2026, 2, 2))])
+    cliente = TestClient(app)
+
+    titulos = [c["title"] for c in cliente.get("/campaigns", params={"q": "100%"}).json()["campaigns"]]
+
+    assert titulos == ["100% Dragones"]
+    assert cliente.get("/campaigns", params={"cursor": "no-es-un-cursor"}).status_code == 400
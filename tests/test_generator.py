@@ -0,0 +1,57 @@
+"""Cancelación de una generación de aventura en curso."""
+import asyncio
+
+from app.components.dnd import generator
+
+ESQUEMA = {
+    "titulo": "Prueba",
+    "sinopsis": "Sinopsis",
+    "plot_twist": "Giro",
+    "esquema_escenas": [{"id": i, "titulo": f"Escena {i}", "resumen": "..."} for i in range(1, 4)],
+}
+PJS = [{"nombre": "Aria", "raza": "Elfo", "clase": "Mago", "genero": "Femenino"}]
+
+
+def test_cancelar_generacion_paralela_cancela_escenas_e_imagenes(monkeypatch):
+    iniciadas, canceladas = [], []
+
+    async def colgada(etiqueta):
+        iniciadas.append(etiqueta)
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            canceladas.append(etiqueta)
+            raise
+
+    async def pjs(setting, nivel):
+        return PJS
+
+    async def esquema(*args):
+        return ESQUEMA
+
+    async def escena(esquema, resumen, nivel, numero, pjs, on_chunk=None, conversacion=None):
+        return await colgada(f"escena:{numero}")
+
+    async def retrato(prompt, session_id, pj_index=None):
+        return await colgada(f"retrato:{pj_index}")
+
+    monkeypatch.setattr(generator, "_generar_personajes", pjs)
+    monkeypatch.setattr(generator, "_generar_esquema_aventura", esquema)
+    monkeypatch.setattr(generator, "_expandir_escena", escena)
+    monkeypatch.setattr(generator.image_skill, "generate_portrait", retrato)
+
+    async def escenario():
+        tarea = asyncio.create_task(
+            generator.crear_datos_aventura("s-cancel", "Bosque", {"nombre": "Épico", "desc": ""}, modo="paralelo")
+        )
+        while len(iniciadas) < 4:
+            await asyncio.sleep(0.01)
+        tarea.cancel()
+        await asyncio.gather(tarea, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        # Antes de que asyncio.run cancele lo que quede vivo al cerrar el loop
+        return tarea, list(canceladas)
+
+    tarea, canceladas_al_volver = asyncio.run(escenario())
+    assert tarea.cancelled()
+    assert sorted(canceladas_al_volver) == sorted(iniciadas)
@@ -0,0 +1,65 @@
+"""Trabajos de generación: checkpoints, reanudación tras reinicio y cancelación."""
+import asyncio
+
+from app.systems.jobs import JobRegistry
+
+ESTILO = {"nombre": "Épico", "desc": ""}
+
+
+async def _esperar_estado(registro: JobRegistry, job_id: str, status: str):
+    while (await registro.estado(job_id))["status"] != status:
+        await asyncio.sleep(0.01)
+
+
+def test_trabajo_interrumpido_se_reanuda_desde_su_checkpoint():
+    recibidos = []
+
+    async def interrumpido(job_id, sid, setting, estilo, nivel, modo, checkpoint, on_checkpoint):
+        checkpoint["pjs"] = [{"nombre": "Aria"}]
+        await on_checkpoint(checkpoint, "personajes")
+        await asyncio.Event().wait()  # el servidor se apaga aquí
+
+    async def reanudado(job_id, sid, setting, estilo, nivel, modo, checkpoint, on_checkpoint):
+        recibidos.append(checkpoint)
+        return {"pjs": checkpoint["pjs"], "historia": {"escenas": [{}]}}
+
+    async def antes_del_reinicio():
+        registro = JobRegistry()
+        registro.runner = interrumpido
+        job_id = await registro.crear("s-jobs", "Bosque", ESTILO, 1, num_escenas=3)
+        while (await registro.estado(job_id))["stage"] != "personajes":
+            await asyncio.sleep(0.01)
+        await registro.detener()
+        return job_id, await registro.estado(job_id)
+
+    async def despues_del_reinicio(job_id):
+        registro = JobRegistry()
+        registro.runner = reanudado
+        assert await registro.reanudar_pendientes() >= 1
+        await _esperar_estado(registro, job_id, "done")
+        return await registro.estado(job_id)
+
+    job_id, interrumpido_estado = asyncio.run(antes_del_reinicio())
+    assert interrumpido_estado["status"] == "running"  # el apagado no lo marca: queda para reanudar
+
+    final = asyncio.run(despues_del_reinicio(job_id))
+    assert final["stage"] == "completada"
+    assert recibidos == [{"num_escenas": 3, "pjs": [{"nombre": "Aria"}]}]
+
+
+def test_cancelado_no_vuelve_a_cambiar_de_estado():
+    async def colgado(*args):
+        await asyncio.Event().wait()
+
+    async def escenario():
+        registro = JobRegistry()
+        registro.runner = colgado
+        job_id = await registro.crear("s-cancel-job", "Bosque", ESTILO, 1)
+        await _esperar_estado(registro, job_id, "running")
+
+        assert await registro.cancelar(job_id)
+        await registro._actualizar(job_id, status="done")  # escritura tardía de la tarea
+        assert not await registro.cancelar(job_id)
+        return await registro.estado(job_id)
+
+    assert asyncio.run(escenario())["status"] == "cancelled"
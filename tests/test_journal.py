@@ -0,0 +1,83 @@
+"""Journal con escritura diferida y memoria narrativa (índice BM25 acotado)."""
+import asyncio
+from datetime import datetime
+
+from app.components.ai import memory
+from app.components.ai.memory import IndiceBM25, buscar_eventos
+from app.state import journal
+from app.systems.journal import JournalSystem
+
+
+def test_flush_fallido_se_reintenta_sin_perder_ni_desordenar_eventos(monkeypatch):
+    sistema = JournalSystem()
+    escribir = sistema._escribir_lote
+    fallos = []
+
+    def falla_una_vez(lote):
+        if not fallos:
+            fallos.append(len(lote))
+            raise RuntimeError("database is locked")
+        escribir(lote)
+
+    monkeypatch.setattr(sistema, "_escribir_lote", falla_una_vez)
+
+    async def escenario():
+        await sistema.register_event("s-reintento", "nota", "Primero")
+        assert sistema.stats()["pending"] == 1
+        await sistema.register_event("s-reintento", "nota", "Segundo")
+        return sistema.historial("s-reintento")
+
+    pagina = asyncio.run(escenario())
+    assert [e["description"] for e in pagina["events"]] == ["Primero", "Segundo"]
+    assert sistema.stats()["failed_flushes"] == 1
+    assert sistema.stats()["pending"] == 0
+
+
+def test_sesion_retomada_se_carga_de_la_db_con_timestamps_utc():
+    async def registrar():
+        sistema = JournalSystem()
+        sistema.iniciar()
+        for i in range(5):
+            await sistema.register_event("s-retomada", "nota", f"Evento {i}")
+        entrada = sistema.get_log("s-retomada")[-1]
+        await sistema.detener()
+        return entrada
+
+    async def retomar():
+        sistema = JournalSystem()
+        await sistema.preparar("s-retomada")
+        return sistema, sistema.get_log("s-retomada"), await sistema.eventos("s-retomada", 0, 2)
+
+    antes = datetime.utcnow()
+    entrada = asyncio.run(registrar())
+    sistema, log, primeros = asyncio.run(retomar())
+
+    assert sistema.total("s-retomada") == 5
+    assert log[-1]["timestamp"] == entrada["timestamp"]  # memoria y DB en UTC
+    assert datetime.fromisoformat(entrada["timestamp"]) >= antes
+    assert [e["description"] for e in primeros] == ["Evento 0", "Evento 1"]
+
+
+def test_indice_bm25_descarta_los_documentos_mas_antiguos():
+    indice = IndiceBM25(capacidad=3)
+    for texto in ["dragón rojo", "taberna oscura", "goblins emboscada", "dragón dorado", "puente roto"]:
+        indice.agregar({"description": texto})
+
+    assert len(indice) == 3
+    assert (indice.inicio, indice.fin) == (2, 5)
+    assert set(indice.docs) == {2, 3, 4}
+    assert "taberna" not in indice.postings
+    assert list(indice.postings["dragon"]) == [3]
+    assert indice.total_len == sum(indice.doc_len.values())
+
+
+def test_busqueda_sobre_la_ventana_reciente_del_journal(monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_INDEX_EVENTS", 3)
+
+    async def escenario():
+        for texto in ["El dragón quemó la aldea", "Compraron cuerdas", "Cruzaron el río", "Otro dragón apareció"]:
+            await journal.register_event("s-bm25", "nota", texto)
+        return await buscar_eventos("s-bm25", "dragón", top_k=5)
+
+    resultados = asyncio.run(escenario())
+    assert [r["description"] for r in resultados] == ["Otro dragón apareció"]
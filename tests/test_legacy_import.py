@@ -0,0 +1,77 @@
+"""Importación de partidas JSON legacy: por lotes, tolerante a errores y reanudable."""
+import asyncio
+import json
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+
+from app.database import get_session
+from app.db_models import Campaign
+from app.systems import legacy_import
+from app.systems.legacy_import import ImportadorLegacy
+
+
+def _partidas(directorio, prefijo: str, n: int) -> list:
+    session_ids = [f"{prefijo}-{i}" for i in range(n)]
+    for sid in session_ids:
+        partida = {"adventure": {"historia": {"titulo": f"Título {sid}"}, "estilo": {"nombre": "Grimdark"}}}
+        (directorio / f"partida_{sid}.json").write_text(json.dumps(partida), encoding="utf-8")
+    return session_ids
+
+
+@pytest.fixture(autouse=True)
+def _logs_de_los_procesos_en_tmp(tmp_path, monkeypatch):
+    # Los procesos del pool (spawn) no heredan el LOG_DIR de conftest: escriben en ./logs
+    monkeypatch.chdir(tmp_path)
+
+
+def _importar(directorio) -> dict:
+    async def escenario():
+        importador = ImportadorLegacy(str(directorio))
+        assert importador.iniciar("test")
+        await importador._tarea
+        return importador.estado()
+    return asyncio.run(escenario())
+
+
+def _titulos(session_ids) -> dict:
+    with get_session() as db:
+        filas = db.exec(select(Campaign.session_id, Campaign.title).where(Campaign.session_id.in_(session_ids))).all()
+    return dict(filas)
+
+
+def test_importa_por_lotes_y_al_relanzar_retoma(tmp_path, monkeypatch):
+    monkeypatch.setattr(legacy_import, "LEGACY_IMPORT_BATCH", 2)
+    session_ids = _partidas(tmp_path, "legacy", 3)
+    (tmp_path / "partida_rota.json").write_text("{no es json", encoding="utf-8")
+
+    primera = _importar(tmp_path)
+    assert (primera["state"], primera["imported"], primera["failed"], primera["done"]) == ("done", 3, 1, 4)
+    assert primera["errors"][0]["file"] == "partida_rota.json"
+    assert _titulos(session_ids) == {sid: f"Título {sid}" for sid in session_ids}
+
+    segunda = _importar(tmp_path)
+    assert (segunda["imported"], segunda["skipped"], segunda["failed"]) == (0, 3, 1)
+
+
+def test_lote_con_conflicto_no_detiene_la_importacion(tmp_path, monkeypatch):
+    monkeypatch.setattr(legacy_import, "LEGACY_IMPORT_BATCH", 2)
+    session_ids = _partidas(tmp_path, "conflicto", 4)
+    insertar = legacy_import._insertar_lote
+    llamadas = []
+
+    def primer_lote_en_conflicto(partidas):
+        llamadas.append(partidas)
+        if len(llamadas) == 1:
+            raise IntegrityError("INSERT INTO campaigns", {}, Exception("UNIQUE constraint failed"))
+        return insertar(partidas)
+
+    monkeypatch.setattr(legacy_import, "_insertar_lote", primer_lote_en_conflicto)
+    estado = _importar(tmp_path)
+    assert (estado["state"], estado["imported"], estado["failed"]) == ("done", 2, 2)
+    assert set(_titulos(session_ids)) == set(session_ids[2:])
+
+    monkeypatch.setattr(legacy_import, "_insertar_lote", insertar)
+    assert _importar(tmp_path)["imported"] == 2
+    assert set(_titulos(session_ids)) == set(session_ids)
@@ -0,0 +1,78 @@
+"""Biblioteca: caché con ETag e invalidación, índice FTS por triggers e importación/exportación NDJSON."""
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.components.dnd import library
+from app.main import app
+
+
+@pytest.fixture
+def cliente() -> TestClient:
+    # Sin `with`: no se disparan los eventos de arranque (pool, autoguardado...)
+    return TestClient(app)
+
+
+def test_if_none_match_compara_etags_exactos(cliente):
+    etag = cliente.get("/library/npcs").headers["etag"]
+
+    for cabecera in (etag, f"W/{etag}", f'"otro", {etag}', "*"):
+        assert cliente.get("/library/npcs", headers={"If-None-Match": cabecera}).status_code == 304, cabecera
+
+    # Antes bastaba con contener el ETag como subcadena
+    for cabecera in (f"{etag}x", f"x{etag}", '"otro"'):
+        assert cliente.get("/library/npcs", headers={"If-None-Match": cabecera}).status_code == 200, cabecera
+
+
+def test_crear_invalida_la_respuesta_cacheada(cliente):
+    etag = cliente.get("/library/npcs").headers["etag"]
+
+    cliente.post("/library/npcs", json={"name": "Velka la Cartógrafa", "description": "Vende mapas falsos"})
+    respuesta = cliente.get("/library/npcs", headers={"If-None-Match": etag})
+
+    assert respuesta.status_code == 200
+    assert respuesta.headers["etag"] != etag
+    assert "Velka la Cartógrafa" in [n["name"] for n in respuesta.json()]
+
+
+def test_exportar_e_importar_ndjson_ida_y_vuelta(cliente):
+    nombres = [f"Guardia del Puente {n}" for n in range(3)]
+    for nombre in nombres:
+        cliente.post("/library/npcs", json={"name": nombre, "stats": {"fue": 14}, "tags": ["puente", "ciudad"]})
+
+    exportadas = [json.loads(l) for l in cliente.get("/library/export", params={"type": "npcs"}).text.splitlines()]
+    nuestras = [r for r in exportadas if r["name"] in nombres]
+    assert len(nuestras) == 3
+    assert all(r["type"] == "npcs" and r["stats"] == {"fue": 14} and "id" not in r for r in nuestras)
+
+    for registro in nuestras:
+        registro["description"] = "Cobra peaje"
+    cuerpo = "\n".join(json.dumps(r) for r in nuestras) + '\n{"type": "npcs"}\nno es json\n'
+    resumen = cliente.post("/library/import", content=cuerpo).json()
+
+    assert (resumen["created"], resumen["updated"], resumen["rejected"]) == (0, 3, 2)
+    assert [e["line"] for e in resumen["errors"]] == [4, 5]
+    importadas = {n.name: n for n in library.listar_npcs(tag="puente")}
+    assert set(importadas) == set(nombres)
+    assert all(n.description == "Cobra peaje" and json.loads(n.stats_json) == {"fue": 14} for n in importadas.values())
+
+
+def _encontrados(q: str, content_type=None) -> set:
+    return {(r["type"], r["id"]) for r in library.buscar_texto(q, content_type=content_type)}
+
+
+def test_triggers_fts_siguen_altas_cambios_y_bajas():
+    npc = library.crear_npc({"name": "Oswin", "personality": "Desconfía de los dracónidos"})
+    enemigo = library.crear_enemy({"name": "Sierpe", "abilities": [{"nombre": "Aliento", "efecto": "Escarcha quebradiza"}]})
+
+    assert ("npcs", npc.id) in _encontrados("draconidos")  # sin tilde: remove_diacritics
+    assert ("enemies", enemigo.id) in _encontrados("quebrad")  # texto dentro del JSON, por prefijo
+    assert not _encontrados("quebradiza", content_type="npcs")
+
+    library.actualizar_npc(npc.id, {"personality": "Colecciona relojes"})
+    assert ("npcs", npc.id) not in _encontrados("draconidos")
+    assert ("npcs", npc.id) in _encontrados("relojes")
+
+    library.eliminar_npc(npc.id)
+    assert ("npcs", npc.id) not in _encontrados("relojes")
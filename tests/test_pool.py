@@ -0,0 +1,83 @@
+"""Pool de aventuras: relleno hasta el tamaño, servicio en orden, sin datos de emergencia y con backoff."""
+import asyncio
+
+from sqlmodel import select, func
+
+from app.components.dnd import generator
+from app.components.story import narrator
+from app.database import get_session
+from app.db_models import PooledAdventure
+from app.systems import pool as pool_mod
+from app.systems.pool import AdventurePool
+
+
+def _ollama_caido(monkeypatch):
+    async def sin_respuesta(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(generator, "generar_con_ia_async", sin_respuesta)
+    monkeypatch.setattr(narrator, "generar_con_ia_async", sin_respuesta)
+
+
+def _en_stock() -> int:
+    with get_session() as db:
+        return db.exec(select(func.count(PooledAdventure.id))).one()
+
+
+def test_generacion_con_ollama_caido_se_marca_como_emergencia(monkeypatch):
+    _ollama_caido(monkeypatch)
+
+    data = asyncio.run(generator.crear_datos_aventura(
+        "s-emergencia", "Puerto brumoso", {"nombre": "Épico", "desc": ""}, imagenes=False
+    ))
+
+    assert data["emergencia"] is True
+    assert data["historia"]["escenas"]  # la mesa sigue teniendo algo que jugar
+
+
+def test_pool_no_guarda_aventuras_de_emergencia(monkeypatch):
+    _ollama_caido(monkeypatch)
+    pool = AdventurePool(size=1, niveles=[1])
+    antes = _en_stock()
+
+    assert asyncio.run(pool._rellenar(pool.cubos()[0][0], 1)) is False
+    assert _en_stock() == antes
+    assert asyncio.run(pool.stats())["failed"] == 1
+
+
+def test_backoff_crece_con_los_fallos_y_tiene_tope(monkeypatch):
+    monkeypatch.setattr(pool_mod, "POOL_IDLE_CHECK", 30)
+    monkeypatch.setattr(pool_mod, "POOL_BACKOFF_MAX", 200)
+    pool = AdventurePool(size=1, niveles=[1])
+
+    esperas = []
+    for fallos in range(4):
+        pool._fallos_seguidos = fallos
+        esperas.append(pool._espera())
+
+    assert esperas == [30, 60, 120, 200]
+
+
+def test_rellenar_hasta_el_tamano_y_servir_la_mas_antigua(monkeypatch):
+    titulos = iter(["Primera", "Segunda"])
+
+    async def aventura_falsa(session_id, setting, estilo, nivel=1, imagenes=True, **kwargs):
+        return {"historia": {"titulo": next(titulos), "escenas": [{"id": 1}]}, "nivel": nivel}
+
+    monkeypatch.setattr(generator, "crear_datos_aventura", aventura_falsa)
+    pool = AdventurePool(size=2, niveles=[7])
+    cubo = pool.cubos()[0]
+
+    async def escenario():
+        for _ in range(2):
+            assert await pool._rellenar(*cubo)
+        lleno = await pool._cubo_mas_vacio() != cubo
+        servidas = [await pool.tomar(*cubo) for _ in range(3)]
+        return lleno, servidas, await pool.stats()
+
+    lleno, servidas, stats = asyncio.run(escenario())
+    assert lleno  # con el cubo al tope, el siguiente relleno va a otro
+    assert [s["data"]["historia"]["titulo"] for s in servidas[:2]] == ["Primera", "Segunda"]
+    assert servidas[2] is None
+    assert (stats["generated"], stats["served"], stats["misses"]) == (2, 2, 1)
+    assert asyncio.run(pool.tomar(cubo[0], 99)) is None  # nivel sin cubo
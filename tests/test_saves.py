@@ -0,0 +1,119 @@
+"""Guardado incremental: secciones base + deltas JSON-Patch y su reconstrucción."""
+import asyncio
+import json
+
+from sqlmodel import select
+
+from app.database import get_session
+from app.db_models import CampaignDelta
+from app.systems import saves as saves_mod
+from app.systems.saves import CampaignSaves, RegistroSesiones
+
+
+def _aventura(n_escenas: int) -> dict:
+    return {
+        "adventure": {
+            "pjs": [{"nombre": "Aria", "hp": 10}],
+            "historia": {
+                "titulo": "La cripta",
+                "escenas": [{"id": i, "nombre": f"Escena {i}", "narrativa": "..."} for i in range(1, n_escenas + 1)],
+            },
+            "estilo": {"nombre": "Épico"},
+        },
+        "vtt": {"tokens": []},
+    }
+
+
+def _recargar(session_id: str) -> dict:
+    sesiones = RegistroSesiones()
+    asyncio.run(CampaignSaves(sesiones).cargar(session_id))
+    return dict(sesiones[session_id])
+
+
+def _patches(campaign_id: int) -> list:
+    with get_session() as db:
+        filas = db.exec(
+            select(CampaignDelta.patch_json).where(CampaignDelta.campaign_id == campaign_id).order_by(CampaignDelta.id)
+        ).all()
+    return [json.loads(p) for p in filas]
+
+
+def test_edicion_anidada_marcada_por_seccion_sobrevive_guardar_y_cargar():
+    sesiones = RegistroSesiones()
+    saves = CampaignSaves(sesiones)
+    sesiones["s-seccion"] = _aventura(3)
+    estado = sesiones["s-seccion"]
+
+    async def escenario():
+        campaign_id = await saves.guardar("s-seccion", "La cripta", "Épico")
+        estado["adventure"]["historia"]["escenas"][1]["narrativa"] = "Una puerta sellada con runas."
+        estado.marcar("escena:1")
+        await saves.guardar("s-seccion", "La cripta", "Épico")
+        return campaign_id
+
+    campaign_id = asyncio.run(escenario())
+    (ops,) = _patches(campaign_id)
+    assert ops == [{"op": "replace", "path": "/adventure/historia/escenas/1/narrativa",
+                    "value": "Una puerta sellada con runas."}]
+    assert _recargar("s-seccion") == dict(estado)
+
+
+def test_escena_insertada_en_medio_se_reconstruye_en_orden():
+    sesiones = RegistroSesiones()
+    saves = CampaignSaves(sesiones)
+    sesiones["s-insertar"] = _aventura(2)
+    estado = sesiones["s-insertar"]
+
+    async def escenario():
+        await saves.guardar("s-insertar", "La cripta", "Épico")
+        escenas = estado["adventure"]["historia"]["escenas"]
+        escenas.insert(1, {"id": 9, "nombre": "Atajo", "narrativa": "Un pasadizo."})
+        estado["adventure"]["pjs"][0]["hp"] = 4
+        estado.marcar("historia", "pjs", *(f"escena:{i}" for i in range(1, len(escenas))))
+        await saves.guardar("s-insertar", "La cripta", "Épico")
+
+    asyncio.run(escenario())
+    assert _recargar("s-insertar") == dict(estado)
+
+
+def test_compactacion_conserva_el_estado(monkeypatch):
+    monkeypatch.setattr(saves_mod, "SAVE_COMPACT_EVERY", 2)
+    sesiones = RegistroSesiones()
+    saves = CampaignSaves(sesiones)
+    sesiones["s-compactar"] = _aventura(2)
+    estado = sesiones["s-compactar"]
+
+    async def escenario():
+        campaign_id = await saves.guardar("s-compactar", "La cripta", "Épico")
+        for hp in (8, 6):
+            estado["adventure"]["pjs"][0]["hp"] = hp
+            estado.marcar("pjs")
+            await saves.guardar("s-compactar", "La cripta", "Épico")
+        estado["vtt"] = {"tokens": [{"id": "pj_0"}]}
+        await saves.guardar("s-compactar", "La cripta", "Épico")
+        return campaign_id
+
+    campaign_id = asyncio.run(escenario())
+    assert saves.stats()["compactions"] == 1
+    assert len(_patches(campaign_id)) == 1  # el guardado posterior a la compactación
+    assert _recargar("s-compactar") == dict(estado)
+
+
+def test_leer_secciones_con_deltas_pendientes_no_escribe():
+    sesiones = RegistroSesiones()
+    saves = CampaignSaves(sesiones)
+    sesiones["s-leer"] = _aventura(2)
+    estado = sesiones["s-leer"]
+
+    async def escenario():
+        campaign_id = await saves.guardar("s-leer", "La cripta", "Épico")
+        estado["adventure"]["historia"]["escenas"][1]["narrativa"] = "El eco responde."
+        estado.marcar("escena:1")
+        await saves.guardar("s-leer", "La cripta", "Épico")
+        # Otro proceso sin la partida en memoria: lee de la DB
+        return campaign_id, await CampaignSaves(RegistroSesiones()).leer_secciones(campaign_id, ["escena:1", "pjs"])
+
+    campaign_id, secciones = asyncio.run(escenario())
+    assert secciones["escena:1"]["narrativa"] == "El eco responde."
+    assert secciones["pjs"] == [{"nombre": "Aria", "hp": 10}]
+    assert len(_patches(campaign_id)) == 1  # leer no compacta
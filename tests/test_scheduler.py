@@ -0,0 +1,104 @@
+"""Planificador LLM: orden por prioridad, cola acotada y cancelación de quien espera."""
+import asyncio
+
+import pytest
+
+from app.components.ai.scheduler import (
+    LLMScheduler, ColaLLMLlena,
+    PRIORIDAD_INTERACTIVA, PRIORIDAD_GENERACION, PRIORIDAD_PREFETCH,
+)
+
+
+async def _ocupar(planificador: LLMScheduler, orden: list, nombre: str, prioridad: int, liberar: asyncio.Event):
+    async with planificador.slot(prioridad):
+        orden.append(nombre)
+        await liberar.wait()
+
+
+def _vacio(stats) -> bool:
+    return stats["running"] == 0 and stats["queue_depth"] == 0
+
+
+async def _hasta_encolar(planificador: LLMScheduler, profundidad: int):
+    while planificador.queue_depth() < profundidad:
+        await asyncio.sleep(0)
+
+
+def test_se_atiende_por_prioridad_y_luego_por_llegada():
+    async def escenario():
+        planificador = LLMScheduler(max_concurrency=1, max_queue=10)
+        orden: list = []
+        liberar, ya = asyncio.Event(), asyncio.Event()
+        ya.set()
+
+        ocupante = asyncio.create_task(_ocupar(planificador, orden, "ocupante", PRIORIDAD_GENERACION, liberar))
+        await asyncio.sleep(0)
+        llegadas = [
+            ("prefetch", PRIORIDAD_PREFETCH),
+            ("generacion-1", PRIORIDAD_GENERACION),
+            ("interactiva", PRIORIDAD_INTERACTIVA),
+            ("generacion-2", PRIORIDAD_GENERACION),
+        ]
+        tareas = []
+        for n, (nombre, prioridad) in enumerate(llegadas, start=1):
+            tareas.append(asyncio.create_task(_ocupar(planificador, orden, nombre, prioridad, ya)))
+            await _hasta_encolar(planificador, n)
+
+        liberar.set()
+        await asyncio.gather(ocupante, *tareas)
+        return orden, planificador.stats()
+
+    orden, stats = asyncio.run(escenario())
+    assert orden == ["ocupante", "interactiva", "generacion-1", "generacion-2", "prefetch"]
+    assert stats["completed"] == 5
+    assert stats["max_depth_seen"] == 4
+    assert _vacio(stats)
+
+
+def test_cola_llena_rechaza_sin_ocupar_plaza():
+    async def escenario():
+        planificador = LLMScheduler(max_concurrency=1, max_queue=1)
+        liberar = asyncio.Event()
+        ocupante = asyncio.create_task(_ocupar(planificador, [], "ocupante", PRIORIDAD_GENERACION, liberar))
+        await asyncio.sleep(0)
+        en_cola = asyncio.create_task(_ocupar(planificador, [], "en cola", PRIORIDAD_GENERACION, liberar))
+        await _hasta_encolar(planificador, 1)
+
+        with pytest.raises(ColaLLMLlena):
+            async with planificador.slot(PRIORIDAD_INTERACTIVA):
+                pass
+
+        liberar.set()
+        await asyncio.gather(ocupante, en_cola)
+        return planificador.stats()
+
+    stats = asyncio.run(escenario())
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 2
+    assert _vacio(stats)
+
+
+def test_cancelar_en_cola_libera_su_puesto():
+    async def escenario():
+        planificador = LLMScheduler(max_concurrency=1, max_queue=10)
+        orden: list = []
+        liberar = asyncio.Event()
+        ocupante = asyncio.create_task(_ocupar(planificador, orden, "ocupante", PRIORIDAD_GENERACION, liberar))
+        await asyncio.sleep(0)
+        cancelada = asyncio.create_task(_ocupar(planificador, orden, "cancelada", PRIORIDAD_INTERACTIVA, liberar))
+        siguiente = asyncio.create_task(_ocupar(planificador, orden, "siguiente", PRIORIDAD_PREFETCH, liberar))
+        await _hasta_encolar(planificador, 2)
+
+        cancelada.cancel()
+        await asyncio.gather(cancelada, return_exceptions=True)
+        profundidad = planificador.queue_depth()
+
+        liberar.set()
+        await asyncio.gather(ocupante, siguiente)
+        return orden, profundidad, planificador.stats()
+
+    orden, profundidad, stats = asyncio.run(escenario())
+    assert profundidad == 1
+    assert orden == ["ocupante", "siguiente"]
+    assert stats["completed"] == 2
+    assert _vacio(stats)
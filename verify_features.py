@@ -1,7 +1,7 @@
 import sys
 import os
 import asyncio
-from app.components.ai.memory import get_narrative_context
+from app.components.ai.memory import get_narrative_context, preparar_contexto
 from app.components.combat.balance import adjust_encounter
 from app.state import journal
 
@@ -17,10 +17,11 @@ async def test_features():
     session_id = "test_session_1"
     
     # Simular eventos
-    journal.register_event(session_id, "start", "La aventura comienza en una taberna.")
-    journal.register_event(session_id, "combat", "El grupo derrotó a los goblins.")
-    journal.register_event(session_id, "plot", "El rey ha sido envenenado.")
+    await journal.register_event(session_id, "start", "La aventura comienza en una taberna.")
+    await journal.register_event(session_id, "combat", "El grupo derrotó a los goblins.")
+    await journal.register_event(session_id, "plot", "El rey ha sido envenenado.")
     
+    await preparar_contexto(session_id)
     context = get_narrative_context(session_id)
     print(f"Contexto recuperado:\n{context}")
     